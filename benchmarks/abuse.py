@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Measures what an abusive client does to everyone else: one user loops downloads of a
+backup from many connections while a normal user lists its backups at a steady pace.
+Runs the app with rate limits and bandwidth shaping on and off and reports the normal
+user's latency percentiles and the abuser's throughput and 429 count.
+
+    python -m benchmarks.abuse --seconds 10 --abusers 32 --size-mb 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, Any, List
+
+from loguru import logger
+
+from benchmarks.server import LocalServer
+from benchmarks.transfer import make_file
+from src.api.client import BackupClient
+from src.utils.network import HTTPSession
+from src.utils.codes import RequestMethod, ResMethod, ResponseCode
+from src.utils.os_utils import BYTES_IN_MB
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {
+        "count": len(ordered),
+        "p50_ms": round(statistics.median(ordered) * 1000, 2),
+        "p95_ms": round(pick(0.95) * 1000, 2),
+        "p99_ms": round(pick(0.99) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+
+async def normal_user(client: BackupClient, until: float, pause: float) -> List[float]:
+    latencies = []
+    while time.monotonic() < until:
+        started = time.perf_counter()
+        await client.backups()
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(pause)
+    return latencies
+
+
+async def abuser(session: HTTPSession, url: str, token: str, until: float, stats: Dict[str, int]) -> None:
+    while time.monotonic() < until:
+        result = await session.query(url, RequestMethod.GET, ResMethod.READ, headers={"Authorization": token})
+        if result.code == ResponseCode.TOO_MANY_REQUESTS:
+            stats["rejected"] += 1
+        elif result.is_success():
+            stats["downloads"] += 1
+            stats["bytes"] += len(result.data)
+        else:
+            stats["errors"] += 1
+
+
+async def scenario(base_url: str, seconds: float, abusers: int, source: str) -> Dict[str, Any]:
+    async with BackupClient(base_url) as normal, BackupClient(base_url) as bad:
+        await normal.register(f"normal-{uuid.uuid4().hex[:8]}", "password")
+        await bad.register(f"abuser-{uuid.uuid4().hex[:8]}", "password")
+        backup = await bad.upload(source)
+        quiet = await normal_user(normal, time.monotonic() + seconds / 2, 0.05)
+        stats = {"downloads": 0, "bytes": 0, "rejected": 0, "errors": 0}
+        until = time.monotonic() + seconds
+        url = f"{base_url}/backups/{backup['backup_id']}/download"
+        async with HTTPSession(limit_per_host=abusers) as session:
+            loud, *_ = await asyncio.gather(
+                normal_user(normal, until, 0.05),
+                *(abuser(session, url, bad.token, until, stats) for _ in range(abusers))
+            )
+    return {
+        "normal_user_quiet": percentiles(quiet),
+        "normal_user_under_abuse": percentiles(loud),
+        "abuser": stats | {"mb_per_second": round(stats["bytes"] / BYTES_IN_MB / seconds, 1)},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--abusers", type=int, default=32)
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--download-mb-per-second", type=float, default=16)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source.zip")
+        make_file(source, int(args.size_mb * BYTES_IN_MB))
+        for name, env in (
+                ("unlimited", {"APP_RATE_LIMITS_ENABLED": "0"}),
+                ("limited", {"APP_DOWNLOAD_BYTES_PER_SECOND": str(int(args.download_mb_per_second * BYTES_IN_MB))}),
+        ):
+            with LocalServer(env=env) as server:
+                report[name] = asyncio.run(scenario(server.base_url, args.seconds, args.abusers, source))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Database lookups from coroutines: 'clients' concurrent tasks on one event loop, as in an async
+view, each making requests of 'lookups' independent queries (a user's backups, 'rows' rows,
+on a table of 'users' users). The "sync" path calls the query helpers in the coroutine, the
+way the synchronous code would be called; "executor" awaits them on the DatabaseExecutor
+(asyncio.gather per request) with each of 'threads' database threads. The report has the
+lookups per second, the request latency and the event loop lag: how late a 1 ms timer fires
+while the lookups run, which is how long every other coroutine of the loop is held up.
+
+    python -m benchmarks.async_db --seconds 5 --clients 64 --threads 1 4 8 16
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Callable, Awaitable
+
+TICK = 0.001
+
+
+async def measure_lag(until: float, lags: List[float]) -> None:
+    while time.monotonic() < until:
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def scenario(lookup: Callable[[int], Awaitable[Any]], seconds: float, clients: int, lookups: int,
+                   users: int) -> Dict[str, Any]:
+    from benchmarks.abuse import percentiles
+    latencies: List[float] = []
+    lags: List[float] = []
+    until = time.monotonic() + seconds
+
+    async def client() -> None:
+        while time.monotonic() < until:
+            started = time.perf_counter()
+            await asyncio.gather(*(lookup(random.randint(1, users)) for _ in range(lookups)))
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(measure_lag(until, lags), *(client() for _ in range(clients)))
+    return {
+        "lookups_per_second": round(len(latencies) * lookups / seconds, 1),
+        "requests": percentiles(latencies),
+        "loop_lag": percentiles(lags) | {"max_ms": round(max(lags, default=0.0) * 1000, 2)},
+    }
+
+
+def populate(path: str, users: int, rows: int) -> None:
+    start = datetime(2024, 1, 1)
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        "INSERT INTO users(user_id, login, password_hash, joined) VALUES (?, ?, ?, ?)",
+        ((user_id, f"user-{user_id}", b"-", start.isoformat(" ")) for user_id in range(1, users + 1))
+    )
+    connection.executemany(
+        "INSERT INTO backups(user_id, created, comment, checksum, size, corrupted) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (user_id, (start + timedelta(minutes=index)).isoformat(" "), f"backup {index}", "%064x" % index, 1 << 20,
+             False)
+            for user_id in range(1, users + 1) for index in range(rows)
+        )
+    )
+    connection.commit()
+    connection.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--lookups", type=int, default=4, help="queries per request, awaited together")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rows", type=int, default=20, help="backups per user, all returned by a lookup")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, path in (("APP_DATABASE_PATH", "app.sqlite"), ("APP_BACKUPS_PATH", "backups"),
+                           ("APP_CACHE_DIR", "cache"), ("APP_RUNTIME_DIR", "run")):
+            os.environ[name] = os.path.join(directory, path)
+        from loguru import logger
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+        from src import app, db
+        from src.core.database import queries
+        from src.core.database.executor import DatabaseExecutor
+
+        with app.app_context():
+            db.create_all()
+        populate(os.environ["APP_DATABASE_PATH"], args.users, args.rows)
+
+        def user_backups(user_id: int) -> List[queries.BackupRow]:
+            return queries.user_backups(db.session, user_id, args.rows)
+
+        async def sync_lookup(user_id: int) -> List[queries.BackupRow]:
+            try:
+                return user_backups(user_id)
+            finally:
+                db.session.remove()
+
+        report: Dict[str, Any] = {
+            "clients": args.clients, "lookups": args.lookups, "users": args.users, "rows": args.rows, "results": {}
+        }
+        with app.app_context():
+            report["results"]["sync"] = asyncio.run(
+                scenario(sync_lookup, args.seconds, args.clients, args.lookups, args.users)
+            )
+        for threads in args.threads:
+            executor = DatabaseExecutor(app, threads)
+            report["results"][f"executor_{threads}"] = asyncio.run(scenario(
+                lambda user_id: executor.run(user_backups, user_id), args.seconds, args.clients, args.lookups,
+                args.users
+            ))
+            executor.shutdown()
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Concurrent large downloads by DOWNLOAD_DELIVERY_MODE: throughput, time to first byte and
+how long each download holds a server worker, plus the CPU time the server spent (Linux).
+The proxy modes (x-accel, x-sendfile) are measured without a proxy: the app only answers
+the headers, which is the worker time a fronting nginx/Apache leaves to the app.
+
+    python -m benchmarks.delivery --size-mb 256 --concurrency 8 --mode stream sendfile x-accel
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, Any, List, Optional
+
+import aiohttp
+from loguru import logger
+
+from benchmarks.abuse import percentiles
+from benchmarks.server import LocalServer
+from benchmarks.transfer import make_file
+from src.api.client import BackupClient
+from src.core.delivery import MODES, X_ACCEL, X_SENDFILE
+from src.utils.os_utils import BYTES_IN_MB
+
+READ_SIZE = 4 * BYTES_IN_MB
+
+
+def cpu_seconds(pid: int) -> Optional[float]:
+    """ User + system CPU time of a process from /proc, None where there is no /proc. """
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            fields = file.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def download(session: aiohttp.ClientSession, url: str, token: str) -> Dict[str, float]:
+    started = time.perf_counter()
+    async with session.get(url, headers={"Authorization": token}) as response:
+        first_byte = time.perf_counter() - started
+        if response.status != 200:
+            raise RuntimeError(f"Download answered {response.status}")
+        received = 0
+        async for block in response.content.iter_chunked(READ_SIZE):
+            received += len(block)
+        proxied = X_ACCEL if "X-Accel-Redirect" in response.headers \
+            else X_SENDFILE if "X-Sendfile" in response.headers else None
+    return {"seconds": time.perf_counter() - started, "first_byte": first_byte, "bytes": received, "proxied": proxied}
+
+
+async def run_mode(server: LocalServer, source: str, concurrency: int, rounds: int) -> Dict[str, Any]:
+    async with BackupClient(server.base_url) as client:
+        await client.register(f"bench-{uuid.uuid4().hex[:12]}", "password")
+        backup = await client.upload(source, "delivery")
+        url = f"{server.base_url}/backups/{backup['backup_id']}/download"
+        results: List[Dict[str, float]] = []
+        cpu_before = cpu_seconds(server.process.pid)
+        started = time.perf_counter()
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None)) as session:
+            for _ in range(rounds):
+                results += await asyncio.gather(*(download(session, url, client.token) for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+        cpu_after = cpu_seconds(server.process.pid)
+        await client.delete(backup["backup_id"])
+    moved = sum(result["bytes"] for result in results)
+    worker_seconds = sum(result["seconds"] for result in results)
+    return {
+        "downloads": len(results),
+        "proxied": results[0]["proxied"],
+        "wall_seconds": round(wall, 3),
+        "mb_per_second": round(moved / BYTES_IN_MB / wall, 1),
+        "seconds": percentiles([result["seconds"] for result in results]),
+        "first_byte_seconds": percentiles([result["first_byte"] for result in results]),
+        # A download holds a server worker from the request to its last byte.
+        "worker_seconds": round(worker_seconds, 3),
+        "worker_seconds_per_download": round(worker_seconds / len(results), 4),
+        "server_cpu_seconds": round(cpu_after - cpu_before, 3) if cpu_before is not None else None,
+        "server_cpu_seconds_per_gb": round((cpu_after - cpu_before) / (moved / 1024 / BYTES_IN_MB), 3)
+        if cpu_before is not None and moved else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=256)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--mode", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    report = {"size_mb": args.size_mb, "concurrency": args.concurrency, "rounds": args.rounds, "modes": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source.zip")
+        make_file(source, int(args.size_mb * BYTES_IN_MB))
+        for mode in args.mode:
+            env = {
+                "APP_DOWNLOAD_DELIVERY_MODE": mode,
+                "APP_RATE_LIMITS_ENABLED": "0",
+                "APP_UPLOAD_BYTES_PER_SECOND": "0",
+                "APP_DOWNLOAD_BYTES_PER_SECOND": "0",
+                "APP_PROFILE_SLOW_THRESHOLD": "0",
+                "APP_QUOTA_MAX_BYTES": str(int(args.size_mb * BYTES_IN_MB) * 2),
+            }
+            with LocalServer(env=env) as server:
+                report["modes"][mode] = asyncio.run(run_mode(server, source, args.concurrency, args.rounds))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
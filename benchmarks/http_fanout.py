@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Compares a sequential 'HTTPSession.get_result' loop with 'HTTPSession.query_many'
+against a local aiohttp server running in a separate process.
+
+    python -m benchmarks.http_fanout --requests 2000 --latency 0.005 --fail-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import sys
+import time
+from typing import Dict, Any
+
+from aiohttp import web
+from loguru import logger
+
+from benchmarks.server import free_port
+from src.utils.network import HTTPSession, QueryRequest, RetryPolicy, ResponseCode
+
+
+def serve(port: int, latency: float, fail_rate: float) -> None:
+    async def handler(request: web.Request) -> web.Response:
+        await asyncio.sleep(latency)
+        if random.random() < fail_rate:
+            return web.Response(status=ResponseCode.SERVICE_UNAVAILABLE.value)
+        return web.json_response({"path": request.path})
+
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    web.run_app(app, host="127.0.0.1", port=port, print=None, access_log=None)
+
+
+async def wait_ready(url: str) -> None:
+    async with HTTPSession() as session:
+        for _ in range(100):
+            if (await session.get_result(url)).code != ResponseCode.ERROR_OCCURRED_CODE:
+                return
+            await asyncio.sleep(0.05)
+    raise RuntimeError(f"Server {url} did not start")
+
+
+async def run(base_url: str, count: int, concurrency: int) -> Dict[str, Any]:
+    urls = [f"{base_url}/item/{i}" for i in range(count)]
+    async with HTTPSession() as session:
+        started = time.perf_counter()
+        sequential = [await session.get_result(url) for url in urls]
+        sequential_time = time.perf_counter() - started
+
+    async with HTTPSession(limit_per_host=concurrency) as session:
+        started = time.perf_counter()
+        fanned_out = await session.query_many(
+            (QueryRequest(url) for url in urls),
+            concurrency=concurrency,
+            retry=RetryPolicy(attempts=4),
+        )
+        fan_out_time = time.perf_counter() - started
+
+    return {
+        "requests": count,
+        "sequential": {
+            "seconds": round(sequential_time, 3),
+            "rps": round(count / sequential_time, 1),
+            "ok": sum(result.is_success() for result in sequential),
+        },
+        "query_many": {
+            "concurrency": concurrency,
+            "seconds": round(fan_out_time, 3),
+            "rps": round(count / fan_out_time, 1),
+            "ok": sum(result.is_success() for result in fanned_out),
+        },
+        "speedup": round(sequential_time / fan_out_time, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.005, help="server-side delay per request, seconds")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 503")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    port = free_port()
+    server = multiprocessing.Process(target=serve, args=(port, args.latency, args.fail_rate), daemon=True)
+    server.start()
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        asyncio.run(wait_ready(base_url))
+        print(json.dumps(asyncio.run(run(base_url, args.requests, args.concurrency)), indent=2))
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == "__main__":
+    main()
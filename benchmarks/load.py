@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+End-to-end load test: starts the app locally on a temporary database and storage,
+seeds users with backups, then runs concurrent virtual users doing a weighted mix of
+register, login, list, metadata, upload, range download and delete for a fixed time
+(a user at the backups quota deletes instead of uploading, as a real client would).
+Reports throughput and latency percentiles per operation and compares them with the
+stored baseline; exits with 1 when an operation got slower or lost throughput beyond
+the tolerance, or failed more often.
+
+    python -m benchmarks.load --seconds 30 --concurrency 16
+    python -m benchmarks.load --update         # rewrite the baseline from this machine
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, Any, List, Callable, Awaitable, Final
+
+from loguru import logger
+
+from benchmarks.abuse import percentiles
+from benchmarks.server import LocalServer
+from benchmarks.transfer import make_file
+from src.api.client import BackupClient, BackupClientError
+from src.utils.network import HTTPSession, RetryPolicy
+from src.utils.codes import RequestMethod, ResMethod, ResponseCode
+
+BASELINE_PATH: Final[str] = os.path.join(os.path.dirname(__file__), "load_baseline.json")
+PASSWORD: Final[str] = "password"
+# Percentiles and rates of rarer operations are too noisy to compare, only their errors are.
+MIN_SAMPLES: Final[int] = 50
+DEFAULT_MIX: Final[Dict[str, int]] = {
+    "register": 1,
+    "login": 4,
+    "list": 30,
+    "metadata": 30,
+    "upload": 8,
+    "download_range": 20,
+    "delete": 7,
+}
+# The server runs without rate limits and slow-request capture, which would measure themselves,
+# and gives upload tokens, so prechecked uploads are ready at once.
+SERVER_ENV: Final[Dict[str, str]] = {
+    "APP_RATE_LIMITS_ENABLED": "0",
+    "APP_PROFILE_SLOW_THRESHOLD": "0",
+    "APP_UPLOAD_TOKEN_SECRET": uuid.uuid4().hex,
+}
+
+
+class VirtualUser(object):
+    """ One account with the backups it uploaded; a failed operation raises BackupClientError. """
+
+    def __init__(self, base_url: str, session: HTTPSession, username: str) -> None:
+        self.base_url = base_url
+        self.session = session
+        self.username = username
+        self.client = BackupClient(base_url, retry=RetryPolicy(attempts=1), session=session)
+        self.backups: List[Dict[str, Any]] = []
+        self.max_backups = 0  # the server's quota, see 'seed'
+        self.uploading = 0
+
+    @property
+    def full(self) -> bool:
+        """ Whether another upload would be over the backups quota, counting the ones in flight. """
+        return len(self.backups) + self.uploading >= self.max_backups
+
+    async def register(self) -> None:
+        await self.client.register(self.username, PASSWORD)
+
+    async def login(self) -> None:
+        await self.client.login(self.username, PASSWORD)
+
+    async def list(self) -> None:
+        await self.client.backups()
+
+    async def metadata(self, rng: random.Random) -> None:
+        await self.client.backup(rng.choice(self.backups)["backup_id"])
+
+    async def upload(self, rng: random.Random, sources: List[str]) -> None:
+        self.uploading += 1
+        try:
+            self.backups.append(await self.client.upload_single(rng.choice(sources), "load"))
+        finally:
+            self.uploading -= 1
+
+    async def download_range(self, rng: random.Random) -> None:
+        backup = rng.choice(self.backups)
+        start = rng.randrange(backup["size"])
+        end = min(backup["size"], start + rng.randint(1, 1024 * 1024)) - 1
+        result = await self.session.query(
+            f"{self.base_url}/backups/{backup['backup_id']}/download", RequestMethod.GET, ResMethod.READ,
+            headers={"Authorization": self.client.token, "Range": f"bytes={start}-{end}"}
+        )
+        if result.code != ResponseCode.PARTIAL_CONTENT or len(result.data) != end - start + 1:
+            raise BackupClientError("Unexpected range response", result.code)
+
+    async def delete(self, rng: random.Random) -> None:
+        backup = self.backups.pop(rng.randrange(len(self.backups)))
+        await self.client.delete(backup["backup_id"])
+
+
+class Recorder(object):
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    async def run(self, name: str, operation: Callable[[], Awaitable[Any]]) -> None:
+        started = time.perf_counter()
+        try:
+            await operation()
+        except BackupClientError as error:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            logger.debug(f"{name} failed: {error}")
+            return
+        self.latencies.setdefault(name, []).append(time.perf_counter() - started)
+
+    def report(self, seconds: float) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: percentiles(self.latencies.get(name, [])) | {
+                "errors": self.errors.get(name, 0),
+                "ops_per_second": round(len(self.latencies.get(name, [])) / seconds, 2),
+            }
+            for name in sorted(set(self.latencies) | set(self.errors))
+        }
+
+
+async def seed(base_url: str, session: HTTPSession, users: int, backups: int, sources: List[str],
+               rng: random.Random) -> List[VirtualUser]:
+    seeded = [VirtualUser(base_url, session, f"load-{uuid.uuid4().hex[:12]}") for _ in range(users)]
+    await asyncio.gather(*(user.register() for user in seeded))
+    max_backups = (await seeded[0].client.usage())["limits"]["backups"]
+    for user in seeded:
+        user.max_backups = max_backups
+    for user in seeded:
+        for _ in range(backups):
+            await user.upload(rng, sources)
+    return seeded
+
+
+async def virtual_user(user: VirtualUser, base_url: str, session: HTTPSession, mix: Dict[str, int],
+                       sources: List[str], rng: random.Random, recorder: Recorder, until: float) -> None:
+    names, weights = list(mix), list(mix.values())
+    while time.monotonic() < until:
+        name = rng.choices(names, weights)[0]
+        if name in ("metadata", "download_range", "delete") and not user.backups:
+            name = "upload"
+        if name == "delete" and len(user.backups) == 1:
+            name = "metadata"
+        if name == "upload" and user.full:
+            name = "delete" if len(user.backups) > 1 else "list"
+        if name == "register":
+            await recorder.run(name, VirtualUser(base_url, session, f"load-{uuid.uuid4().hex[:12]}").register)
+        elif name == "upload":
+            await recorder.run(name, lambda: user.upload(rng, sources))
+        elif name in ("metadata", "download_range", "delete"):
+            await recorder.run(name, lambda: getattr(user, name)(rng))
+        else:
+            await recorder.run(name, getattr(user, name))
+
+
+async def scenario(base_url: str, args: argparse.Namespace, sources: List[str]) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    async with HTTPSession(limit_per_host=args.concurrency) as session:
+        started = time.perf_counter()
+        users = await seed(base_url, session, args.users, args.backups, sources, rng)
+        seed_seconds = time.perf_counter() - started
+        until = time.monotonic() + args.seconds
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            virtual_user(users[index % len(users)], base_url, session, args.mix, sources,
+                         random.Random(f"{args.seed}-{index}"), recorder, until)
+            for index in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+    operations = recorder.report(elapsed)
+    total = sum(len(samples) for samples in recorder.latencies.values())
+    return {
+        "seed_seconds": round(seed_seconds, 2),
+        "seconds": round(elapsed, 2),
+        "total_ops_per_second": round(total / elapsed, 2),
+        "operations": operations,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    problems = []
+    if baseline.get("config", None) != report["config"]:
+        return ["the baseline was recorded with other settings, run with --update"] if baseline else []
+    for name, result in report["operations"].items():
+        base = baseline["operations"].get(name, None)
+        if base is None:
+            continue
+        if result["errors"] > base["errors"]:
+            problems.append(f"{name}: {result['errors']} errors > baseline {base['errors']}")
+        if min(result.get("count", 0), base.get("count", 0)) < MIN_SAMPLES:
+            continue
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            problems.append(f"{name}: p95 {result['p95_ms']} ms > baseline {base['p95_ms']} ms (+{tolerance:.0%})")
+        if result["ops_per_second"] < base["ops_per_second"] * (1 - tolerance):
+            problems.append(
+                f"{name}: {result['ops_per_second']} ops/s < baseline {base['ops_per_second']} ops/s (-{tolerance:.0%})"
+            )
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--concurrency", type=int, default=16, help="virtual users running at once")
+    parser.add_argument("--users", type=int, default=16, help="seeded users")
+    parser.add_argument("--backups", type=int, default=4, help="seeded backups per user")
+    parser.add_argument("--sizes-kb", type=int, nargs="+", default=[16, 256, 4096], help="upload sizes")
+    parser.add_argument("--mix", type=json.loads, default=DEFAULT_MIX, help="operation weights as JSON")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed change against the baseline")
+    parser.add_argument("--update", action="store_true", help="store this run as the new baseline")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    with tempfile.TemporaryDirectory() as directory:
+        sources = []
+        for size_kb in args.sizes_kb:
+            sources.append(os.path.join(directory, f"{size_kb}kb.zip"))
+            make_file(sources[-1], size_kb * 1024)
+        with LocalServer(env=SERVER_ENV) as server:
+            report = asyncio.run(scenario(server.base_url, args, sources))
+    report["config"] = {
+        key: getattr(args, key) for key in ("concurrency", "users", "backups", "sizes_kb", "mix", "seed")
+    }
+    if args.update:
+        with open(BASELINE_PATH, "w") as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, "r") as file:
+            baseline = json.load(file)
+    problems = compare(report, baseline, args.tolerance)
+    print(json.dumps(report | {"problems": problems}, indent=2))
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Microbenchmarks of the CPU hot paths, each over a parameter sweep:
+  kdf        HashVerifier.generate_hash / verify_data by PBKDF2 iterations
+  jwt        RSACipher.jwt_encode / jwt_decode (RS512) by RSA key size
+  checksum   file_checksum (SHA-256) by file size and buffer size
+  serialize  the BackupProvider.get response (serialize_backup + jsonify) by row count
+  queries    the read helpers of src.core.database.queries against the ORM query in a fresh
+             app context per call that they replaced, by backups per user
+  sealed     storing and reading a backup plain vs sealed (AES-256-GCM) by chunk size and
+             crypto threads, and a 1 MiB range read of a sealed file
+  introspect checking a batch of tokens of different users with a '/users/login' GET each vs
+             one '/users/introspect' call, with and without the verified-token cache, by batch size
+Every case is warmed up, then timed in 'repeat' samples of enough loops to last
+'min_time / repeat' each; the report (JSON) has the per-call mean, median, stdev,
+min and max of the samples and the calls per second.
+
+    python -m benchmarks.micro --suite kdf jwt --output micro.json
+    python -m benchmarks.micro --quick
+"""
+import argparse
+import datetime
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from typing import Dict, Any, List, Callable, Final
+
+SUITES: Final[tuple] = ("kdf", "jwt", "checksum", "serialize", "queries", "sealed", "introspect")
+BackupRow = namedtuple("BackupRow", ("backup_id", "user_id", "login", "comment", "created", "checksum", "size"))
+
+
+def bench(function: Callable[[], Any], min_time: float, repeat: int, warmup: int) -> Dict[str, Any]:
+    for _ in range(warmup):
+        function()
+    # Grow the loops like 'timeit.autorange', then scale them to fill one sample.
+    loops, target = 1, min_time / repeat
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            function()
+        elapsed = time.perf_counter() - started
+        if elapsed >= target / 10 or loops >= 1 << 20:
+            break
+        loops *= 10
+    loops = max(1, round(loops * target / max(elapsed, 1e-9)))
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for _ in range(loops):
+                function()
+            samples.append((time.perf_counter() - started) / loops)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    mean = statistics.fmean(samples)
+    return {
+        "loops": loops,
+        "repeat": repeat,
+        "mean_us": round(mean * 1e6, 3),
+        "median_us": round(statistics.median(samples) * 1e6, 3),
+        "stdev_us": round(statistics.stdev(samples) * 1e6, 3) if len(samples) > 1 else 0.0,
+        "min_us": round(min(samples) * 1e6, 3),
+        "max_us": round(max(samples) * 1e6, 3),
+        "ops_per_second": round(1 / mean, 2),
+    }
+
+
+def kdf_suite(args: argparse.Namespace, directory: str) -> List[Dict[str, Any]]:
+    from src.utils import HashVerifier, HashAlg
+    verifier = HashVerifier.provide()
+    results = []
+    for iterations in args.iterations:
+        verifier.PBKDF2_ITERATIONS = iterations  # instance attribute shadows the class default
+        password_hash = verifier.generate_hash("password", HashAlg.SHA512)
+        for operation, function in (
+                ("generate_hash", lambda: verifier.generate_hash("password", HashAlg.SHA512)),
+                ("verify_data", lambda: verifier.verify_data("password", password_hash, HashAlg.SHA512)),
+        ):
+            results.append({"operation": operation, "iterations": iterations} | bench(function, *args.timing))
+    del verifier.PBKDF2_ITERATIONS
+    return results
+
+
+def jwt_suite(args: argparse.Namespace, directory: str) -> List[Dict[str, Any]]:
+    from Crypto.PublicKey import RSA
+    from jwt import JWT
+    from src.utils import RSACipher
+    from src.utils.keyring import KeyRing, KEY_SUFFIX, key_id
+    results = []
+    for bits in args.key_sizes:
+        keys_dir = os.path.join(directory, f"keys-{bits}")
+        os.makedirs(keys_dir)
+        key = RSA.generate(bits)
+        with open(os.path.join(keys_dir, f"00000000000000-{key_id(key.public_key())}{KEY_SUFFIX}"), "wb") as file:
+            file.write(key.export_key(passphrase=RSACipher.PASSPHRASE, pkcs=8, protection="scryptAndAES256-CBC"))
+        cipher = RSACipher.__new__(RSACipher)
+        cipher.jwt = JWT()
+        cipher.ring = KeyRing(keys_dir, RSACipher.PASSPHRASE, activation_delay=0)
+        cipher.ring.reload()
+        token = cipher.jwt_encode({"user_id": 1})
+        for operation, function in (
+                ("jwt_encode", lambda: cipher.jwt_encode({"user_id": 1})),
+                ("jwt_decode", lambda: cipher.jwt_decode(token)),
+        ):
+            results.append({"operation": operation, "key_bits": bits} | bench(function, *args.timing))
+    return results
+
+
+def checksum_suite(args: argparse.Namespace, directory: str) -> List[Dict[str, Any]]:
+    from src.utils import file_checksum, ChecksumHash, BYTES_IN_MB
+    from benchmarks.transfer import make_file
+    results = []
+    for size_mb in args.file_sizes_mb:
+        path = os.path.join(directory, f"{size_mb}mb.bin")
+        make_file(path, int(size_mb * BYTES_IN_MB))
+        for buffer_kb in args.buffer_sizes_kb:
+            result = bench(lambda: file_checksum(path, ChecksumHash.SHA_256, buffer_kb * 1024), *args.timing)
+            result["mb_per_second"] = round(size_mb * result["ops_per_second"], 1)
+            results.append({"operation": "file_checksum", "file_mb": size_mb, "buffer_kb": buffer_kb} | result)
+        os.remove(path)
+    return results
+
+
+def serialize_suite(args: argparse.Namespace, directory: str) -> List[Dict[str, Any]]:
+    from flask import jsonify
+    from src import app
+    from src.api.routes.common import serialize_backup
+    created = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    results = []
+    for count in args.rows:
+        rows = [
+            BackupRow(index, 1, "username", f"comment {index}", created + datetime.timedelta(seconds=index),
+                      "%064x" % index, 1 << 20)
+            for index in range(count)
+        ]
+        with app.test_request_context():
+            for operation, function in (
+                    ("serialize_backup", lambda: [serialize_backup(row) for row in rows]),
+                    ("jsonify", lambda: jsonify([serialize_backup(row) for row in rows]).get_data()),
+            ):
+                results.append({"operation": operation, "rows": count} | bench(function, *args.timing))
+    return results
+
+
+def queries_suite(args: argparse.Namespace, directory: str) -> List[Dict[str, Any]]:
+    from src import app, db
+    from src.core.database import queries
+    from src.core.database.models import User, Backup
+    created = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    results = []
+    with app.app_context():
+        db.create_all()
+        for count in args.backups_per_user:
+            user = User(login=f"bench-{count}", password_hash=b"x" * 64, joined=created)
+            db.session.add(user)
+            db.session.flush()
+            db.session.add_all(
+                Backup(user_id=user.user_id, created=created, comment="comment", checksum="%064x" % index, size=1 << 20)
+                for index in range(count)
+            )
+            db.session.commit()
+            user_id, backup_id = user.user_id, Backup.query.filter_by(user_id=user.user_id).first().backup_id
+
+            def orm_user() -> None:
+                with app.app_context():
+                    User.query.filter(User.user_id == user_id).first()
+
+            def orm_backup() -> None:
+                with app.app_context():
+                    Backup.query.filter_by(backup_id=backup_id, user_id=user_id).join(User).add_columns(
+                        Backup.backup_id, Backup.user_id, Backup.created, Backup.comment, Backup.checksum,
+                        Backup.size, Backup.corrupted, User.login
+                    ).first()
+
+            def orm_backups() -> None:
+                with app.app_context():
+                    User.query.filter(User.user_id == user_id)\
+                        .join(Backup, Backup.user_id == User.user_id, isouter=True)\
+                        .add_columns(User.user_id, User.login, User.joined, Backup.backup_id, Backup.created,
+                                     Backup.comment, Backup.checksum, Backup.size)\
+                        .limit(count).all()
+
+            for operation, function in (
+                    ("orm_user_by_id", orm_user),
+                    ("user_by_id", lambda: queries.user_by_id(db.session, user_id)),
+                    ("orm_backup_by_id", orm_backup),
+                    ("backup_by_id", lambda: queries.backup_by_id(db.session, backup_id, user_id)),
+                    ("orm_user_backups", orm_backups),
+                    ("user_backups", lambda: queries.user_backups(db.session, user_id, count)),
+            ):
+                results.append({"operation": operation, "backups": count} | bench(function, *args.timing))
+            db.session.rollback()
+    return results
+
+
+def sealed_suite(args: argparse.Namespace, directory: str) -> List[Dict[str, Any]]:
+    import random
+    import shutil
+    from concurrent.futures import ThreadPoolExecutor
+    from src.utils import SealedReader, SealedWriter, BYTES_IN_MB
+    from src.utils.sealed import master_key_id
+    from benchmarks.transfer import make_file
+    master_key = os.urandom(32)
+    keys = {master_key_id(master_key): master_key}.get
+    results = []
+    for size_mb in args.file_sizes_mb:
+        source, target = os.path.join(directory, f"{size_mb}mb.bin"), os.path.join(directory, "stored.bin")
+
+        def store_plain() -> None:
+            with open(source, "rb") as file, open(target, "wb") as out:
+                shutil.copyfileobj(file, out, BYTES_IN_MB)
+
+        def read_plain() -> None:
+            with open(target, "rb") as file:
+                while file.read(BYTES_IN_MB):
+                    pass
+
+        make_file(source, int(size_mb * BYTES_IN_MB))
+        store_plain()
+        for operation, function in (("store_plain", store_plain), ("read_plain", read_plain)):
+            result = bench(function, *args.timing)
+            result["mb_per_second"] = round(size_mb * result["ops_per_second"], 1)
+            results.append({"operation": operation, "file_mb": size_mb} | result)
+        for threads in args.crypto_threads:
+            with ThreadPoolExecutor(threads) as executor:
+                for chunk_kb in args.chunk_sizes_kb:
+                    def store_sealed() -> None:
+                        with open(source, "rb") as file, open(target, "wb") as out:
+                            with SealedWriter(out, master_key, chunk_kb * 1024, executor, threads * 2) as sealed:
+                                shutil.copyfileobj(file, sealed, BYTES_IN_MB)
+
+                    def read_sealed() -> None:
+                        with SealedReader(open(target, "rb"), keys, executor, threads * 2) as file:
+                            while file.read(BYTES_IN_MB):
+                                pass
+
+                    def read_range() -> None:
+                        with SealedReader(open(target, "rb"), keys, executor, threads * 2) as file:
+                            file.seek(random.randrange(max(1, file.size - BYTES_IN_MB)))
+                            remaining = BYTES_IN_MB
+                            while remaining > 0:
+                                block = file.read(remaining)  # up to the end of the current chunk
+                                if not block:
+                                    break
+                                remaining -= len(block)
+
+                    store_sealed()
+                    for operation, function, mb in (("store_sealed", store_sealed, size_mb),
+                                                    ("read_sealed", read_sealed, size_mb),
+                                                    ("read_range_sealed", read_range, 1)):
+                        result = bench(function, *args.timing)
+                        result["mb_per_second"] = round(mb * result["ops_per_second"], 1)
+                        results.append({
+                            "operation": operation, "file_mb": size_mb, "chunk_kb": chunk_kb, "threads": threads
+                        } | result)
+        os.remove(source)
+        os.remove(target)
+    return results
+
+
+def introspect_suite(args: argparse.Namespace, directory: str) -> List[Dict[str, Any]]:
+    from flask_restful import Api
+    from src import app, db
+    from src.api.routes import Login, TokenIntrospection
+    from src.core.database.models import User
+    from src.core.tokens import VerifiedTokens
+    # A local Api: once 'src.api.routes' is loaded (by any suite), 'src.api' is that package, not the Api.
+    api = Api(app, prefix="/api")
+    for resource in (Login, TokenIntrospection):
+        api.add_resource(resource, resource.url)
+    app.config["INTERNAL_API_TOKEN"] = internal = "benchmark"
+    client = app.test_client()
+    created = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    cached = VerifiedTokens.provide()
+    results = []
+    with app.app_context():
+        db.create_all()
+        users = [User(login=f"introspect-{index}", password_hash=b"x" * 64, joined=created)
+                 for index in range(max(args.batch_sizes))]
+        db.session.add_all(users)
+        db.session.commit()
+        tokens = [user.token for user in users]
+
+    def login_gets(batch: List[str]) -> None:
+        for token in batch:
+            assert client.get("/api/users/login", headers={"Authorization": token}).status_code == 200
+
+    def introspect(batch: List[str]) -> None:
+        response = client.post("/api/users/introspect", json={"tokens": batch}, headers={"X-Internal-Token": internal})
+        assert response.status_code == 200 and all(result["active"] for result in response.json["results"])
+
+    for size in args.batch_sizes:
+        batch = tokens[:size]
+        for cache, instance in (("cached", cached), ("uncached", VerifiedTokens(0))):
+            VerifiedTokens.instance = instance
+            for operation, function in (("login_get", lambda: login_gets(batch)),
+                                        ("introspect", lambda: introspect(batch))):
+                result = bench(function, *args.timing)
+                result["per_token_us"] = round(result["mean_us"] / size, 3)
+                results.append({"operation": operation, "tokens": size, "token_cache": cache} | result)
+    VerifiedTokens.instance = cached
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--suite", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--iterations", type=int, nargs="+", default=[5_000, 10_000, 20_000, 50_000, 100_000])
+    parser.add_argument("--key-sizes", type=int, nargs="+", default=[2048, 3072, 4096])
+    parser.add_argument("--file-sizes-mb", type=float, nargs="+", default=[1, 16, 128])
+    parser.add_argument("--buffer-sizes-kb", type=int, nargs="+", default=[64, 256, 1024, 4096])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1_000, 10_000])
+    parser.add_argument("--backups-per-user", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--chunk-sizes-kb", type=int, nargs="+", default=[64, 256, 1024])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--crypto-threads", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument("--min-time", type=float, default=2.0, help="seconds of samples per case")
+    parser.add_argument("--repeat", type=int, default=7, help="samples per case")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed calls per case")
+    parser.add_argument("--quick", action="store_true", help="a short run with the smaller parameters")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    if args.quick:
+        args.min_time, args.repeat, args.warmup = 0.3, 3, 1
+        args.iterations, args.key_sizes, args.file_sizes_mb = [20_000], [3072], [16]
+        args.buffer_sizes_kb, args.rows, args.chunk_sizes_kb = [256, 1024], [10, 1_000], [256]
+        args.backups_per_user, args.batch_sizes = [10], [1, 100]
+    args.timing = (args.min_time, args.repeat, args.warmup)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The app is imported on a throwaway database, cache and runtime directory.
+        for name, path in (("APP_DATABASE_PATH", "app.sqlite"), ("APP_BACKUPS_PATH", "backups"),
+                           ("APP_CACHE_DIR", "cache"), ("APP_RUNTIME_DIR", "run")):
+            os.environ.setdefault(name, os.path.join(directory, path))
+        from loguru import logger
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+        suites = {"kdf": kdf_suite, "jwt": jwt_suite, "checksum": checksum_suite, "serialize": serialize_suite,
+                  "queries": queries_suite, "sealed": sealed_suite, "introspect": introspect_suite}
+        report = {
+            "python": sys.version.split()[0],
+            "platform": sys.platform,
+            "cpu_count": os.cpu_count(),
+            "settings": {"min_time": args.min_time, "repeat": args.repeat, "warmup": args.warmup},
+            "results": {name: suites[name](args, directory) for name in args.suite},
+        }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
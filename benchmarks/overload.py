@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Upload throughput under overload: 'uploaders' clients (one user each) loop single-request
+uploads of a 'size-mb' backup, deleting each one after it's stored, far beyond what the
+server can take at once. Runs the app with admission control on and off and reports the
+goodput (MB/s of stored backups), the latency of completed uploads, and the refusals
+(503/507, retried after their Retry-After; bodies are sent behind 'Expect: 100-continue',
+so a refusal costs no transfer) and errors.
+
+    python -m benchmarks.overload --seconds 15 --uploaders 48 --size-mb 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, Any, List
+
+from aiohttp import FormData
+from loguru import logger
+
+from benchmarks.abuse import percentiles
+from benchmarks.server import LocalServer
+from benchmarks.transfer import make_file
+from src.api.client import BackupClient
+from src.utils.network import HTTPSession
+from src.utils.codes import RequestMethod, ResMethod, ResponseCode, ContentType
+from src.utils.os_utils import BYTES_IN_MB
+
+REFUSED: frozenset = frozenset({ResponseCode.SERVICE_UNAVAILABLE, ResponseCode.INSUFFICIENT_STORAGE})
+
+
+async def uploader(client: BackupClient, source: str, until: float, latencies: List[float],
+                   stats: Dict[str, int]) -> None:
+    session, base_url = client.session, client.base_url
+    while time.monotonic() < until:
+        started = time.perf_counter()
+        with open(source, "rb") as file:
+            form = FormData()
+            form.add_field("file", file, filename="source.zip", content_type=ContentType.APPLICATION_ZIP)
+            result = await session.query(f"{base_url}/backups", RequestMethod.POST, ResMethod.JSON, data=form,
+                                         headers={"Authorization": client.token}, expect100=True)
+        if result.is_success():
+            latencies.append(time.perf_counter() - started)
+            stats["uploads"] += 1
+            await client.delete(result.data["backup_id"])
+        elif result.code in REFUSED:
+            stats["refused"] += 1
+            retry_after = result.response.headers.get("Retry-After", "1") if result.response else "1"
+            await asyncio.sleep(min(float(retry_after), max(0.0, until - time.monotonic())))
+        else:
+            stats["errors"] += 1
+
+
+async def scenario(base_url: str, seconds: float, uploaders: int, source: str, size: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    stats = {"uploads": 0, "refused": 0, "errors": 0}
+    async with HTTPSession(limit_per_host=uploaders) as session:
+        clients = [BackupClient(base_url, session=session) for _ in range(uploaders)]
+        for client in clients:
+            await client.register(f"uploader-{uuid.uuid4().hex[:8]}", "password")
+        until = time.monotonic() + seconds
+        await asyncio.gather(*(uploader(client, source, until, latencies, stats) for client in clients))
+    return {
+        "goodput_mb_per_second": round(stats["uploads"] * size / BYTES_IN_MB / seconds, 1),
+        "completed": percentiles(latencies),
+    } | stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--uploaders", type=int, default=48)
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--max-uploads", type=int, default=8, help="ADMISSION_MAX_UPLOADS of the admitted run")
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    size = int(args.size_mb * BYTES_IN_MB)
+    common = {
+        "APP_RATE_LIMITS_ENABLED": "0", "APP_QUOTA_MAX_BACKUPS": str(1 << 20), "APP_QUOTA_MAX_BYTES": str(1 << 50),
+    }
+    report: Dict[str, Any] = {"uploaders": args.uploaders, "size_mb": args.size_mb}
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source.zip")
+        make_file(source, size)
+        for name, env in (
+                ("unlimited", {"APP_ADMISSION_ENABLED": "0"}),
+                ("admitted", {"APP_ADMISSION_MAX_UPLOADS": str(args.max_uploads)}),
+        ):
+            with LocalServer(env=common | env) as server:
+                report[name] = asyncio.run(scenario(server.base_url, args.seconds, args.uploaders, source, size))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
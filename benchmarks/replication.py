@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Starts a primary and a replica instance on two local ports, uploads backups to the
+primary and checks that they reach the replica intact, that downloads can be
+redirected to the replica and that deletes propagate. Reports replication lag.
+
+    python -m benchmarks.replication --backups 5 --size-mb 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, Any
+
+from loguru import logger
+
+from benchmarks.server import LocalServer
+from benchmarks.transfer import make_file
+from src.api.client import BackupClient, BackupClientError
+from src.utils import ResponseCode, ChecksumHash, file_checksum, BYTES_IN_MB
+
+INTERNAL_TOKEN = uuid.uuid4().hex
+
+
+async def wait_replicated(replica: BackupClient, backup_id: int, checksum: str, timeout: float) -> float:
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            if (await replica.backup(backup_id))["checksum"] == checksum:
+                return time.perf_counter() - started
+        except BackupClientError:
+            pass
+        await asyncio.sleep(0.02)
+    raise TimeoutError(f"Backup {backup_id} was not replicated in {timeout} s")
+
+
+async def wait_deleted(replica: BackupClient, backup_id: int, timeout: float) -> None:
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            await replica.backup(backup_id)
+        except BackupClientError as error:
+            if error.code == ResponseCode.NOT_FOUND:
+                return
+        await asyncio.sleep(0.05)
+    raise TimeoutError(f"Delete of backup {backup_id} was not replicated in {timeout} s")
+
+
+async def run(primary_url: str, replica_url: str, backups: int, size: int, directory: str) -> Dict[str, Any]:
+    async with BackupClient(primary_url) as primary, BackupClient(replica_url) as replica:
+        await primary.register(f"replica-{uuid.uuid4().hex[:10]}", "password")
+        replica.token = primary.token
+        lags, uploaded = [], []
+        for index in range(backups):
+            source = os.path.join(directory, f"source-{index}.zip")
+            make_file(source, size)
+            backup = await primary.upload(source, f"backup {index}")
+            lags.append(await wait_replicated(replica, backup["backup_id"], backup["checksum"], timeout=60))
+            uploaded.append(backup)
+        redirected = 0
+        for backup in uploaded:
+            destination = os.path.join(directory, f"download-{backup['backup_id']}.zip")
+            await primary.download(backup["backup_id"], destination)
+            assert file_checksum(destination, ChecksumHash.SHA_256) == backup["checksum"]
+            result = await primary.session.get_result(
+                f"{primary_url}/backups/{backup['backup_id']}/download",
+                headers={"Authorization": primary.token, "Range": "bytes=0-0"},
+                allow_redirects=False
+            )
+            redirected += result.code == ResponseCode.TEMPORARY_REDIRECT
+        for backup in uploaded:
+            await primary.delete(backup["backup_id"])
+            await wait_deleted(replica, backup["backup_id"], timeout=60)
+    return {
+        "backups": backups,
+        "size_mb": round(size / BYTES_IN_MB, 1),
+        "replication_lag_seconds": {
+            "mean": round(statistics.mean(lags), 3),
+            "max": round(max(lags), 3),
+        },
+        "downloads_redirected_to_replica": redirected,
+        "deletes_replicated": len(uploaded),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backups", type=int, default=5)
+    parser.add_argument("--size-mb", type=float, default=8)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    common = {"APP_INTERNAL_API_TOKEN": INTERNAL_TOKEN}
+    with LocalServer(env=common) as replica, \
+            LocalServer(env=common | {
+                "APP_REPLICATION_PEERS": replica.base_url,
+                "APP_REPLICATION_READ_MODE": "redirect",
+            }) as primary, \
+            tempfile.TemporaryDirectory() as directory:
+        report = asyncio.run(run(primary.base_url, replica.base_url, args.backups, int(args.size_mb * BYTES_IN_MB), directory))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Latency of '/backups/search' on a large backups table: 'rows' backups with generated
+comments, half of them ('--heavy-share') owned by one user, the rest spread over 'users'.
+Every case runs for the heavy user and for a typical one, through the test client (auth,
+parsing, query and JSON) after a warm-up, and walks 'pages' pages by cursor; the report has
+the latency percentiles per case and the query plan of each query shape.
+
+    python -m benchmarks.search --rows 1000000 --users 1000 --output search.json
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, Iterator, Tuple
+
+RARE_WORDS = 5000
+COMMON_WORDS = ("nightly", "weekly", "database", "photos", "project")
+START = datetime(2020, 1, 1)
+
+
+def generate(rows: int, users: int, heavy_share: float, seed: int) -> Iterator[Tuple]:
+    """ (user_id, created, comment, checksum, size, corrupted) in creation order; user 1 is the heavy one. """
+    rng = random.Random(seed)
+    step = timedelta(days=4 * 365) / rows
+    for index in range(rows):
+        user_id = 1 if rng.random() < heavy_share else rng.randint(2, users + 1)
+        # One or two common words, so the two-word case matches about 1 row in 20.
+        words = [f"w{rng.randrange(RARE_WORDS)}" for _ in range(3)] + rng.sample(COMMON_WORDS, rng.randint(1, 2))
+        yield (
+            user_id, (START + step * index).isoformat(" "), " ".join(words), "%064x" % index,
+            rng.randint(1, 1 << 30), False
+        )
+
+
+def populate(path: str, rows: int, users: int, heavy_share: float, seed: int) -> float:
+    """ Bulk loads through sqlite3 (the triggers fill the full-text index); returns the seconds taken. """
+    started = time.perf_counter()
+    connection = sqlite3.connect(path)
+    connection.executemany(
+        "INSERT INTO users(user_id, login, password_hash, joined) VALUES (?, ?, ?, ?)",
+        ((user_id, f"user-{user_id}", b"-", START.isoformat(" ")) for user_id in range(1, users + 2))
+    )
+    connection.executemany(
+        "INSERT INTO backups(user_id, created, comment, checksum, size, corrupted) VALUES (?, ?, ?, ?, ?, ?)",
+        generate(rows, users, heavy_share, seed)
+    )
+    connection.commit()
+    connection.execute("ANALYZE")
+    connection.close()
+    return time.perf_counter() - started
+
+
+def cases(typical_user: int) -> Dict[str, Tuple[int, Dict[str, Any]]]:
+    middle = START + timedelta(days=2 * 365)
+    filters = {
+        "latest": {},
+        "month": {"created_from": middle.isoformat(), "created_to": (middle + timedelta(days=30)).isoformat()},
+        "size_range": {"size_min": 1 << 20, "size_max": 1 << 24},
+        "common_word": {"q": "nightly"},
+        "rare_word": {"q": "w17"},
+        "two_rare_words": {"q": "w17 w18"},
+        "two_common_words": {"q": "nightly photos"},
+        "prefix": {"q": "w12*"},
+        "word_and_month": {"q": "database", "created_from": middle.isoformat(),
+                           "created_to": (middle + timedelta(days=30)).isoformat()},
+        "word_and_size": {"q": "weekly", "size_max": 1 << 24},
+    }
+    ret = {}
+    for user, user_id in (("heavy", 1), ("typical", typical_user)):
+        for name, params in filters.items():
+            ret[f"{user}/{name}"] = (user_id, params)
+    return ret
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--heavy-share", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=50, help="timed requests per case")
+    parser.add_argument("--pages", type=int, default=5, help="pages walked by cursor per request")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, path in (("APP_DATABASE_PATH", "app.sqlite"), ("APP_BACKUPS_PATH", "backups"),
+                           ("APP_CACHE_DIR", "cache"), ("APP_RUNTIME_DIR", "run")):
+            os.environ[name] = os.path.join(directory, path)
+        os.environ["APP_RATE_LIMITS_ENABLED"] = "0"
+        from loguru import logger
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+        from sqlalchemy.dialects import sqlite
+        # The app reads its paths at import, and 'src.api' is the Api until the package of that name loads.
+        from src import app, api, db
+        from benchmarks.abuse import percentiles
+        from src.api.routes import BackupSearch
+        from src.core.database import queries
+        from src.utils import RSACipher
+
+        api.add_resource(BackupSearch, BackupSearch.url)
+        with app.app_context():
+            db.create_all()
+        load_seconds = populate(os.environ["APP_DATABASE_PATH"], args.rows, args.users, args.heavy_share, args.seed)
+        client = app.test_client()
+        tokens = {}
+        report: Dict[str, Any] = {
+            "rows": args.rows, "users": args.users, "heavy_share": args.heavy_share, "limit": args.limit,
+            "pages": args.pages, "load_seconds": round(load_seconds, 1),
+            "database_mb": round(os.path.getsize(os.environ["APP_DATABASE_PATH"]) / (1 << 20), 1),
+            "cases": {}, "plans": {},
+        }
+        for name, (user_id, params) in cases(args.users // 2 + 2).items():
+            token = tokens.setdefault(user_id, RSACipher.provide().jwt_encode({"user_id": user_id}))
+            first_page, pages, found = [], [], 0
+            for attempt in range(args.repeat + 1):
+                cursor = None
+                for page in range(args.pages):
+                    query = params | {"limit": args.limit} | ({"cursor": cursor} if cursor else {})
+                    started = time.perf_counter()
+                    response = client.get("/api/backups/search", headers={"Authorization": token}, query_string=query)
+                    elapsed = time.perf_counter() - started
+                    if response.status_code != 200:
+                        raise RuntimeError(f"{name}: {response.status_code} {response.json}")
+                    if attempt:  # the first walk warms the page cache
+                        (first_page if page == 0 else pages).append(elapsed)
+                        found += len(response.json["backups"]) if attempt == 1 else 0
+                    cursor = response.json["next_cursor"]
+                    if cursor is None:
+                        break
+            report["cases"][name] = {
+                "params": params, "found": found,
+                "first_page": percentiles(first_page), "next_pages": percentiles(pages),
+            }
+            shape = name.split("/")[1]
+            if shape not in report["plans"]:
+                with app.app_context():
+                    search = queries.SearchFilter(
+                        params.get("q"),
+                        datetime.fromisoformat(params["created_from"]) if "created_from" in params else None,
+                        datetime.fromisoformat(params["created_to"]) if "created_to" in params else None,
+                        params.get("size_min"), params.get("size_max"),
+                    )
+                    statement = queries.search_statement(user_id, search, None, args.limit)
+                    compiled = statement.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True})
+                    plan = db.session.execute(db.text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+                    report["plans"][shape] = [row[-1] for row in plan]
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional, Dict, Final
+
+ROOT_DIR: Final[str] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class LocalServer(object):
+    """
+    Runs 'main.py' in a subprocess on a free port with its own temporary SQLite
+    database, cache and backups directory. Extra 'APP_*' settings go in 'env'.
+    """
+    START_TIMEOUT: Final[float] = 30.0
+
+    def __init__(self, port: Optional[int] = None, env: Optional[Dict[str, str]] = None, keep: bool = False) -> None:
+        self.port = port or free_port()
+        self.env = env or {}
+        self.keep = keep
+        self.directory: Optional[str] = None
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/api"
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.directory, "server.log")
+
+    def start(self) -> "LocalServer":
+        self.directory = tempfile.mkdtemp(prefix=f"app-{self.port}-")
+        env = os.environ | {
+            "APP_PORT": str(self.port),
+            "APP_HOST": "127.0.0.1",
+            "APP_TESTING": "0",
+            "APP_SQLALCHEMY_ECHO": "0",
+            "APP_DATABASE_PATH": os.path.join(self.directory, "app.sqlite"),
+            "APP_BACKUPS_PATH": os.path.join(self.directory, "backups"),
+            "APP_CACHE_DIR": os.path.join(self.directory, "cache"),
+            "APP_RUNTIME_DIR": os.path.join(self.directory, "run"),
+        } | self.env
+        log = open(self.log_path, "wb")
+        self.process = subprocess.Popen(
+            [sys.executable, "main.py"], cwd=ROOT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        log.close()
+        deadline = time.monotonic() + self.START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}, see {self.log_path}")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.2):
+                    return self
+            except OSError:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f"Server did not start in {self.START_TIMEOUT} s")
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+        if self.directory and not self.keep:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self) -> "LocalServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Measures the cold import time of the entry points in fresh interpreters and checks
+that maintenance entry points don't load the heavy runtime-only dependencies.
+Exits with 1 when an entry point is slower than its budget (plus the tolerance)
+or loads a forbidden module.
+
+    python -m benchmarks.startup --runs 7
+    python -m benchmarks.startup --update      # rewrite the budget from this machine
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, Any, List, Tuple, Final
+
+BUDGET_PATH: Final[str] = os.path.join(os.path.dirname(__file__), "startup_budget.json")
+ROOT: Final[str] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINTS: Final[Tuple[str, ...]] = (
+    "main",
+    "src.core.database.create",
+    "src.core.database.drop",
+    "src.core.database.models",
+)
+# Entry points that must not pay for HTTP, crypto or alembic.
+FORBIDDEN: Final[Dict[str, Tuple[str, ...]]] = {
+    "src.core.database.create": ("aiohttp", "Crypto", "jwt", "dateutil", "alembic"),
+    "src.core.database.drop": ("aiohttp", "Crypto", "jwt", "dateutil", "alembic"),
+    "src.core.database.models": ("aiohttp", "Crypto", "jwt", "dateutil", "alembic"),
+    "main": ("aiohttp", "alembic"),
+}
+PROBE: Final[str] = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"ms": elapsed * 1000, "modules": sorted(m.split(".")[0] for m in sys.modules)}}))
+"""
+
+
+def probe(module: str, env: Dict[str, str]) -> Dict[str, Any]:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module)],
+        cwd=ROOT, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(runs: int) -> Dict[str, Dict[str, Any]]:
+    with tempfile.TemporaryDirectory() as directory:
+        env = os.environ | {
+            "PYTHONPATH": ROOT,
+            "APP_DATABASE_PATH": os.path.join(directory, "app.sqlite"),
+            "APP_BACKUPS_PATH": os.path.join(directory, "downloads"),
+            "APP_CACHE_DIR": os.path.join(directory, "cache"),
+            "APP_PROFILE_STARTUP": "0",
+        }
+        results = {}
+        for module in ENTRY_POINTS:
+            probe(module, env)  # warm the bytecode and the page cache
+            samples = [probe(module, env) for _ in range(runs)]
+            loaded = set(samples[-1]["modules"])
+            results[module] = {
+                "median_ms": round(statistics.median(sample["ms"] for sample in samples), 1),
+                "min_ms": round(min(sample["ms"] for sample in samples), 1),
+                "forbidden_loaded": sorted(name for name in FORBIDDEN.get(module, ()) if name in loaded),
+            }
+        return results
+
+
+def check(results: Dict[str, Dict[str, Any]], budget: Dict[str, float], tolerance: float) -> List[str]:
+    problems = []
+    for module, result in results.items():
+        if result["forbidden_loaded"]:
+            problems.append(f"{module} loads {', '.join(result['forbidden_loaded'])}")
+        limit = budget.get(module, None)
+        if limit is not None and result["median_ms"] > limit * (1 + tolerance):
+            problems.append(f"{module}: {result['median_ms']} ms > budget {limit} ms (+{tolerance:.0%})")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown over the budget")
+    parser.add_argument("--update", action="store_true", help="store the measured medians as the new budget")
+    args = parser.parse_args()
+    results = measure(args.runs)
+    if args.update:
+        with open(BUDGET_PATH, "w") as file:
+            json.dump({module: result["median_ms"] for module, result in results.items()}, file, indent=2)
+            file.write("\n")
+    budget = {}
+    if os.path.exists(BUDGET_PATH):
+        with open(BUDGET_PATH, "r") as file:
+            budget = json.load(file)
+    problems = check(results, budget, args.tolerance)
+    print(json.dumps({"results": results, "budget": budget, "problems": problems}, indent=2))
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""
+Starts the app locally and compares single-stream transfers with the parallel
+chunked upload / segmented download of 'BackupClient'.
+
+    python -m benchmarks.transfer --size-mb 64 --parallelism 4 --chunk-mb 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, Any
+
+from loguru import logger
+
+from benchmarks.server import LocalServer
+from src.api.client import BackupClient
+from src.utils.os_utils import BYTES_IN_MB
+
+
+def make_file(path: str, size: int) -> None:
+    with open(path, "wb") as file:
+        for _ in range(size // BYTES_IN_MB):
+            file.write(os.urandom(BYTES_IN_MB))
+        file.write(os.urandom(size % BYTES_IN_MB))
+
+
+async def timed(coro) -> Dict[str, Any]:
+    started = time.perf_counter()
+    await coro
+    return {"seconds": round(time.perf_counter() - started, 3)}
+
+
+async def run(base_url: str, size: int, parallelism: int, chunk_size: int, directory: str) -> Dict[str, Any]:
+    source = os.path.join(directory, "source.zip")
+    make_file(source, size)
+    async with BackupClient(base_url, parallelism=parallelism, chunk_size=chunk_size) as client:
+        await client.register(f"bench-{uuid.uuid4().hex[:12]}", "password")
+        results = {}
+        started = time.perf_counter()
+        single = await client.upload_single(source, "single")
+        results["upload_single"] = {"seconds": round(time.perf_counter() - started, 3)}
+        started = time.perf_counter()
+        chunked = await client.upload(source, "chunked")
+        results["upload_parallel"] = {"seconds": round(time.perf_counter() - started, 3)}
+        results["download_single"] = await timed(
+            client.download_single(chunked["backup_id"], os.path.join(directory, "single.zip"))
+        )
+        results["download_parallel"] = await timed(
+            client.download(chunked["backup_id"], os.path.join(directory, "parallel.zip"))
+        )
+        await client.delete(single["backup_id"])
+        await client.delete(chunked["backup_id"])
+    for result in results.values():
+        result["mb_per_second"] = round(size / BYTES_IN_MB / result["seconds"], 1)
+    return {"size_mb": round(size / BYTES_IN_MB, 1), "parallelism": parallelism, "chunk_size": chunk_size} | results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=64)
+    parser.add_argument("--parallelism", type=int, default=4)
+    parser.add_argument("--chunk-mb", type=float, default=8)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    # Bandwidth shaping off: this compares the transfer protocols, not the limits.
+    unshaped = {"APP_UPLOAD_BYTES_PER_SECOND": "0", "APP_DOWNLOAD_BYTES_PER_SECOND": "0"}
+    with LocalServer(env=unshaped) as server, tempfile.TemporaryDirectory() as directory:
+        report = asyncio.run(run(
+            server.base_url,
+            int(args.size_mb * BYTES_IN_MB),
+            args.parallelism,
+            int(args.chunk_mb * BYTES_IN_MB),
+            directory
+        ))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,76 @@
 #!/flask/bin/python
 # -*- coding: UTF-8 -*-
+import os
 from typing import NoReturn
 
 from src import app, api, config, db
-from src.core.database.models import User, Backup
-from src.api.routes import Login, Register, BackupManager, BackupProvider, DownloadBackup
+from src.core.profiling import startup, RequestProfiler
+from src.core.database.models import User, Backup, UploadSession, UploadChunk, ReplicationTask, RevokedToken, Job, UserUsage
+from src.core.admission import AdmissionController
+from src.core.delivery import SendfileRequestHandler
+from src.core.integrity import Scrubber
+from src.core.jobs import JobQueue
+from src.core import metrics
+from src.core.log_pipeline import LogPipeline
+from src.core.ratelimit import RateLimiter
+from src.core.replication import Replicator
+from src.core.revocation import RevocationList
+from src.utils import RSACipher, HashVerifier
+
+with startup.phase("routes"):
+    from src.api.routes import (
+        Login, Register, Logout, TokenIntrospection, BackupManager, BackupProvider, BackupStatus, BackupExport,
+        BackupSearch, BackupChanges, DownloadBackup, UploadManager, UploadPrecheck, UploadProvider, UploadCommit,
+        ReplicaProvider, MetricsProvider, UsageProvider
+    )
+
+
+def start_background_workers() -> None:
+    if config.TESTING and os.environ.get("WERKZEUG_RUN_MAIN") != "true":
+        return  # the reloader's parent process only watches files and never serves
+    ring = RSACipher.provide().ring
+    ring.grace, ring.activation_delay = config.KEYS_RETIREMENT_GRACE, config.KEYS_ACTIVATION_DELAY
+    ring.start(config.KEYS_RELOAD_INTERVAL)
+    RevocationList.provide().start()
+    JobQueue.provide().start()
+    Replicator.provide().start()
+    Scrubber.provide().start()
 
 
 def main() -> NoReturn:
-    with app.app_context():
+    LogPipeline.provide().init_app()
+    with startup.phase("create_all"), app.app_context():
         db.create_all()
+    with startup.phase("keys"):
+        # Loading the keys and the KDF here keeps the first login from paying for them.
+        RSACipher.provide()
+        HashVerifier.provide()
     api.add_resource(Login, Login.url)
     api.add_resource(Register, Register.url)
+    api.add_resource(Logout, Logout.url)
+    api.add_resource(TokenIntrospection, TokenIntrospection.url)
+    api.add_resource(UsageProvider, UsageProvider.url)
     api.add_resource(BackupManager, BackupManager.url)
     api.add_resource(BackupProvider, BackupProvider.url)
+    api.add_resource(BackupStatus, BackupStatus.url)
+    api.add_resource(BackupExport, BackupExport.url)
+    api.add_resource(BackupSearch, BackupSearch.url)
+    api.add_resource(BackupChanges, BackupChanges.url)
     api.add_resource(DownloadBackup, DownloadBackup.url)
-    app.run(host=config.HOST, port=config.PORT, debug=config.TESTING)
+    api.add_resource(UploadManager, UploadManager.url)
+    api.add_resource(UploadPrecheck, UploadPrecheck.url)
+    api.add_resource(UploadProvider, UploadProvider.url)
+    api.add_resource(UploadCommit, UploadCommit.url)
+    api.add_resource(ReplicaProvider, ReplicaProvider.url)
+    api.add_resource(MetricsProvider, MetricsProvider.url)
+    metrics.init_app(app)
+    RequestProfiler.provide().init_app()
+    RateLimiter.provide().init_app()
+    AdmissionController.provide().init_app()
+    with startup.phase("workers"):
+        start_background_workers()
+    startup.report()
+    app.run(host=config.HOST, port=config.PORT, debug=config.TESTING, request_handler=SendfileRequestHandler)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,55 @@
-from flask import Flask
-from flask_alembic import Alembic
-from flask_caching import Cache
-from flask_migrate import Migrate
-from flask_restful import Api
-from flask_sqlalchemy import SQLAlchemy
+import os
+import sys
+from typing import Any, Optional, Tuple, TYPE_CHECKING
+
+from src.core.profiling import startup
+
+with startup.phase("flask"):
+    from flask import Flask
+    from flask_caching import Cache
+    from flask_restful import Api
+    from flask_sqlalchemy import SQLAlchemy
 
 from src.core.config import Config
 
-app: Flask = Flask(__name__)
-config = Config()
-app.config.from_object(config)
-cache: Cache = Cache(app)
-db: SQLAlchemy = SQLAlchemy(app=app)
-migrate: Migrate = Migrate(app, db, directory=config.SQLALCHEMY_MIGRATE_REPO)
-alembic: Alembic = Alembic(app)
+if TYPE_CHECKING:
+    from flask_alembic import Alembic
+    from flask_migrate import Migrate
+
+with startup.phase("config"):
+    app: Flask = Flask(__name__)
+    config = Config()
+    app.config.from_object(config)
+with startup.phase("cache"):
+    cache: Cache = Cache(app)
+with startup.phase("db"):
+    db: SQLAlchemy = SQLAlchemy(app=app)
 api: Api = Api(app, prefix="/api")
+
+_migrations: Optional[Tuple["Migrate", "Alembic"]] = None
+
+
+def init_migrations() -> Tuple["Migrate", "Alembic"]:
+    """
+    Flask-Migrate and Flask-Alembic pull in alembic, which the server never uses at runtime;
+    they are set up on first access to 'src.migrate' / 'src.alembic' or under the 'flask' CLI.
+    """
+    global _migrations
+    if _migrations is None:
+        from flask_alembic import Alembic
+        from flask_migrate import Migrate
+
+        _migrations = (Migrate(app, db, directory=config.SQLALCHEMY_MIGRATE_REPO), Alembic(app))
+    return _migrations
+
+
+def __getattr__(name: str) -> Any:
+    if name == "migrate":
+        return init_migrations()[0]
+    if name == "alembic":
+        return init_migrations()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if os.path.basename(sys.argv[0]).startswith("flask"):
+    init_migrations()
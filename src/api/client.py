@@ -0,0 +1,370 @@
+import asyncio
+import json
+import os
+from typing import Final, Optional, Dict, Any, List, Iterator, Set
+
+from aiohttp import FormData
+from loguru import logger
+from yarl import URL
+
+from src.utils import (
+    HTTPSession, QueryRequest, RetryPolicy, NetworkResultAsync, RequestMethod, ResMethod, ResponseCode,
+    ContentType, ChecksumHash, file_checksum, BYTES_IN_MB
+)
+
+
+class BackupClientError(Exception):
+
+    def __init__(self, message: str, code: int = ResponseCode.ERROR_OCCURRED_CODE) -> None:
+        super().__init__(f"{message} (code {code})")
+        self.message = message
+        self.code = code
+
+
+class BackupClient(object):
+    """
+    Client for the backup API.
+    'upload' sends a backup as parallel chunks of an upload session and 'download'
+    fetches it as parallel byte ranges into a preallocated file. Both keep a small
+    '<file>.progress.json' next to the local file, so an interrupted transfer
+    continues where it stopped when called again, and both verify the SHA-256
+    checksum of the whole file at the end. Uploads first ask '/backups/precheck', so content
+    the server already stores for the user isn't sent again.
+    """
+    DEFAULT_CHUNK_SIZE: Final[int] = 8 * BYTES_IN_MB
+    DEFAULT_PARALLELISM: Final[int] = 4
+    PART_SUFFIX: Final[str] = ".part"
+    PROGRESS_SUFFIX: Final[str] = ".progress.json"
+    UPLOAD_TOKEN_HEADER: Final[str] = "X-Upload-Token"
+    MAX_REDIRECTS: Final[int] = 5
+    REDIRECT_CODES: Final[frozenset] = frozenset({
+        ResponseCode.MOVED_PERMANENTLY, ResponseCode.FOUND, ResponseCode.SEE_OTHER,
+        ResponseCode.TEMPORARY_REDIRECT, ResponseCode.PERMANENT_REDIRECT,
+    })
+
+    def __init__(
+            self,
+            base_url: str,
+            token: Optional[str] = None,
+            parallelism: int = DEFAULT_PARALLELISM,
+            chunk_size: int = DEFAULT_CHUNK_SIZE,
+            retry: RetryPolicy = RetryPolicy(attempts=5),
+            session: Optional[HTTPSession] = None
+    ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.parallelism = parallelism
+        self.chunk_size = chunk_size
+        self.retry = retry
+        self._session = session
+        self._owns_session = session is None
+
+    async def __aenter__(self) -> "BackupClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    @property
+    def session(self) -> HTTPSession:
+        if self._session is None:
+            self._session = HTTPSession(limit_per_host=max(self.parallelism * 2, HTTPSession.DEFAULT_LIMIT_PER_HOST))
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+        self._session = None
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    def _headers(self, **headers: str) -> Dict[str, str]:
+        if self.token:
+            headers["Authorization"] = self.token
+        return headers
+
+    @staticmethod
+    def _check(result: NetworkResultAsync[Any]) -> Any:
+        if not result.is_success():
+            message = result.data.get("message", result.data) if isinstance(result.data, dict) else result.data
+            raise BackupClientError(str(message or result.error), result.code)
+        return result.data
+
+    async def _call(self, method: RequestMethod, path: str, retry: Optional[RetryPolicy] = None, **kwargs) -> Any:
+        kwargs["headers"] = self._headers(**kwargs.get("headers", {}))
+        request = QueryRequest(self._url(path), method, ResMethod.JSON, kwargs)
+        return self._check(await self.session.query_with_retry(request, retry or self.retry))
+
+    async def register(self, username: str, password: str) -> Dict[str, Any]:
+        ret = await self._call(RequestMethod.POST, "/users/register", data={"username": username, "password": password})
+        self.token = ret["token"]
+        return ret
+
+    async def login(self, username: str, password: str) -> Dict[str, Any]:
+        ret = await self._call(RequestMethod.POST, "/users/login", data={"username": username, "password": password})
+        self.token = ret["token"]
+        return ret
+
+    async def usage(self) -> Dict[str, Any]:
+        return await self._call(RequestMethod.GET, "/users/usage")
+
+    async def backups(self) -> List[Dict[str, Any]]:
+        return await self._call(RequestMethod.GET, "/backups")
+
+    async def changes(self, since: int, wait: float = 0, limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        The changes of the backups after version 'since' (the version in the ETag of '/backups', then the
+        returned 'version'); with 'wait' the server holds an empty answer for up to that many seconds.
+        """
+        params = {"since": str(since), "wait": str(wait)} | ({"limit": str(limit)} if limit else {})
+        return await self._call(RequestMethod.GET, "/backups/changes", params=params)
+
+    async def search(self, cursor: Optional[str] = None, **filters: Any) -> Dict[str, Any]:
+        """
+        A page of '/backups/search' by the filters (q, created_from, created_to, size_min,
+        size_max, limit); pass the returned 'next_cursor' to get the next one.
+        """
+        params = {key: str(value) for key, value in filters.items() if value is not None}
+        if cursor:
+            params["cursor"] = cursor
+        return await self._call(RequestMethod.GET, "/backups/search", params=params)
+
+    async def backup(self, backup_id: int) -> Dict[str, Any]:
+        return await self._call(RequestMethod.GET, f"/backups/{backup_id}")
+
+    async def status(self, backup_id: int) -> Dict[str, Any]:
+        """ The processing state of an upload: "processing", "ready", "failed" or "corrupted". """
+        return await self._call(RequestMethod.GET, f"/backups/{backup_id}/status")
+
+    async def delete(self, backup_id: int) -> Dict[str, Any]:
+        return await self._call(RequestMethod.DELETE, f"/backups/{backup_id}")
+
+    async def precheck(self, checksum: str, size: int, comment: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Announces a backup by its SHA-256 and size. With "deduplicated" the answer is the backup,
+        made from the same content already stored; otherwise it has the "upload_token" to send it (null if the server gives none).
+        """
+        return await self._call(RequestMethod.POST, "/backups/precheck", retry=RetryPolicy(attempts=1), data={
+            "size": str(size),
+            "checksum": checksum,
+            **({"comment": comment} if comment is not None else {}),
+        })
+
+    async def upload_single(self, path: str, comment: Optional[str] = None, precheck: bool = True) -> Dict[str, Any]:
+        """
+        Uploads the file as one multipart stream (the legacy endpoint). With 'precheck' the
+        file is hashed first: content the server already has isn't sent at all, and the rest is
+        sent with its upload token behind 'Expect: 100-continue', so a refusal costs no body and
+        the backup is "ready" at once. Without it, the server answers before hashing the file:
+        the checksum is set once 'status' reports "ready".
+        """
+        headers = {}
+        if precheck:
+            checksum = await asyncio.get_running_loop().run_in_executor(
+                None, file_checksum, path, ChecksumHash.SHA_256
+            )
+            ret = await self.precheck(checksum, os.path.getsize(path), comment)
+            if ret["deduplicated"]:
+                return ret
+            if ret["upload_token"]:
+                headers[self.UPLOAD_TOKEN_HEADER] = ret["upload_token"]
+        with open(path, "rb") as file:
+            form = FormData()
+            form.add_field("file", file, filename=os.path.basename(path), content_type=ContentType.APPLICATION_ZIP)
+            if comment is not None:
+                form.add_field("comment", comment)
+            return await self._call(
+                RequestMethod.POST, "/backups", retry=RetryPolicy(attempts=1), data=form, headers=headers,
+                expect100=precheck
+            )
+
+    async def upload(self, path: str, comment: Optional[str] = None) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        size = os.path.getsize(path)
+        checksum = await loop.run_in_executor(None, file_checksum, path, ChecksumHash.SHA_256)
+        progress_path = path + self.PROGRESS_SUFFIX
+        progress = self._load_progress(progress_path)
+        upload = None
+        if progress.get("checksum", None) == checksum and progress.get("size", None) == size:
+            try:
+                upload = await self._call(RequestMethod.GET, f"/backups/uploads/{progress['upload_id']}")
+            except BackupClientError as error:
+                logger.warning(f"Upload {progress['upload_id']} can't be resumed: {error.message}")
+        if upload is None:
+            ret = await self.precheck(checksum, size, comment)
+            if ret["deduplicated"]:
+                if os.path.exists(progress_path):
+                    os.remove(progress_path)
+                return ret
+            upload = await self._call(RequestMethod.POST, "/backups/uploads", retry=RetryPolicy(attempts=1), data={
+                "size": str(size),
+                "checksum": checksum,
+                "chunk_size": str(self.chunk_size),
+                **({"comment": comment} if comment is not None else {}),
+            })
+            self._save_progress(progress_path, {"upload_id": upload["upload_id"], "size": size, "checksum": checksum})
+        received = set(upload["received"])
+        missing = [index for index in range(upload["chunks"]) if index not in received]
+        results = await self.session.query_many(
+            self._chunk_requests(path, upload, missing),
+            concurrency=self.parallelism,
+            retry=self.retry
+        )
+        for result in results:
+            self._check(result)
+        ret = await self._call(RequestMethod.POST, f"/backups/uploads/{upload['upload_id']}/complete")
+        os.remove(progress_path)
+        return ret
+
+    def _chunk_requests(self, path: str, upload: Dict[str, Any], indexes: List[int]) -> Iterator[QueryRequest]:
+        """ Reads each chunk only when 'query_many' is ready to send it. """
+        size, chunk_size = upload["size"], upload["chunk_size"]
+        url = self._url(f"/backups/uploads/{upload['upload_id']}")
+        with open(path, "rb") as file:
+            for index in indexes:
+                start = index * chunk_size
+                file.seek(start)
+                data = file.read(min(chunk_size, size - start))
+                yield QueryRequest(url, RequestMethod.PUT, ResMethod.JSON, {
+                    "data": data,
+                    "headers": self._headers(**{
+                        "Content-Type": ContentType.APPLICATION_OCTET_STREAM,
+                        "Content-Range": f"bytes {start}-{start + len(data) - 1}/{size}",
+                    }),
+                })
+
+    async def download_single(self, backup_id: int, destination: str) -> str:
+        """ Downloads the file as one stream (no ranges, no resumption). """
+        meta = await self.backup(backup_id)
+        result = await self._fetch(self._url(f"/backups/{backup_id}/download"))
+        with open(destination, "wb") as file:
+            file.write(self._check(result))
+        await self._verify(destination, meta.get("checksum", None))
+        return destination
+
+    async def download(self, backup_id: int, destination: str) -> str:
+        meta = await self.backup(backup_id)
+        size, checksum = meta.get("size", None), meta.get("checksum", None)
+        if size is None:
+            size = await self._probe_size(backup_id)
+        part_path, progress_path = destination + self.PART_SUFFIX, destination + self.PROGRESS_SUFFIX
+        progress = self._load_progress(progress_path)
+        done: Set[int] = set()
+        if os.path.exists(part_path) and progress.get("backup_id", None) == backup_id \
+                and progress.get("size", None) == size and progress.get("checksum", None) == checksum \
+                and progress.get("segment_size", None) == self.chunk_size:
+            done = set(progress["done"])
+        else:
+            with open(part_path, "wb") as file:
+                file.truncate(size)
+        state = {"backup_id": backup_id, "size": size, "checksum": checksum, "segment_size": self.chunk_size}
+        segments = iter([index for index in range(max(1, -(-size // self.chunk_size))) if index not in done])
+        url = self._url(f"/backups/{backup_id}/download")
+
+        with open(part_path, "r+b") as file:
+            async def worker() -> None:
+                for index in segments:
+                    start = index * self.chunk_size
+                    end = min(start + self.chunk_size, size) - 1
+                    result = await self._fetch(url, Range=f"bytes={start}-{end}")
+                    data = self._check(result)
+                    if result.code == ResponseCode.OK and len(data) == size:
+                        start, end = 0, size - 1
+                    elif result.code != ResponseCode.PARTIAL_CONTENT or len(data) != end - start + 1:
+                        raise BackupClientError(f"Unexpected response for bytes {start}-{end}", result.code)
+                    file.seek(start)
+                    file.write(data)
+                    done.add(index)
+                    self._save_progress(progress_path, state | {"done": sorted(done)})
+
+            workers = [asyncio.ensure_future(worker()) for _ in range(self.parallelism)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        await self._verify(part_path, checksum)
+        os.replace(part_path, destination)
+        if os.path.exists(progress_path):
+            os.remove(progress_path)
+        return destination
+
+    async def export(self, destination: str, backup_ids: Optional[List[int]] = None) -> str:
+        """
+        Downloads the backups (all by default) as one tar archive; an interrupted export
+        continues from the bytes already in '<destination>.part'.
+        """
+        part_path, progress_path = destination + self.PART_SUFFIX, destination + self.PROGRESS_SUFFIX
+        ids = ",".join(str(backup_id) for backup_id in sorted(backup_ids)) if backup_ids else ""
+        progress = self._load_progress(progress_path)
+        offset = 0
+        headers = self._headers()
+        if os.path.exists(part_path) and progress.get("ids", None) == ids and progress.get("etag", None):
+            offset = os.path.getsize(part_path)
+            headers |= {"Range": f"bytes={offset}-", "If-Range": progress["etag"]}
+        params = {"ids": ids} if ids else {}
+        async with self.session.get(self._url("/backups/export"), params=params, headers=headers) as response:
+            if response.status == ResponseCode.OK:
+                offset = 0
+            elif response.status == ResponseCode.RANGE_NOT_SATISFIABLE \
+                    and response.headers.get("Content-Range", "") == f"bytes */{offset}":
+                offset = -1  # the part file is already complete
+            elif response.status != ResponseCode.PARTIAL_CONTENT \
+                    or not response.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+                raise BackupClientError(await response.text(), response.status)
+            if offset >= 0:
+                self._save_progress(progress_path, {"ids": ids, "etag": response.headers.get("ETag", None)})
+                with open(part_path, "r+b" if offset else "wb") as file:
+                    file.seek(offset)
+                    file.truncate()
+                    async for block in response.content.iter_chunked(self.chunk_size):
+                        file.write(block)
+        os.replace(part_path, destination)
+        os.remove(progress_path)
+        return destination
+
+    async def _fetch(self, url: str, **headers: str) -> NetworkResultAsync[Any]:
+        """
+        GETs a download, following redirects to replica nodes by hand: aiohttp drops
+        the Authorization header on cross-origin redirects and replicas need it.
+        """
+        for _ in range(self.MAX_REDIRECTS):
+            result = await self.session.query_with_retry(QueryRequest(url, RequestMethod.GET, ResMethod.READ, {
+                "headers": self._headers(**headers),
+                "allow_redirects": False,
+            }), self.retry)
+            if result.code not in self.REDIRECT_CODES or result.response is None:
+                return result
+            url = str(result.url.join(URL(result.headers["Location"])))
+        raise BackupClientError(f"Too many redirects for {url}", ResponseCode.LOOP_DETECTED)
+
+    async def _probe_size(self, backup_id: int) -> int:
+        result = await self._fetch(self._url(f"/backups/{backup_id}/download"), Range="bytes=0-0")
+        self._check(result)
+        if result.code == ResponseCode.PARTIAL_CONTENT:
+            return int(result.headers["Content-Range"].rsplit("/", 1)[1])
+        return len(result.data)
+
+    @staticmethod
+    async def _verify(path: str, checksum: Optional[str]) -> None:
+        if not checksum:
+            return
+        actual = await asyncio.get_running_loop().run_in_executor(None, file_checksum, path, ChecksumHash.SHA_256)
+        if actual != checksum:
+            raise BackupClientError(f"Checksum mismatch for {path}: {actual} != {checksum}")
+
+    @staticmethod
+    def _load_progress(path: str) -> Dict[str, Any]:
+        try:
+            with open(path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _save_progress(path: str, state: Dict[str, Any]) -> None:
+        with open(path + ".tmp", "w") as file:
+            json.dump(state, file)
+        os.replace(path + ".tmp", path)
@@ -1,2 +1,8 @@
-from .auth import Login, Register
-from .backups import BackupManager, BackupProvider, DownloadBackup
+from .auth import Login, Register, Logout, TokenIntrospection
+from .backups import (
+    BackupManager, BackupProvider, BackupStatus, BackupExport, BackupSearch, BackupChanges, DownloadBackup
+)
+from .uploads import UploadManager, UploadPrecheck, UploadProvider, UploadCommit
+from .replication import ReplicaProvider
+from .metrics import MetricsProvider
+from .usage import UsageProvider
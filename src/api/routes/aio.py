@@ -0,0 +1,25 @@
+"""
+The data access helpers of 'common' for async views, under the same names: each call runs the
+synchronous helper (with its memoize cache) on the DatabaseExecutor, so awaiting it doesn't
+block the event loop and independent lookups can be awaited together:
+
+    user, backups = await asyncio.gather(aio.find_user_by_id(user_id), aio.find_user_backups_by_id(user_id, version))
+"""
+from src import db
+from src.api.routes import common
+from src.core.database import queries
+from src.core.database.executor import offloaded
+
+authorized_claims = offloaded(common.authorized_claims)
+authorize = offloaded(common.authorize)
+find_user_by_id = offloaded(common.find_user_by_id)
+find_user_by_login = offloaded(common.find_user_by_login)
+find_backup_by_id = offloaded(common.find_backup_by_id)
+find_user_backups_by_id = offloaded(common.find_user_backups_by_id)
+received_chunks = offloaded(common.received_chunks)
+delete_backup = offloaded(common.delete_backup)
+
+
+@offloaded
+def collection_version(user_id: int) -> int:
+    return queries.collection_version(db.session, user_id)
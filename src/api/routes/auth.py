@@ -1,23 +1,26 @@
-from flask import Response, jsonify
+from flask import Response, jsonify, current_app
 from flask_restful import Resource, reqparse
 
-from src import app, db
-from src.api.routes.common import find_user_by_id, find_user_by_login
+from src import db
+from src.api.routes.common import (
+    authorize, authorized_claims, find_user_by_id, find_user_by_login, is_internal_request, error_response
+)
+from src.core.database import queries
 from src.core.database.models import User, verify_password
-from src.utils import RSACipher, ResponseCode
+from src.core.revocation import RevocationList
+from src.utils import ResponseCode
 
 
 class Login(Resource):
     url = "/users/login"
+    rate_class = {"GET": "read", "POST": "auth"}
 
     def get(self) -> Response:
         parser = reqparse.RequestParser()
         parser.add_argument("Authorization", location="headers", required=True, help="Missing auth token!")
         args = parser.parse_args()
-        token = args["Authorization"]
-        decoded = RSACipher.provide().jwt_decode(token)
-        user_id = decoded.get("user_id", None) if decoded else None
-        if not decoded or not user_id:
+        user_id = authorize(args["Authorization"])
+        if not user_id:
             ret = jsonify({
                 "message": "Invalid auth token!"
             })
@@ -56,6 +59,7 @@ class Login(Resource):
 
 class Register(Resource):
     url = "/users/register"
+    rate_class = "auth"
 
     def post(self) -> Response:
         parser = reqparse.RequestParser()
@@ -71,9 +75,64 @@ class Register(Resource):
             ret.status_code = ResponseCode.CONFLICT.value
             return ret
         user = User.create_user(username, args["password"])
-        with app.app_context():
-            db.session.add(user)
-            db.session.flush()
-            ret = user.serialize() | {"token": user.token}
-            db.session.commit()
+        db.session.add(user)
+        db.session.flush()
+        ret = user.serialize() | {"token": user.token}
+        db.session.commit()
         return jsonify(ret)
+
+
+class Logout(Resource):
+    url = "/users/logout"
+    rate_class = "auth"
+
+    def post(self) -> Response:
+        parser = reqparse.RequestParser()
+        parser.add_argument("Authorization", location="headers", required=True, help="Missing auth token!")
+        args = parser.parse_args()
+        claims = authorized_claims(args["Authorization"])
+        if not claims or not claims.get("user_id", None) or not claims.get("jti", None):
+            ret = jsonify({
+                "message": "Invalid auth token!"
+            })
+            ret.status_code = ResponseCode.UNAUTHORIZED.value
+            return ret
+        RevocationList.provide().revoke(claims)
+        return jsonify({
+            "message": "Logged out!"
+        })
+
+
+class TokenIntrospection(Resource):
+    """
+    Internal (INTERNAL_API_TOKEN_HEADER): checks a batch of user tokens for the other services
+    in one call instead of a '/users/login' GET per token. Answers, in the order of 'tokens',
+    whether each one is active and if so its claims and user. A repeated token is checked once,
+    the signatures of known tokens aren't verified again and the users come from one query.
+    """
+    url = "/users/introspect"
+    rate_class = "read"
+
+    def post(self) -> Response:
+        if not is_internal_request():
+            return error_response("Forbidden!", ResponseCode.FORBIDDEN)
+        parser = reqparse.RequestParser()
+        parser.add_argument("tokens", location="json", type=str, action="append", required=True,
+                            help="'Tokens' is a required field!")
+        args = parser.parse_args()
+        tokens = args["tokens"]
+        if len(tokens) > current_app.config["INTROSPECTION_MAX_TOKENS"]:
+            return error_response(
+                f"At most {current_app.config['INTROSPECTION_MAX_TOKENS']} tokens per call!", ResponseCode.BAD_REQUEST
+            )
+        claims = {token: authorized_claims(token) for token in dict.fromkeys(tokens)}
+        users = queries.users_by_ids(
+            db.session, sorted({found["user_id"] for found in claims.values() if found and found.get("user_id")})
+        )
+        results = {}
+        for token, found in claims.items():
+            user = users.get(found.get("user_id", None), None) if found else None
+            results[token] = ({"active": True, "claims": found} | user.serialize()) if user else {"active": False}
+        return jsonify({
+            "results": [results[token] for token in tokens]
+        })
@@ -1,31 +1,55 @@
 import base64
+import binascii
+import calendar
+import hashlib
+import json
 import os
+from datetime import datetime
 from pathlib import Path
+from typing import Final, List
 
-from flask import Response, jsonify, current_app, send_file, request
+from flask import Response, jsonify, current_app, request, redirect, stream_with_context
 from flask_restful import Resource, reqparse
 from loguru import logger
-from requests_toolbelt import MultipartEncoder
-from werkzeug.datastructures import FileStorage
+from werkzeug.datastructures import FileStorage, ContentRange
 
-from src import db, cache, app
-from src.api.routes.common import find_user_by_id, find_user_backups_by_id, find_backup_by_id, delete_backup
-from src.core.database.models import Backup, BACKUP_PER_PAGE
-from src.utils import ResponseCode, RSACipher, ContentType, Encodings
+from src import db, cache
+from src.api.routes.common import (
+    authorize, error_response, deduplicated_backup, find_user_by_id, find_user_backups_by_id, find_backup_by_id,
+    delete_backup, serialize_backup, wait_for_change
+)
+from src.core.delivery import deliver_file
+from src.core.database import queries
+from src.core.database.models import Backup, BackupChange, Job, ReplicationTask, BACKUP_PER_PAGE
+from src.core.database.queries import BackupRow, SearchFilter, SEARCH_AFTER, match_expression, search_backups
+from src.core.dedupe import find_duplicate, load_upload_token
+from src.core.jobs import JobQueue, enqueue_job, backup_state
+from src.core.profiling import span
+from src.core.quota import QuotaExceeded, check_quota, charge_usage
+from src.core.replication import Replicator, enqueue_replication, pick_replica
+from src.core.storage import backup_path, blob_size, open_blob, write_blob
+from src.utils import ResponseCode, ContentType, ChecksumHash, TarMember, TarStream, get_logger
+
+hot_logger = get_logger(__name__)
+# Content-Length of the form is an upper bound of the file size; this much of it may be the form around it.
+MULTIPART_OVERHEAD: Final[int] = 16 * 1024
+MANIFEST_NAME: Final[str] = "MANIFEST.json"
+SEARCH_MAX_LIMIT: Final[int] = 100
+CHANGES_DEFAULT_LIMIT: Final[int] = 100
+CHANGES_MAX_LIMIT: Final[int] = 1000
 
 
 class DownloadBackup(Resource):
     url = "/backups/<int:backup_id>/download"
+    rate_class = "transfer"
 
     def get(self, backup_id: int) -> Response:
-        logger.info(request.headers)
+        hot_logger.debug("Download of backup {} requested with headers {}", backup_id, request.headers)
         parser = reqparse.RequestParser()
         parser.add_argument("Authorization", location="headers", required=True, help="Missing auth token!")
         args = parser.parse_args()
-        token = args["Authorization"]
-        decoded = RSACipher.provide().jwt_decode(token)
-        user_id = decoded.get("user_id", None) if decoded else None
-        if not decoded or not user_id:
+        user_id = authorize(args["Authorization"])
+        if not user_id:
             ret = jsonify({
                 "message": "Invalid auth token!"
             })
@@ -38,27 +62,128 @@ class DownloadBackup(Resource):
             })
             ret.status_code = ResponseCode.NOT_FOUND.value
             return ret
-        download_path = os.path.join(
-            current_app.config["USER_BACKUPS_PATH"],
-            f"{backup.backup_id}-{backup.user_id} [{backup.created.strftime('%d-%m-%Y_%H;%M;%S.%f')}].zip"
-        )
-        resp = send_file(download_path)
+        download_path = backup_path(backup)
+        local_available = not backup.corrupted and os.path.exists(download_path)
+        replica = pick_replica(backup.backup_id, local_available)
+        if replica:
+            return redirect(f"{replica}/backups/{backup.backup_id}/download", code=ResponseCode.TEMPORARY_REDIRECT.value)
+        if backup.corrupted:
+            ret = jsonify({
+                "message": "Backup is corrupted!"
+            })
+            ret.status_code = ResponseCode.INTERNAL_SERVER_ERROR.value
+            return ret
+        with span("io"):
+            resp = deliver_file(download_path)
      #   resp.headers["Connection"] = "close"
-        logger.debug(resp.headers)
+        hot_logger.debug("Download of backup {} answered with headers {}", backup_id, resp.headers)
         return resp
 
 
+def export_members(backups: List[Backup]) -> List[TarMember]:
+    """ MANIFEST.json, then the backups available on this node in id order; the manifest lists the others. """
+    members, manifest = [], {"backups": [], "missing": []}
+    for backup in backups:
+        path = backup_path(backup)
+        if backup.corrupted or not os.path.exists(path):
+            manifest["missing"].append(backup.backup_id)
+            continue
+        member = TarMember(
+            os.path.basename(path), blob_size(path), calendar.timegm(backup.created.utctimetuple()),
+            path=path, checksum=backup.checksum
+        )
+        members.append(member)
+        manifest["backups"].append({
+            "backup_id": backup.backup_id,
+            "file": member.name,
+            "comment": backup.comment,
+            "created": str(backup.created),
+            "checksum": backup.checksum,
+            "size": member.size,
+        })
+    data = json.dumps(manifest, indent=2, sort_keys=True).encode()
+    mtime = max((member.mtime for member in members), default=0)
+    return [TarMember(MANIFEST_NAME, len(data), mtime, data=data, checksum=hashlib.sha256(data).hexdigest())] + members
+
+
+class BackupExport(Resource):
+    """
+    All (or the 'ids' of) the user's backups as one tar stream, built from the stored files
+    as it is sent. The layout is deterministic, so an interrupted export resumes with
+    'Range: bytes=<received>-' and 'If-Range: <ETag>'.
+    """
+    url = "/backups/export"
+    rate_class = "transfer"
+
+    def get(self) -> Response:
+        parser = reqparse.RequestParser()
+        parser.add_argument("Authorization", location="headers", required=True, help="Missing auth token!")
+        parser.add_argument("ids", location="args")
+        args = parser.parse_args()
+        user_id = authorize(args["Authorization"])
+        if not user_id:
+            ret = jsonify({
+                "message": "Invalid auth token!"
+            })
+            ret.status_code = ResponseCode.UNAUTHORIZED.value
+            return ret
+        query = Backup.query.filter(Backup.user_id == user_id)
+        if args["ids"]:
+            try:
+                ids = {int(backup_id) for backup_id in args["ids"].split(",")}
+            except ValueError:
+                ret = jsonify({
+                    "message": "'ids' must be comma separated backup ids!"
+                })
+                ret.status_code = ResponseCode.BAD_REQUEST.value
+                return ret
+            query = query.filter(Backup.backup_id.in_(ids))
+        backups = query.order_by(Backup.backup_id).all()
+        if not backups or args["ids"] and len(backups) != len(ids):
+            ret = jsonify({
+                "message": "Backups is not found!"
+            })
+            ret.status_code = ResponseCode.NOT_FOUND.value
+            return ret
+        stream = TarStream(export_members(backups), opener=open_blob)
+        start, stop = 0, stream.size
+        ranges = request.range
+        if ranges is not None and len(ranges.ranges) == 1 \
+                and (request.if_range.etag is None and request.if_range.date is None
+                     or request.if_range.etag == stream.etag):
+            bounds = ranges.range_for_length(stream.size)
+            if bounds is None:
+                ret = jsonify({
+                    "message": "Range is not satisfiable!"
+                })
+                ret.status_code = ResponseCode.RANGE_NOT_SATISFIABLE.value
+                ret.headers["Content-Range"] = f"bytes */{stream.size}"
+                return ret
+            start, stop = bounds
+        ret = Response(
+            stream_with_context(stream.iter_range(start, stop)), mimetype=ContentType.APPLICATION_TAR,
+            direct_passthrough=True
+        )
+        if (start, stop) != (0, stream.size):
+            ret.status_code = ResponseCode.PARTIAL_CONTENT.value
+            ret.content_range = ContentRange("bytes", start, stop, stream.size)
+        ret.content_length = stop - start
+        ret.accept_ranges = "bytes"
+        ret.set_etag(stream.etag)
+        ret.headers["Content-Disposition"] = f"attachment; filename=backups-{user_id}.tar"
+        return ret
+
+
 class BackupManager(Resource):
     url = "/backups/<int:backup_id>"
+    rate_class = {"GET": "read", "DELETE": "write"}
 
     def get(self, backup_id: int) -> Response:
         parser = reqparse.RequestParser()
         parser.add_argument("Authorization", location="headers", required=True, help="Missing auth token!")
         args = parser.parse_args()
-        token = args["Authorization"]
-        decoded = RSACipher.provide().jwt_decode(token)
-        user_id = decoded.get("user_id", None) if decoded else None
-        if not decoded or not user_id:
+        user_id = authorize(args["Authorization"])
+        if not user_id:
             ret = jsonify({
                 "message": "Invalid auth token!"
             })
@@ -71,22 +196,14 @@ class BackupManager(Resource):
             })
             ret.status_code = ResponseCode.NOT_FOUND.value
             return ret
-        return jsonify({
-            "backup_id": backup.backup_id,
-            "user_id": backup.user_id,
-            "username": backup.login,
-            "comment": backup.comment,
-            "created": str(backup.created),
-        })
+        return jsonify(serialize_backup(backup))
 
     def delete(self, backup_id: int) -> Response:
         parser = reqparse.RequestParser()
         parser.add_argument("Authorization", location="headers", required=True, help="Missing auth token!")
         args = parser.parse_args()
-        token = args["Authorization"]
-        decoded = RSACipher.provide().jwt_decode(token)
-        user_id = decoded.get("user_id", None) if decoded else None
-        if not decoded or not user_id:
+        user_id = authorize(args["Authorization"])
+        if not user_id:
             ret = jsonify({
                 "message": "Invalid auth token!"
             })
@@ -99,92 +216,290 @@ class BackupManager(Resource):
             })
             ret.status_code = ResponseCode.NOT_FOUND.value
             return ret
-        download_path = Path(os.path.join(
-            current_app.config["USER_BACKUPS_PATH"],
-            f"{backup.backup_id}-{backup.user_id} [{backup.created.strftime('%d-%m-%Y_%H;%M;%S.%f')}].zip")
-        )
+        download_path = Path(backup_path(backup))
         delete_backup(backup.backup_id)
         if download_path.exists():
             download_path.unlink()
         cache.delete_memoized(find_backup_by_id)
+        Replicator.provide().notify()
         return jsonify({"message": f"Backup with id {backup_id} was successfully deleted!"})
 
 
+def collection_etag(user_id: int, version: int) -> str:
+    """ '<user_id>-<version>': versions are counted per user, and the ETag must not match another user's list. """
+    return f"{user_id}-{version}"
+
+
 class BackupProvider(Resource):
+    """
+    GET lists the user's backups with the collection version in the ETag ('<user_id>-<version>'),
+    so a poll with 'If-None-Match' gets 304 from one index lookup while nothing changed; the
+    version is also the 'since' of '/backups/changes'.
+    """
     url = "/backups"
+    rate_class = {"GET": "read", "POST": "write"}
+    admission = ("POST",)
 
     def get(self) -> Response:
         parser = reqparse.RequestParser()
         parser.add_argument("Authorization", location="headers", required=True, help="Missing auth token!")
         args = parser.parse_args()
-        token = args["Authorization"]
-        decoded = RSACipher.provide().jwt_decode(token)
-        user_id = decoded.get("user_id", None) if decoded else None
-        if not decoded or not user_id:
+        user_id = authorize(args["Authorization"])
+        if not user_id:
             ret = jsonify({
                 "message": "Invalid auth token!"
             })
             ret.status_code = ResponseCode.UNAUTHORIZED.value
             return ret
-        backups = find_user_backups_by_id(user_id)
-        if not backups:
-            ret = jsonify({
-                "message": "User/backups is/are not found!"
-            })
-            ret.status_code = ResponseCode.NOT_FOUND.value
-            return ret
-        serialized = [
-            {
-                "backup_id": backup.backup_id,
-                "user_id": backup.user_id,
-                "username": backup.login,
-                "comment": backup.comment,
-                "created": str(backup.created),
-            } for backup in backups
-        ]
-        return jsonify(serialized)
+        version = queries.collection_version(db.session, user_id)
+        etag = collection_etag(user_id, version)
+        if request.if_none_match.contains(etag):
+            ret = Response(status=ResponseCode.NOT_MODIFIED.value)
+        else:
+            backups = find_user_backups_by_id(user_id, version)
+            if not backups:
+                ret = jsonify({
+                    "message": "User/backups is/are not found!"
+                })
+                ret.status_code = ResponseCode.NOT_FOUND.value
+                return ret
+            ret = jsonify([serialize_backup(backup) for backup in backups])
+        ret.set_etag(etag)
+        ret.cache_control.private = True
+        ret.cache_control.no_cache = True
+        ret.vary.add("Authorization")
+        return ret
 
     def post(self) -> Response:
         parser = reqparse.RequestParser()
         parser.add_argument("Authorization", location="headers", required=True, help="Missing auth token!")
+        user_id = authorize(parser.parse_args()["Authorization"])
+        if not user_id:
+            ret = jsonify({
+                "message": "Invalid auth token!"
+            })
+            ret.status_code = ResponseCode.UNAUTHORIZED.value
+            return ret
+        user = find_user_by_id(user_id)
+        if not user:
+            ret = jsonify({
+                "message": "Invalid auth token!"
+            })
+            ret.status_code = ResponseCode.UNAUTHORIZED.value
+            return ret
+        # Rejected from the headers, before the body is read (and, with 'Expect: 100-continue', sent).
+        grant = None
+        if current_app.config["UPLOAD_TOKEN_HEADER"] in request.headers:
+            grant = load_upload_token(request.headers[current_app.config["UPLOAD_TOKEN_HEADER"]], user_id)
+            if grant is None:
+                return error_response("Invalid or expired upload token!", ResponseCode.FORBIDDEN)
+            if (request.content_length or 0) > grant.size + MULTIPART_OVERHEAD:
+                return error_response("The body is larger than the announced backup!", ResponseCode.PAYLOAD_TOO_LARGE)
+            duplicate = find_duplicate(user_id, grant.checksum, grant.size)
+            if duplicate is not None:  # stored by another upload since the precheck
+                return deduplicated_backup(user_id, duplicate, grant.comment)
+        error = check_quota(user_id, grant.size if grant else max(0, (request.content_length or 0) - MULTIPART_OVERHEAD))
+        if error:
+            ret = jsonify({
+                "message": error.message
+            })
+            ret.status_code = error.code.value
+            return ret
         parser.add_argument("comment", location="form")
         parser.add_argument("file", location="files", type=FileStorage, required=True, help="Missing backup .zip file!")
         args = parser.parse_args()
-        token = args["Authorization"]
-        decoded = RSACipher.provide().jwt_decode(token)
-        user_id = decoded.get("user_id", None) if decoded else None
-        if not decoded or not user_id:
+        comment = args.get("comment", None)
+        backup = Backup.create(user_id, comment)
+        db.session.add(backup)
+        db.session.flush()
+        file = args["file"]
+        file_path = os.path.join(current_app.config["USER_BACKUPS_PATH"], backup.download_path)
+        # Only the durable receipt of the bytes happens here; checksum and replication are jobs,
+        # unless a token announced the checksum: then it's computed on the way and checked now.
+        with span("io"):
+            backup.size, digests = write_blob(
+                file_path, file.stream, fsync=True, hash_algs=(ChecksumHash.SHA_256,) if grant else ()
+            )
+        if grant and (backup.size, digests[ChecksumHash.SHA_256]) != (grant.size, grant.checksum):
+            db.session.rollback()
+            os.remove(file_path)
+            return error_response("The backup doesn't match its checksum and size!", ResponseCode.UNPROCESSABLE_ENTITY)
+        try:
+            charge_usage(user_id, 1, backup.size)
+        except QuotaExceeded as error:
+            db.session.rollback()
+            os.remove(file_path)
+            ret = jsonify({
+                "message": error.message
+            })
+            ret.status_code = error.code.value
+            return ret
+        if grant:
+            backup.checksum, backup.verified = grant.checksum, datetime.utcnow()
+            enqueue_replication(backup.backup_id, ReplicationTask.PUT)
+        else:
+            enqueue_job(Job.CHECKSUM, backup.backup_id)
+        ret = {
+            "backup_id": backup.backup_id,
+            "user_id": backup.user_id,
+            "username": user.login,
+            "comment": backup.comment,
+            "created": str(backup.created),
+            "checksum": backup.checksum,
+            "size": backup.size,
+            "state": "ready" if grant else "processing",
+        }
+        db.session.commit()
+        if grant:
+            Replicator.provide().notify()
+        else:
+            JobQueue.provide().notify()
+        ret = jsonify(ret)
+        ret.status_code = ResponseCode.CREATED.value if grant else ResponseCode.ACCEPTED.value
+        return ret
+
+
+def encode_cursor(row: BackupRow, by_id: bool) -> str:
+    key = [row.backup_id] if by_id else [row.backup_id, row.created.isoformat()]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, by_id: bool) -> SEARCH_AFTER:
+    """ The keyset position in a cursor from 'encode_cursor'; ValueError for any other string. """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if by_id and len(key) == 1:
+            return int(key[0])
+        if not by_id and len(key) == 2:
+            return datetime.fromisoformat(key[1]), int(key[0])
+    except (TypeError, ValueError, binascii.Error):
+        pass
+    raise ValueError(f"Invalid cursor: {cursor}")
+
+
+class BackupSearch(Resource):
+    """
+    The user's backups by comment words ('q'), creation time ('created_from' inclusive,
+    'created_to' exclusive, ISO 8601) and size in bytes ('size_min', 'size_max'), a page of
+    'limit' at a time; 'next_cursor' is the 'cursor' of the following page.
+    """
+    url = "/backups/search"
+    rate_class = "read"
+
+    def get(self) -> Response:
+        parser = reqparse.RequestParser()
+        parser.add_argument("Authorization", location="headers", required=True, help="Missing auth token!")
+        parser.add_argument("q", location="args")
+        parser.add_argument("created_from", location="args", type=datetime.fromisoformat, help="Not an ISO date!")
+        parser.add_argument("created_to", location="args", type=datetime.fromisoformat, help="Not an ISO date!")
+        parser.add_argument("size_min", location="args", type=int)
+        parser.add_argument("size_max", location="args", type=int)
+        parser.add_argument("limit", location="args", type=int, default=BACKUP_PER_PAGE)
+        parser.add_argument("cursor", location="args")
+        args = parser.parse_args()
+        user_id = authorize(args["Authorization"])
+        if not user_id:
             ret = jsonify({
                 "message": "Invalid auth token!"
             })
             ret.status_code = ResponseCode.UNAUTHORIZED.value
             return ret
-        user_with_backups = find_user_backups_by_id(user_id)
-        if not user_with_backups:
+        search = SearchFilter(
+            args["q"], args["created_from"], args["created_to"], args["size_min"], args["size_max"]
+        )
+        by_id = bool(search.text) and match_expression(user_id, search.text) is not None
+        try:
+            after = decode_cursor(args["cursor"], by_id) if args["cursor"] else None
+        except ValueError as error:
+            ret = jsonify({
+                "message": str(error)
+            })
+            ret.status_code = ResponseCode.BAD_REQUEST.value
+            return ret
+        limit = min(max(args["limit"], 1), SEARCH_MAX_LIMIT)
+        backups = search_backups(db.session, user_id, search, after, limit)
+        return jsonify({
+            "backups": [serialize_backup(backup) for backup in backups],
+            "next_cursor": encode_cursor(backups[-1], by_id) if len(backups) == limit else None,
+        })
+
+
+class BackupChanges(Resource):
+    """
+    The changes of the user's backups after version 'since' (the version in the ETag of
+    '/backups' or the 'version' of the previous answer), oldest first and at most 'limit', each with the backup as
+    it is now ("deleted" without one once it's gone); 'version' is the 'since' of the next call.
+    With 'wait' (seconds, up to CHANGES_MAX_WAIT) an answer that would be empty waits for a change.
+    A 'since' whose changes are no longer kept (see CHANGES_RETAINED) is 410: list the backups again.
+    """
+    url = "/backups/changes"
+    rate_class = "read"
+
+    def get(self) -> Response:
+        parser = reqparse.RequestParser()
+        parser.add_argument("Authorization", location="headers", required=True, help="Missing auth token!")
+        parser.add_argument("since", location="args", type=int, required=True, help="'Since' must be a version!")
+        parser.add_argument("wait", location="args", type=float, default=0.0)
+        parser.add_argument("limit", location="args", type=int, default=CHANGES_DEFAULT_LIMIT)
+        args = parser.parse_args()
+        user_id = authorize(args["Authorization"])
+        if not user_id:
+            return error_response("Invalid auth token!", ResponseCode.UNAUTHORIZED)
+        since = args["since"]
+        wait = min(max(args["wait"], 0.0), current_app.config["CHANGES_MAX_WAIT"])
+        oldest, version = wait_for_change(user_id, since, wait) if wait else queries.change_window(db.session, user_id)
+        if not oldest - 1 <= since <= version:
+            return error_response("The changes since this version are gone, list the backups again!", ResponseCode.GONE)
+        limit = min(max(args["limit"], 1), CHANGES_MAX_LIMIT)
+        changes = queries.changes_since(db.session, user_id, since, limit)
+        latest = {}  # the last change of each backup, in the order of the last changes
+        for change in changes:
+            previous = latest.pop(change.backup_id, None)
+            if previous is not None and previous.change == BackupChange.CREATED and change.change == BackupChange.UPDATED:
+                change = change._replace(change=BackupChange.CREATED)  # an upload inserts the row, then fills it
+            latest[change.backup_id] = change
+        present = [backup_id for backup_id, change in latest.items() if change.change != BackupChange.DELETED]
+        backups = queries.backups_by_ids(db.session, user_id, present)
+        return jsonify({
+            "version": changes[-1].version if changes else version,
+            "changes": [{
+                "version": change.version,
+                "backup_id": backup_id,
+                "change": change.change if backup_id in backups else BackupChange.DELETED,
+                "backup": serialize_backup(backups[backup_id]) if backup_id in backups else None,
+            } for backup_id, change in latest.items()],
+            "more": len(changes) == limit,
+        })
+
+
+class BackupStatus(Resource):
+    url = "/backups/<int:backup_id>/status"
+    rate_class = "read"
+
+    def get(self, backup_id: int) -> Response:
+        parser = reqparse.RequestParser()
+        parser.add_argument("Authorization", location="headers", required=True, help="Missing auth token!")
+        args = parser.parse_args()
+        user_id = authorize(args["Authorization"])
+        if not user_id:
             ret = jsonify({
                 "message": "Invalid auth token!"
             })
             ret.status_code = ResponseCode.UNAUTHORIZED.value
             return ret
-        if len(user_with_backups) >= 10:
+        backup = db.session.get(Backup, backup_id)
+        if not backup or backup.user_id != user_id:
             ret = jsonify({
-                "message": "Backups limit reached!"
+                "message": "Backup is not found!"
             })
-            ret.status_code = ResponseCode.CONFLICT.value
+            ret.status_code = ResponseCode.NOT_FOUND.value
             return ret
-        comment = args.get("comment", None)
-        backup = Backup.create(user_id, comment)
-        with app.app_context():
-            db.session.add(backup)
-            db.session.flush()
-            ret = {
-                "backup_id": backup.backup_id,
-                "user_id": backup.user_id,
-                "username": user_with_backups[0].login,
-                "comment": backup.comment,
-                "created": str(backup.created),
-            }
-            file = args["file"]
-            file.save(os.path.join(current_app.config["USER_BACKUPS_PATH"], backup.download_path))
-            db.session.commit()
-        return jsonify(ret)
+        jobs = Job.query.filter_by(backup_id=backup_id).order_by(Job.job_id).all()
+        return jsonify({
+            "backup_id": backup_id,
+            "state": "corrupted" if backup.corrupted else backup_state(jobs),
+            "checksum": backup.checksum,
+            "size": backup.size,
+            "verified": str(backup.verified) if backup.verified else None,
+            "jobs": [job.serialize() for job in jobs],
+        })
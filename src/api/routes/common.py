@@ -1,54 +1,127 @@
 import functools
 import hashlib
-from typing import Optional, List
+import hmac
+import time
+from typing import Optional, List, Dict, Any, Tuple
 
-from flask import jsonify
+from flask import jsonify, Response, request, g, has_request_context
 from flask_restful import reqparse
 from loguru import logger
 
-from src import cache, app, db
-from src.core.database.models import User, Backup
-from src.utils import RSACipher, ResponseCode
+from src import app, db
+from src.core.metrics import metrics
+from src.core.database import queries
+from src.core.database.models import Backup, UploadSession, UploadChunk, ReplicationTask, Job
+from src.core.database.queries import UserRow, BackupRow
+from src.core.dedupe import clone_backup
+from src.core.quota import QuotaExceeded, release_usage
+from src.core.replication import Replicator, enqueue_replication
+from src.core.revocation import RevocationList
+from src.core.tokens import VerifiedTokens
+from src.utils import ResponseCode
 
 
-@cache.memoize(timeout=100, hash_method=hashlib.sha256)
-def find_user_by_id(user_id: int) -> Optional[User]:
-    with app.app_context():
-        return User.query.filter(User.user_id == user_id).first()
+def error_response(message: str, code: ResponseCode) -> Response:
+    ret = jsonify({
+        "message": message
+    })
+    ret.status_code = code.value
+    return ret
 
 
-@cache.memoize(timeout=30, hash_method=hashlib.sha256)
-def find_backup_by_id(backup_id: int, user_id: int) -> Optional[Backup]:
-    with app.app_context():
-        return Backup.query\
-            .filter_by(backup_id=backup_id, user_id=user_id)\
-            .join(User)\
-            .add_columns(Backup.backup_id, Backup.user_id, Backup.created, Backup.comment, User.login)\
-            .first()
+def is_internal_request() -> bool:
+    expected = app.config["INTERNAL_API_TOKEN"]
+    given = request.headers.get(app.config["INTERNAL_API_TOKEN_HEADER"], "")
+    return bool(expected) and hmac.compare_digest(given, expected)
+
+
+def authorized_claims(token: str) -> Optional[Dict[str, Any]]:
+    """ Claims of a valid token that wasn't revoked (logged out), else None; checked once per request. """
+    checked = g.setdefault("authorized_claims", {}) if has_request_context() else {}
+    if token in checked:
+        return checked[token]
+    decoded = VerifiedTokens.provide().decode(token)
+    if not decoded or RevocationList.provide().is_revoked(decoded.get("jti", None)):
+        decoded = None
+    checked[token] = decoded
+    return decoded
+
+
+def authorize(token: str) -> Optional[int]:
+    claims = authorized_claims(token)
+    return claims.get("user_id", None) if claims else None
+
+
+def serialize_backup(backup) -> Dict[str, str | int | None]:
+    return {
+        "backup_id": backup.backup_id,
+        "user_id": backup.user_id,
+        "username": backup.login,
+        "comment": backup.comment,
+        "created": str(backup.created),
+        "checksum": backup.checksum,
+        "size": backup.size,
+    }
+
+
+@metrics.memoize(timeout=100, hash_method=hashlib.sha256)
+def find_user_by_id(user_id: int) -> Optional[UserRow]:
+    return queries.user_by_id(db.session, user_id)
+
+
+@metrics.memoize(timeout=30, hash_method=hashlib.sha256)
+def find_backup_by_id(backup_id: int, user_id: int) -> Optional[BackupRow]:
+    return queries.backup_by_id(db.session, backup_id, user_id)
 
 
 def delete_backup(backup_id: int) -> int:
-    with app.app_context():
-        ret = Backup.query.filter_by(backup_id=backup_id).delete()
-        db.session.commit()
-        return ret
+    backup = db.session.get(Backup, backup_id)
+    ret = Backup.query.filter_by(backup_id=backup_id).delete()
+    if ret:
+        release_usage(backup.user_id, backup.size)
+        # SQLite may hand the id out again, and a leftover job would be taken for the new backup's.
+        Job.query.filter_by(backup_id=backup_id).delete()
+        enqueue_replication(backup_id, ReplicationTask.DELETE)
+    db.session.commit()
+    return ret
+
+
+@metrics.memoize(timeout=30, hash_method=hashlib.sha256)
+def find_user_backups_by_id(user_id: int, version: int) -> List[BackupRow]:
+    """ The backups of the user at collection 'version'; it only keys the cache, a change makes a new entry. """
+    return queries.user_backups(db.session, user_id, app.config["QUOTA_MAX_BACKUPS"])
+
+
+def wait_for_change(user_id: int, since: int, timeout: float) -> Tuple[int, int]:
+    """
+    The change window (see queries.change_window) of the user once its version isn't 'since'
+    anymore or 'timeout' seconds passed. Polls every CHANGES_POLL_INTERVAL, ending the session's
+    transaction in between: it would keep seeing its snapshot and hold a pooled connection.
+    """
+    deadline = time.monotonic() + timeout
+    window = queries.change_window(db.session, user_id)
+    while window[1] == since and (remaining := deadline - time.monotonic()) > 0:
+        db.session.rollback()
+        time.sleep(min(app.config["CHANGES_POLL_INTERVAL"], remaining))
+        window = queries.change_window(db.session, user_id)
+    return window
 
 
-@cache.memoize(timeout=30, hash_method=hashlib.sha256)
-def find_user_backups_by_id(user_id: int) -> List[Backup]:
-    with app.app_context():
-        return User.query\
-            .filter(User.user_id == user_id)\
-            .join(Backup, Backup.user_id == User.user_id, isouter=True)\
-            .add_columns(User.user_id, User.login, User.joined, Backup.backup_id, Backup.created, Backup.comment)\
-            .limit(10)\
-            .all()
+def find_upload_session(upload_id: str, user_id: int) -> Optional[UploadSession]:
+    return UploadSession.query.filter_by(upload_id=upload_id, user_id=user_id).first()
 
 
-@cache.memoize(timeout=30, hash_method=hashlib.sha256)
-def find_user_by_login(username: str) -> Optional[User]:
-    with app.app_context():
-        return User.query.filter(User.login == username).first()
+def received_chunks(upload_id: str) -> List[int]:
+    rows = db.session.query(UploadChunk.chunk_index)\
+        .filter(UploadChunk.upload_id == upload_id)\
+        .order_by(UploadChunk.chunk_index)\
+        .all()
+    return [row.chunk_index for row in rows]
+
+
+@metrics.memoize(timeout=30, hash_method=hashlib.sha256)
+def find_user_by_login(username: str) -> Optional[UserRow]:
+    return queries.user_by_login(db.session, username)
 
 
 def auth_required(f):
@@ -58,10 +131,8 @@ def auth_required(f):
         parser = reqparse.RequestParser()
         parser.add_argument("Authorization", location="headers", required=True, help="Missing auth token!")
         parsed_args = parser.parse_args()
-        token = parsed_args["Authorization"]
-        decoded = RSACipher.provide().jwt_decode(token)
-        user_id = decoded.get("user_id", None) if decoded else None
-        if not decoded or not user_id:
+        user_id = authorize(parsed_args["Authorization"])
+        if not user_id:
             ret = jsonify({
                 "message": "Invalid auth token!"
             })
@@ -69,4 +140,19 @@ def auth_required(f):
             return ret
         else:
             return f(*args, **kwargs)
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+
+def deduplicated_backup(user_id: int, duplicate: BackupRow, comment: Optional[str]) -> Response:
+    """ 201 with a new backup of the content of 'duplicate' (see src.core.dedupe), or the quota error. """
+    try:
+        backup = clone_backup(user_id, duplicate, comment)
+    except QuotaExceeded as error:
+        db.session.rollback()
+        return error_response(error.message, error.code)
+    Replicator.provide().notify()
+    ret = jsonify(serialize_backup(duplicate._replace(
+        backup_id=backup.backup_id, created=backup.created, comment=backup.comment
+    )) | {"state": "ready", "deduplicated": True})
+    ret.status_code = ResponseCode.CREATED.value
+    return ret
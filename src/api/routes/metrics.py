@@ -0,0 +1,19 @@
+import ipaddress
+
+from flask import Response, request
+from flask_restful import Resource
+
+from src.api.routes.common import error_response, is_internal_request
+from src.core.metrics import metrics
+from src.utils import ResponseCode
+
+
+class MetricsProvider(Resource):
+    """ Prometheus scrape endpoint: from this host, or elsewhere with the internal token. """
+    url = "/metrics"
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def get(self) -> Response:
+        if not is_internal_request() and not ipaddress.ip_address(request.remote_addr or "0.0.0.0").is_loopback:
+            return error_response("Forbidden!", ResponseCode.FORBIDDEN)
+        return Response(metrics.render(), mimetype=self.CONTENT_TYPE)
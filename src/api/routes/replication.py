@@ -0,0 +1,92 @@
+import os
+from datetime import datetime
+
+from flask import Response, jsonify
+from flask_restful import Resource, reqparse
+from werkzeug.datastructures import FileStorage
+
+from src import db, cache
+from src.api.routes.common import (
+    error_response, is_internal_request, find_backup_by_id, find_user_by_id
+)
+from src.core.database.models import Backup, User
+from src.core.quota import charge_usage, release_usage
+from src.core.storage import backup_path, store_file
+from src.utils import ResponseCode, ChecksumHash, file_checksum
+
+
+class ReplicaProvider(Resource):
+    """ Receives backups pushed by the replicator of a peer node (see src.core.replication). """
+    url = "/replication/backups/<int:backup_id>"
+    admission = ("PUT",)
+
+    def put(self, backup_id: int) -> Response:
+        if not is_internal_request():
+            return error_response("Forbidden!", ResponseCode.FORBIDDEN)
+        parser = reqparse.RequestParser()
+        parser.add_argument("user_id", location="form", type=int, required=True)
+        parser.add_argument("login", location="form", required=True)
+        parser.add_argument("password_hash", location="form", required=True)
+        parser.add_argument("joined", location="form", required=True)
+        parser.add_argument("created", location="form", required=True)
+        parser.add_argument("comment", location="form")
+        parser.add_argument("checksum", location="form", required=True)
+        parser.add_argument("size", location="form", type=int)
+        parser.add_argument("file", location="files", type=FileStorage, required=True)
+        args = parser.parse_args()
+        user = db.session.get(User, args["user_id"])
+        if user is None:
+            if User.query.filter_by(login=args["login"]).first():
+                return error_response("Login belongs to another user on this node!", ResponseCode.CONFLICT)
+            user = User(
+                user_id=args["user_id"],
+                login=args["login"],
+                password_hash=args["password_hash"].encode(),
+                joined=datetime.fromisoformat(args["joined"]),
+            )
+            db.session.add(user)
+        backup = db.session.get(Backup, backup_id)
+        if backup is not None and backup.user_id != user.user_id:
+            return error_response("Backup id belongs to another user on this node!", ResponseCode.CONFLICT)
+        old_size = backup.size if backup is not None else None
+        if backup is None:
+            backup = Backup(backup_id=backup_id, user_id=user.user_id, created=datetime.fromisoformat(args["created"]))
+            db.session.add(backup)
+        backup.comment = args["comment"] or None
+        backup.checksum = args["checksum"]
+        backup.size = args["size"]
+        path = backup_path(backup)
+        args["file"].save(path + ".replica")
+        checksum = file_checksum(path + ".replica", ChecksumHash.SHA_256)
+        if checksum != args["checksum"]:
+            os.remove(path + ".replica")
+            db.session.rollback()
+            return error_response(f"Checksum mismatch: {checksum}!", ResponseCode.UNPROCESSABLE_ENTITY)
+        store_file(path + ".replica", path)
+        if os.path.exists(path + ".replica"):
+            os.remove(path + ".replica")
+        backup.verified, backup.corrupted = datetime.utcnow(), False
+        # The origin enforced the quota; the replica only keeps its counters in step.
+        charge_usage(user.user_id, int(old_size is None), (args["size"] or 0) - (old_size or 0), enforce=False)
+        db.session.commit()
+        cache.delete_memoized(find_backup_by_id)
+        cache.delete_memoized(find_user_by_id)
+        return jsonify({"backup_id": backup_id, "checksum": checksum})
+
+    def delete(self, backup_id: int) -> Response:
+        if not is_internal_request():
+            return error_response("Forbidden!", ResponseCode.FORBIDDEN)
+        backup = db.session.get(Backup, backup_id)
+        if backup is None:
+            return error_response("Backup is not found!", ResponseCode.NOT_FOUND)
+        path = backup_path(backup)
+        user_id, size = backup.user_id, backup.size
+        # Deleted first, as in delete_backup: a usage row created by the release mustn't count the backup.
+        db.session.delete(backup)
+        db.session.flush()
+        release_usage(user_id, size)
+        db.session.commit()
+        if os.path.exists(path):
+            os.remove(path)
+        cache.delete_memoized(find_backup_by_id)
+        return jsonify({"message": f"Replica of backup {backup_id} was deleted!"})
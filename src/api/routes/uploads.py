@@ -0,0 +1,234 @@
+import contextlib
+import os
+import re
+from typing import Final
+
+from flask import Response, jsonify, current_app, request
+from flask_restful import Resource, reqparse
+from loguru import logger
+
+from src import db
+from src.api.routes.common import (
+    authorize, deduplicated_backup, error_response, find_user_by_id, find_upload_session,
+    received_chunks
+)
+from src.core.admission import AdmissionController, AdmissionRefused, refused_response
+from src.core.database.models import Backup, UploadSession, UploadChunk, ReplicationTask
+from src.core.dedupe import UploadGrant, find_duplicate, sign_upload_token
+from src.core.profiling import span
+from src.core.quota import QuotaExceeded, check_quota, charge_usage
+from src.core.replication import Replicator, enqueue_replication
+from src.core.storage import backup_path, upload_part_path, store_file
+from src.utils import ResponseCode, ChecksumHash, file_checksum, BYTES_IN_MB
+
+CONTENT_RANGE: Final = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+SHA256_HEX: Final = re.compile(r"^[0-9a-fA-F]{64}$")
+COPY_BUFFER_SIZE: Final[int] = BYTES_IN_MB
+
+
+def auth_parser() -> reqparse.RequestParser:
+    parser = reqparse.RequestParser()
+    parser.add_argument("Authorization", location="headers", required=True, help="Missing auth token!")
+    return parser
+
+
+class UploadPrecheck(Resource):
+    """
+    Announces an upload by its SHA-256 and size. When the user already stores that content the
+    backup is created from it, answered 201 with "deduplicated", and nothing is uploaded;
+    otherwise 200 with an 'upload_token' for the UPLOAD_TOKEN_HEADER of the POST to '/backups'
+    (null when UPLOAD_TOKEN_SECRET is unset: the upload is then hashed after it is received).
+    """
+    url = "/backups/precheck"
+    rate_class = "write"
+
+    def post(self) -> Response:
+        parser = auth_parser()
+        parser.add_argument("size", location="form", type=int, required=True, help="'Size' is a required field!")
+        parser.add_argument("checksum", location="form", required=True, help="'Checksum' (SHA-256) is a required field!")
+        parser.add_argument("comment", location="form")
+        args = parser.parse_args()
+        user_id = authorize(args["Authorization"])
+        if not user_id:
+            return error_response("Invalid auth token!", ResponseCode.UNAUTHORIZED)
+        if args["size"] <= 0 or not SHA256_HEX.match(args["checksum"]):
+            return error_response("Invalid size or checksum!", ResponseCode.BAD_REQUEST)
+        size, checksum = args["size"], args["checksum"].lower()
+        duplicate = find_duplicate(user_id, checksum, size)
+        if duplicate is not None:
+            return deduplicated_backup(user_id, duplicate, args.get("comment", None))
+        error = check_quota(user_id, size)
+        if error:
+            return error_response(error.message, error.code)
+        token = sign_upload_token(UploadGrant(user_id, checksum, size, args.get("comment", None)))
+        return jsonify({
+            "deduplicated": False,
+            "upload_token": token,
+            "expires_in": current_app.config["UPLOAD_TOKEN_MAX_AGE"] if token else None,
+        })
+
+
+class UploadManager(Resource):
+    """ Starts a chunked upload: the client then PUTs chunks in any order and in parallel. """
+    url = "/backups/uploads"
+    rate_class = "write"
+
+    def post(self) -> Response:
+        parser = auth_parser()
+        parser.add_argument("size", location="form", type=int, required=True, help="'Size' is a required field!")
+        parser.add_argument("checksum", location="form", required=True, help="'Checksum' (SHA-256) is a required field!")
+        parser.add_argument("chunk_size", location="form", type=int)
+        parser.add_argument("comment", location="form")
+        args = parser.parse_args()
+        user_id = authorize(args["Authorization"])
+        if not user_id:
+            return error_response("Invalid auth token!", ResponseCode.UNAUTHORIZED)
+        if args["size"] <= 0 or not SHA256_HEX.match(args["checksum"]):
+            return error_response("Invalid size or checksum!", ResponseCode.BAD_REQUEST)
+        error = check_quota(user_id, args["size"])
+        if error:
+            return error_response(error.message, error.code)
+        # The part file is sparse: its chunks take the space as they arrive, each admitted on its own.
+        refused = AdmissionController.provide().check_space(args["size"])
+        if refused:
+            return refused_response(refused)
+        chunk_size = min(
+            max(args["chunk_size"] or current_app.config["UPLOAD_DEFAULT_CHUNK_SIZE"],
+                current_app.config["UPLOAD_MIN_CHUNK_SIZE"]),
+            current_app.config["UPLOAD_MAX_CHUNK_SIZE"]
+        )
+        session = UploadSession.create(user_id, args["size"], chunk_size, args["checksum"], args.get("comment", None))
+        with open(upload_part_path(session.upload_id), "wb") as file:
+            file.truncate(session.size)
+        db.session.add(session)
+        db.session.commit()
+        ret = jsonify(session.serialize([]))
+        ret.status_code = ResponseCode.CREATED.value
+        return ret
+
+
+class UploadProvider(Resource):
+    url = "/backups/uploads/<string:upload_id>"
+    rate_class = {"GET": "read", "PUT": "transfer", "DELETE": "write"}
+    admission = ("PUT",)
+
+    def get(self, upload_id: str) -> Response:
+        args = auth_parser().parse_args()
+        user_id = authorize(args["Authorization"])
+        if not user_id:
+            return error_response("Invalid auth token!", ResponseCode.UNAUTHORIZED)
+        session = find_upload_session(upload_id, user_id)
+        if not session:
+            return error_response("Upload is not found!", ResponseCode.NOT_FOUND)
+        return jsonify(session.serialize(received_chunks(upload_id)))
+
+    def put(self, upload_id: str) -> Response:
+        args = auth_parser().parse_args()
+        user_id = authorize(args["Authorization"])
+        if not user_id:
+            return error_response("Invalid auth token!", ResponseCode.UNAUTHORIZED)
+        session = find_upload_session(upload_id, user_id)
+        if not session:
+            return error_response("Upload is not found!", ResponseCode.NOT_FOUND)
+        match = CONTENT_RANGE.match(request.headers.get("Content-Range", ""))
+        if not match:
+            return error_response("Missing or invalid Content-Range!", ResponseCode.BAD_REQUEST)
+        start, end, total = (int(group) for group in match.groups())
+        index = start // session.chunk_size
+        length = end - start + 1
+        if total != session.size or start % session.chunk_size or length != session.chunk_length(index) \
+                or request.content_length != length:
+            return error_response("Content-Range does not match the upload chunks!", ResponseCode.RANGE_NOT_SATISFIABLE)
+        written = 0
+        with span("io"), open(upload_part_path(upload_id), "r+b") as file:
+            file.seek(start)
+            while written < length and (block := request.stream.read(min(COPY_BUFFER_SIZE, length - written))):
+                file.write(block)
+                written += len(block)
+        if written != length:
+            return error_response("Incomplete chunk body!", ResponseCode.BAD_REQUEST)
+        db.session.merge(UploadChunk(upload_id=upload_id, chunk_index=index))
+        db.session.commit()
+        return jsonify({"upload_id": upload_id, "chunk": index})
+
+    def delete(self, upload_id: str) -> Response:
+        args = auth_parser().parse_args()
+        user_id = authorize(args["Authorization"])
+        if not user_id:
+            return error_response("Invalid auth token!", ResponseCode.UNAUTHORIZED)
+        session = find_upload_session(upload_id, user_id)
+        if not session:
+            return error_response("Upload is not found!", ResponseCode.NOT_FOUND)
+        db.session.delete(session)
+        db.session.commit()
+        if os.path.exists(upload_part_path(upload_id)):
+            os.remove(upload_part_path(upload_id))
+        return jsonify({"message": f"Upload {upload_id} was aborted!"})
+
+
+class UploadCommit(Resource):
+    url = "/backups/uploads/<string:upload_id>/complete"
+    rate_class = "write"
+
+    def post(self, upload_id: str) -> Response:
+        args = auth_parser().parse_args()
+        user_id = authorize(args["Authorization"])
+        if not user_id:
+            return error_response("Invalid auth token!", ResponseCode.UNAUTHORIZED)
+        session = find_upload_session(upload_id, user_id)
+        if not session:
+            return error_response("Upload is not found!", ResponseCode.NOT_FOUND)
+        received = received_chunks(upload_id)
+        if len(received) != session.chunk_count:
+            ret = jsonify(session.serialize(received) | {"message": "Upload is incomplete!"})
+            ret.status_code = ResponseCode.CONFLICT.value
+            return ret
+        part_path = upload_part_path(upload_id)
+        with span("io"):
+            checksum = file_checksum(part_path, ChecksumHash.SHA_256)
+        if checksum != session.checksum:
+            logger.warning(f"Upload {upload_id}: checksum mismatch ({checksum} != {session.checksum})")
+            UploadChunk.query.filter_by(upload_id=upload_id).delete()
+            db.session.commit()
+            return error_response("Checksum mismatch, upload the chunks again!", ResponseCode.UNPROCESSABLE_ENTITY)
+        backup = Backup.create(user_id, session.comment, checksum, session.size)
+        backup.verified = backup.created
+        db.session.add(backup)
+        db.session.flush()
+        try:
+            charge_usage(user_id, 1, session.size)
+        except QuotaExceeded as error:
+            db.session.rollback()
+            return error_response(error.message, error.code)
+        space = contextlib.nullcontext()
+        if current_app.config["STORAGE_ENCRYPTION"]:  # sealing writes a second copy before the part is removed
+            try:
+                space = AdmissionController.provide().reserve(user_id, session.size, slot=False)
+            except AdmissionRefused as error:
+                db.session.rollback()
+                return refused_response(error)
+        with span("io"), space:
+            store_file(part_path, backup_path(backup))
+        try:
+            db.session.delete(session)
+            enqueue_replication(backup.backup_id, ReplicationTask.PUT)
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            if os.path.exists(part_path):
+                os.remove(backup_path(backup))
+            else:
+                os.replace(backup_path(backup), part_path)
+            raise
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        Replicator.provide().notify()
+        return jsonify({
+            "backup_id": backup.backup_id,
+            "user_id": backup.user_id,
+            "username": find_user_by_id(user_id).login,
+            "comment": backup.comment,
+            "created": str(backup.created),
+            "checksum": backup.checksum,
+            "size": backup.size,
+        })
@@ -0,0 +1,21 @@
+from flask import Response, jsonify
+from flask_restful import Resource, reqparse
+
+from src.api.routes.common import authorize, error_response
+from src.core.quota import serialize_usage
+from src.utils import ResponseCode
+
+
+class UsageProvider(Resource):
+    """ Storage used by the user against the quota; one primary key lookup of the usage row. """
+    url = "/users/usage"
+    rate_class = "read"
+
+    def get(self) -> Response:
+        parser = reqparse.RequestParser()
+        parser.add_argument("Authorization", location="headers", required=True, help="Missing auth token!")
+        args = parser.parse_args()
+        user_id = authorize(args["Authorization"])
+        if not user_id:
+            return error_response("Invalid auth token!", ResponseCode.UNAUTHORIZED)
+        return jsonify(serialize_usage(user_id))
@@ -0,0 +1,272 @@
+import math
+import random
+import shutil
+import threading
+import time
+from typing import Optional, Dict, Tuple, Iterator, Final
+
+from flask import Flask, Response, request, g, jsonify, current_app, abort
+from loguru import logger
+
+from src import app
+from src.core.metrics import metrics
+from src.utils import ResponseCode
+
+
+class AdmissionRefused(Exception):
+
+    def __init__(self, message: str, code: ResponseCode, retry_after: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.message = message
+        self.code = code
+        self.retry_after = retry_after
+
+
+class Reservation(object):
+    """ An admitted body: its upload slot (if any) and disk bytes, held until 'release'. """
+
+    def __init__(self, controller: "AdmissionController", user_id: Optional[int], size: int, slot: bool) -> None:
+        self.controller = controller
+        self.user_id = user_id
+        self.size = size
+        self.slot = slot
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+    def __enter__(self) -> "Reservation":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
+
+
+class ReservedInput(object):
+    """
+    'wsgi.input' wrapper of a body without Content-Length: once more has been read than its
+    reservation holds, the reservation grows by at least 'step'. A body the disk has no room
+    for is cut off with 507, one over 'limit' with 413 (aborting the read with the response).
+    """
+
+    def __init__(self, stream, reservation: Reservation, step: int, limit: Optional[int]) -> None:
+        self._stream = stream
+        self._reservation = reservation
+        self._step = step
+        self._limit = limit
+        self._received = 0
+
+    def _count(self, size: int) -> None:
+        self._received += size
+        if self._limit and self._received > self._limit:
+            metrics.inc("app_admission_refused_total", ("size",))
+            abort(refused_response(AdmissionRefused("The body is too large!", ResponseCode.PAYLOAD_TOO_LARGE)))
+        missing = self._received - self._reservation.size
+        if missing > 0:
+            try:
+                self._reservation.controller.grow(self._reservation, max(missing, self._step))
+            except AdmissionRefused as error:
+                abort(refused_response(error))
+
+    def read(self, *args) -> bytes:
+        data = self._stream.read(*args)
+        self._count(len(data))
+        return data
+
+    def readline(self, *args) -> bytes:
+        data = self._stream.readline(*args)
+        self._count(len(data))
+        return data
+
+    def readlines(self, *args) -> list:
+        lines = self._stream.readlines(*args)
+        self._count(sum(map(len, lines)))
+        return lines
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self.readline, b"")
+
+    def __getattr__(self, name: str):
+        return getattr(self._stream, name)
+
+
+class AdmissionController(object):
+    """
+    Admits request bodies before they are read, so overload is refused at once instead of
+    slowing every upload down and a burst can't fill the disk (and the database with it).
+    A Resource opts in with an 'admission' attribute, the HTTP methods whose bodies it takes.
+    An admitted body holds an upload slot, at most ADMISSION_MAX_UPLOADS in all and
+    ADMISSION_MAX_USER_UPLOADS per user, and reserves its Content-Length against the free disk
+    space, which has to stay above ADMISSION_MIN_FREE_BYTES. A chunked body starts with
+    ADMISSION_CHUNKED_RESERVE and grows its reservation as it is read (see ReservedInput).
+    Without a slot after ADMISSION_QUEUE_TIMEOUT the answer is 503, without the space 507,
+    both with Retry-After; a body over MAX_CONTENT_LENGTH is 413. The counts are per process.
+    """
+    instance: Optional["AdmissionController"] = None
+    # Weight of the last upload in the average duration that Retry-After is estimated from.
+    DURATION_SMOOTHING: Final[float] = 0.2
+    MAX_RETRY_AFTER: Final[int] = 60
+
+    def __init__(self, flask_app: Flask) -> None:
+        self.app = flask_app
+        self.enabled: bool = flask_app.config["ADMISSION_ENABLED"]
+        self.path: str = flask_app.config["USER_BACKUPS_PATH"]
+        self.max_content_length: Optional[int] = flask_app.config["MAX_CONTENT_LENGTH"]
+        self.max_uploads: int = flask_app.config["ADMISSION_MAX_UPLOADS"]
+        self.max_user_uploads: int = flask_app.config["ADMISSION_MAX_USER_UPLOADS"]
+        self.min_free_bytes: int = flask_app.config["ADMISSION_MIN_FREE_BYTES"]
+        self.queue_timeout: float = flask_app.config["ADMISSION_QUEUE_TIMEOUT"]
+        self.disk_retry_after: int = flask_app.config["ADMISSION_DISK_RETRY_AFTER"]
+        self.chunked_reserve: int = flask_app.config["ADMISSION_CHUNKED_RESERVE"]
+        self._released = threading.Condition(threading.Lock())
+        self._uploads = 0
+        self._user_uploads: Dict[int, int] = {}
+        self._reserved = 0
+        self._duration = 1.0
+
+    @classmethod
+    def provide(cls) -> "AdmissionController":
+        if not cls.instance:
+            cls.instance = AdmissionController(app)
+        return cls.instance
+
+    def init_app(self) -> None:
+        if not self.enabled:
+            return
+        self.app.before_request(self._before_request)
+        self.app.teardown_request(self._teardown_request)
+        logger.info(
+            f"Admission: {self.max_uploads} uploads, {self.max_user_uploads} per user, "
+            f"{self.min_free_bytes} bytes kept free"
+        )
+
+    def free_bytes(self) -> int:
+        """ Free space of the backups disk not promised to a body in flight. """
+        return shutil.disk_usage(self.path).free - self._reserved
+
+    def check_space(self, size: int) -> Optional[AdmissionRefused]:
+        """ The refusal of 'size' more bytes on disk or None, reserving nothing (for sizes announced ahead). """
+        if self.enabled and self.free_bytes() - size < self.min_free_bytes:
+            return self._refuse("disk", "Not enough disk space for the upload!", ResponseCode.INSUFFICIENT_STORAGE,
+                                self.disk_retry_after)
+        return None
+
+    def reserve(self, user_id: Optional[int], size: int, slot: bool = True) -> Reservation:
+        """
+        Takes an upload slot (with 'slot'; waiting up to ADMISSION_QUEUE_TIMEOUT) and reserves
+        'size' bytes of disk, or raises AdmissionRefused. Without 'enabled', admits everything.
+        """
+        if not self.enabled:
+            return Reservation(self, user_id, 0, False)
+        deadline = time.monotonic() + self.queue_timeout
+        with self._released:
+            if self.free_bytes() - size < self.min_free_bytes:
+                raise self._refuse("disk", "Not enough disk space for the upload!", ResponseCode.INSUFFICIENT_STORAGE,
+                                   self.disk_retry_after)
+            while slot:
+                full, share = self._slots_full(user_id)
+                if not full:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._refuse(full, "Too many uploads in progress, retry later!",
+                                       ResponseCode.SERVICE_UNAVAILABLE, self._retry_after(share))
+                self._released.wait(remaining)
+            if slot:
+                self._uploads += 1
+                if user_id is not None:
+                    self._user_uploads[user_id] = self._user_uploads.get(user_id, 0) + 1
+            self._reserved += size
+        return Reservation(self, user_id, size, slot)
+
+    def grow(self, reservation: Reservation, size: int) -> None:
+        """ Reserves 'size' more bytes for an admitted body, or raises AdmissionRefused. """
+        with self._released:
+            if reservation.released:
+                return
+            if self.free_bytes() - size < self.min_free_bytes:
+                raise self._refuse("disk", "Not enough disk space for the upload!", ResponseCode.INSUFFICIENT_STORAGE,
+                                   self.disk_retry_after)
+            self._reserved += size
+            reservation.size += size
+
+    def _slots_full(self, user_id: Optional[int]) -> Tuple[Optional[str], int]:
+        """ The exhausted limit ("uploads" or "user_uploads") and its slot count, or None. """
+        if self._uploads >= self.max_uploads:
+            return "uploads", self.max_uploads
+        if user_id is not None and self._user_uploads.get(user_id, 0) >= self.max_user_uploads:
+            return "user_uploads", self.max_user_uploads
+        return None, 0
+
+    def _retry_after(self, slots: int) -> int:
+        """ About when one of 'slots' busy uploads of the average duration ends; jittered so retries spread out. """
+        estimate = self._duration / max(1, slots) * random.uniform(1.0, 1.5)
+        return min(self.MAX_RETRY_AFTER, max(1, math.ceil(estimate)))
+
+    def _release(self, reservation: Reservation) -> None:
+        with self._released:
+            self._reserved -= reservation.size
+            if reservation.slot:
+                self._uploads -= 1
+                if reservation.user_id is not None:
+                    left = self._user_uploads[reservation.user_id] - 1
+                    if left:
+                        self._user_uploads[reservation.user_id] = left
+                    else:
+                        del self._user_uploads[reservation.user_id]
+                elapsed = time.monotonic() - reservation.started
+                self._duration += self.DURATION_SMOOTHING * (elapsed - self._duration)
+                self._released.notify_all()
+
+    @staticmethod
+    def _refuse(reason: str, message: str, code: ResponseCode, retry_after: int) -> AdmissionRefused:
+        metrics.inc("app_admission_refused_total", (reason,))
+        return AdmissionRefused(message, code, retry_after)
+
+    @staticmethod
+    def _admission() -> tuple:
+        view = current_app.view_functions.get(request.endpoint, None)
+        return getattr(getattr(view, "view_class", None), "admission", ())
+
+    def _before_request(self) -> Optional[Response]:
+        if request.method not in self._admission():
+            return None
+        size = request.content_length
+        if size is not None and self.max_content_length and size > self.max_content_length:
+            metrics.inc("app_admission_refused_total", ("size",))
+            return refused_response(AdmissionRefused("The body is too large!", ResponseCode.PAYLOAD_TOO_LARGE))
+        from src.api.routes.common import authorize  # the routes use this module
+        token = request.headers.get("Authorization", None)
+        try:
+            g.admission = self.reserve(
+                authorize(token) if token else None, size if size is not None else self.chunked_reserve
+            )
+        except AdmissionRefused as error:
+            return refused_response(error)
+        if size is None:
+            request.environ["wsgi.input"] = ReservedInput(
+                request.environ["wsgi.input"], g.admission, self.chunked_reserve, self.max_content_length
+            )
+        return None
+
+    @staticmethod
+    def _teardown_request(exc: Optional[BaseException]) -> None:
+        reservation = g.pop("admission", None)
+        if reservation is not None:
+            reservation.release()
+
+
+def refused_response(error: AdmissionRefused) -> Response:
+    ret = jsonify({
+        "message": error.message
+    })
+    ret.status_code = error.code.value
+    if error.retry_after is not None:
+        ret.headers["Retry-After"] = str(error.retry_after)
+    return ret
+
+
+metrics.counter("app_admission_refused_total", "Request bodies refused before they were read.", ("reason",))
@@ -1,17 +1,152 @@
 import os
 from typing import Final
 
-from src.core.database.common import SQLITE_URI, MIGRATION_DIR, CACHE_DIRECTORY, ALEMBIC_SCRIPT_ENV, DOWNLOAD_PATH
+from src.core.database.common import (
+    SQLITE_URI, MIGRATION_DIR, CACHE_DIRECTORY, ALEMBIC_SCRIPT_ENV, DOWNLOAD_PATH, UPLOADS_PATH, RUNTIME_PATH
+)
+from src.utils.os_utils import BYTES_IN_MB
+
+
+def env_flag(name: str, default: bool) -> bool:
+    return os.environ.get(name, str(int(default))).lower() in ("1", "true", "yes", "on")
+
+
+def env_list(name: str) -> tuple:
+    return tuple(item.strip().rstrip("/") for item in os.environ.get(name, "").split(",") if item.strip())
 
 
 class Config(object):
-    PORT: Final[int] = 9999
-    HOST: Final[str] = "127.0.0.1"
-    TESTING: Final[bool] = True
-    SQLALCHEMY_ECHO: Final[bool] = True
+    PORT: Final[int] = int(os.environ.get("APP_PORT", 9999))
+    HOST: Final[str] = os.environ.get("APP_HOST", "127.0.0.1")
+    TESTING: Final[bool] = env_flag("APP_TESTING", True)
+    SQLALCHEMY_ECHO: Final[bool] = env_flag("APP_SQLALCHEMY_ECHO", False)
     SQLALCHEMY_DATABASE_URI: Final[str] = SQLITE_URI
     SQLALCHEMY_MIGRATE_REPO: Final[str] = MIGRATION_DIR
+    # Threads that run the database calls of coroutines (src.core.database.executor), per process.
+    DB_THREADS: Final[int] = int(os.environ.get("APP_DB_THREADS", 8))
     USER_BACKUPS_PATH: Final[str] = DOWNLOAD_PATH
+    UPLOAD_SESSIONS_PATH: Final[str] = UPLOADS_PATH
+    UPLOAD_MIN_CHUNK_SIZE: Final[int] = BYTES_IN_MB
+    UPLOAD_MAX_CHUNK_SIZE: Final[int] = 64 * BYTES_IN_MB
+    UPLOAD_DEFAULT_CHUNK_SIZE: Final[int] = 8 * BYTES_IN_MB
+    # '/backups/precheck': content the user already stores (same SHA-256 and size) is linked to the
+    # new backup instead of uploaded again; otherwise it gives a token for UPLOAD_TOKEN_HEADER of the upload,
+    # signed with UPLOAD_TOKEN_SECRET. Without that secret no tokens are given: uploads are hashed afterwards.
+    UPLOAD_DEDUPLICATION: Final[bool] = env_flag("APP_UPLOAD_DEDUPLICATION", True)
+    UPLOAD_TOKEN_HEADER: Final[str] = "X-Upload-Token"
+    UPLOAD_TOKEN_MAX_AGE: Final[int] = int(os.environ.get("APP_UPLOAD_TOKEN_MAX_AGE", 3600))
+    UPLOAD_TOKEN_SECRET: Final[str] = os.environ.get("APP_UPLOAD_TOKEN_SECRET", "")
+    # '/backups/changes' long-polls ('wait') up to CHANGES_MAX_WAIT seconds, checking the collection
+    # version every CHANGES_POLL_INTERVAL; each waiting client holds a worker thread meanwhile.
+    CHANGES_MAX_WAIT: Final[float] = float(os.environ.get("APP_CHANGES_MAX_WAIT", 30))
+    CHANGES_POLL_INTERVAL: Final[float] = float(os.environ.get("APP_CHANGES_POLL_INTERVAL", 1))
+    # Per user; uploads over the count are answered 409, over the bytes 507.
+    QUOTA_MAX_BACKUPS: Final[int] = int(os.environ.get("APP_QUOTA_MAX_BACKUPS", 10))
+    QUOTA_MAX_BYTES: Final[int] = int(os.environ.get("APP_QUOTA_MAX_BYTES", 10 * 1024 * BYTES_IN_MB))
+    # Request bodies are admitted before they're read (src.core.admission), per worker process: up to
+    # ADMISSION_MAX_UPLOADS at once and ADMISSION_MAX_USER_UPLOADS per user (503 beyond, after waiting
+    # ADMISSION_QUEUE_TIMEOUT for a slot), while the free space of the backups disk less the bodies in flight
+    # stays above ADMISSION_MIN_FREE_BYTES (507 beyond), which keeps room for the database. A body without
+    # Content-Length (chunked) reserves ADMISSION_CHUNKED_RESERVE, and as much again whenever it outgrows that.
+    MAX_CONTENT_LENGTH: Final[int] = int(os.environ.get("APP_MAX_CONTENT_LENGTH", QUOTA_MAX_BYTES + BYTES_IN_MB))
+    ADMISSION_ENABLED: Final[bool] = env_flag("APP_ADMISSION_ENABLED", True)
+    ADMISSION_MAX_UPLOADS: Final[int] = int(os.environ.get("APP_ADMISSION_MAX_UPLOADS", 16))
+    ADMISSION_MAX_USER_UPLOADS: Final[int] = int(os.environ.get("APP_ADMISSION_MAX_USER_UPLOADS", 4))
+    ADMISSION_MIN_FREE_BYTES: Final[int] = int(os.environ.get("APP_ADMISSION_MIN_FREE_BYTES", 1024 * BYTES_IN_MB))
+    ADMISSION_QUEUE_TIMEOUT: Final[float] = float(os.environ.get("APP_ADMISSION_QUEUE_TIMEOUT", 0.25))
+    ADMISSION_DISK_RETRY_AFTER: Final[int] = 300
+    ADMISSION_CHUNKED_RESERVE: Final[int] = int(os.environ.get("APP_ADMISSION_CHUNKED_RESERVE", 64 * BYTES_IN_MB))
+    INTERNAL_API_TOKEN: Final[str] = os.environ.get("APP_INTERNAL_API_TOKEN", "")
+    INTERNAL_API_TOKEN_HEADER: Final[str] = "X-Internal-Token"
+    # Tokens per call of the internal token introspection endpoint.
+    INTROSPECTION_MAX_TOKENS: Final[int] = int(os.environ.get("APP_INTROSPECTION_MAX_TOKENS", 1000))
+    REPLICATION_PEERS: Final[tuple] = env_list("APP_REPLICATION_PEERS")
+    REPLICATION_CONCURRENCY: Final[int] = int(os.environ.get("APP_REPLICATION_CONCURRENCY", 4))
+    REPLICATION_POLL_INTERVAL: Final[float] = 5.0
+    REPLICATION_MAX_ATTEMPTS: Final[int] = 12
+    REPLICATION_MAX_BACKOFF: Final[float] = 600.0
+    REPLICATION_CLAIM_TIMEOUT: Final[float] = 900.0
+    # "local": serve from this node, redirect only when the local file is missing;
+    # "redirect": spread downloads over this node and every in-sync replica.
+    REPLICATION_READ_MODE: Final[str] = os.environ.get("APP_REPLICATION_READ_MODE", "local")
+    JOBS_WORKERS: Final[int] = int(os.environ.get("APP_JOBS_WORKERS", 4))
+    JOBS_CONCURRENCY: Final[dict] = {"checksum": 2}  # per kind and process, by default JOBS_WORKERS
+    JOBS_POLL_INTERVAL: Final[float] = 1.0
+    JOBS_MAX_ATTEMPTS: Final[int] = 5
+    JOBS_MAX_BACKOFF: Final[float] = 300.0
+    JOBS_CLAIM_TIMEOUT: Final[float] = 600.0
+    SCRUB_BYTES_PER_SECOND: Final[int] = int(os.environ.get("APP_SCRUB_BYTES_PER_SECOND", 32 * BYTES_IN_MB))
+    SCRUB_INTERVAL: Final[float] = float(os.environ.get("APP_SCRUB_INTERVAL", 6 * 3600))
+    SCRUB_BATCH_SIZE: Final[int] = 100
+    # JWT key rotation: new keys dropped into the keys directory sign after KEYS_ACTIVATION_DELAY,
+    # removed ones keep verifying for KEYS_RETIREMENT_GRACE.
+    KEYS_RELOAD_INTERVAL: Final[float] = float(os.environ.get("APP_KEYS_RELOAD_INTERVAL", 30))
+    KEYS_ACTIVATION_DELAY: Final[float] = float(os.environ.get("APP_KEYS_ACTIVATION_DELAY", 60))
+    KEYS_RETIREMENT_GRACE: Final[float] = float(os.environ.get("APP_KEYS_RETIREMENT_GRACE", 7 * 24 * 3600))
+    # Revoked tokens reach the other workers within REVOCATION_REFRESH_INTERVAL.
+    REVOCATION_REFRESH_INTERVAL: Final[float] = float(os.environ.get("APP_REVOCATION_REFRESH_INTERVAL", 2))
+    REVOCATION_PRUNE_INTERVAL: Final[float] = 3600.0
+    REVOCATION_BLOOM_CAPACITY: Final[int] = 100_000
+    REVOCATION_BLOOM_ERROR_RATE: Final[float] = 0.001
+    # Verified tokens kept per worker, so a token's signature is checked once (src.core.tokens).
+    TOKEN_CACHE_SIZE: Final[int] = int(os.environ.get("APP_TOKEN_CACHE_SIZE", 10_000))
+    # Token buckets by endpoint class (the 'rate_class' of a Resource), per IP and per user:
+    # (requests per second, burst). Buckets are shared by the workers through RATE_LIMIT_STATE_PATH.
+    RATE_LIMITS_ENABLED: Final[bool] = env_flag("APP_RATE_LIMITS_ENABLED", True)
+    RATE_LIMITS: Final[dict] = {
+        "auth": {"ip": (1.0, 20)},
+        "read": {"ip": (50.0, 200), "user": (20.0, 100)},
+        "write": {"ip": (10.0, 40), "user": (2.0, 20)},
+        "transfer": {"ip": (100.0, 400), "user": (50.0, 200)},
+    }
+    RATE_LIMIT_STATE_PATH: Final[str] = os.path.join(RUNTIME_PATH, "rate_limits.bin")
+    # Per-user bandwidth of request bodies and file responses, 0 disables shaping.
+    UPLOAD_BYTES_PER_SECOND: Final[int] = int(os.environ.get("APP_UPLOAD_BYTES_PER_SECOND", 64 * BYTES_IN_MB))
+    DOWNLOAD_BYTES_PER_SECOND: Final[int] = int(os.environ.get("APP_DOWNLOAD_BYTES_PER_SECOND", 64 * BYTES_IN_MB))
+    # How downloads are sent, see src.core.delivery: "stream", "sendfile", "x-accel" (nginx, with an
+    # 'internal' location at DOWNLOAD_ACCEL_PREFIX aliased to USER_BACKUPS_PATH) or "x-sendfile".
+    DOWNLOAD_DELIVERY_MODE: Final[str] = os.environ.get("APP_DOWNLOAD_DELIVERY_MODE", "stream")
+    DOWNLOAD_ACCEL_PREFIX: Final[str] = os.environ.get("APP_DOWNLOAD_ACCEL_PREFIX", "/internal/backups/")
+    # Backups sealed at rest with AES-256-GCM in STORAGE_CHUNK_SIZE chunks (src.utils.sealed) under the
+    # master key at STORAGE_MASTER_KEY_PATH, created on first use. Plain and sealed files can coexist.
+    STORAGE_ENCRYPTION: Final[bool] = env_flag("APP_STORAGE_ENCRYPTION", False)
+    STORAGE_MASTER_KEY_PATH: Final[str] = os.environ.get(
+        "APP_STORAGE_MASTER_KEY_PATH",
+        os.path.join(os.path.dirname(os.path.dirname(__file__)), "store", "storage-master.key")
+    )
+    STORAGE_CHUNK_SIZE: Final[int] = 256 * 1024
+    STORAGE_CRYPTO_THREADS: Final[int] = int(os.environ.get("APP_STORAGE_CRYPTO_THREADS", os.cpu_count() or 1))
+    METRICS_ENABLED: Final[bool] = env_flag("APP_METRICS_ENABLED", True)
+    METRICS_PATH: Final[str] = os.path.join(RUNTIME_PATH, "metrics")
+    METRICS_SNAPSHOT_INTERVAL: Final[float] = 5.0
+    # Requests carrying PROFILE_TOKEN_HEADER ('python -m src.core.profiling sign') or picked at
+    # PROFILE_SAMPLE_RATE are profiled with PROFILE_MODE "cprofile" or "sample" (stack sampling).
+    # The header is signed with PROFILE_SECRET; while that is unset, the header is ignored.
+    # Requests slower than PROFILE_SLOW_THRESHOLD seconds are saved with their spans, 0 disables that.
+    PROFILE_PATH: Final[str] = os.path.join(RUNTIME_PATH, "profiles")
+    PROFILE_MODE: Final[str] = os.environ.get("APP_PROFILE_MODE", "cprofile")
+    PROFILE_SAMPLE_RATE: Final[float] = float(os.environ.get("APP_PROFILE_SAMPLE_RATE", 0.0))
+    PROFILE_SAMPLE_INTERVAL: Final[float] = 0.005
+    PROFILE_SLOW_THRESHOLD: Final[float] = float(os.environ.get("APP_PROFILE_SLOW_THRESHOLD", 1.0))
+    PROFILE_MAX_FILES: Final[int] = 500
+    PROFILE_TOKEN_HEADER: Final[str] = "X-Profile-Token"
+    PROFILE_TOKEN_MAX_AGE: Final[int] = 3600
+    PROFILE_SECRET: Final[str] = os.environ.get("APP_PROFILE_SECRET", "")
+    # Levels and sampled fractions of the records below WARNING by category (module name or
+    # the bound 'category', matched by dotted prefix); "access" is the per-request log.
+    LOG_LEVELS: Final[dict] = {
+        "": os.environ.get("APP_LOG_LEVEL", "INFO"),
+        "src.utils.network": "WARNING",
+    }
+    LOG_SAMPLING: Final[dict] = {
+        "access": float(os.environ.get("APP_LOG_ACCESS_SAMPLE_RATE", 0.01)),
+    }
+    LOG_PATH: Final[str] = os.environ.get("APP_LOG_PATH", os.path.join(RUNTIME_PATH, "logs", "app.log"))
+    LOG_MAX_BYTES: Final[int] = 64 * BYTES_IN_MB
+    LOG_BACKUPS: Final[int] = 5
+    LOG_QUEUE_SIZE: Final[int] = 100_000
+    LOG_FLUSH_INTERVAL: Final[float] = 0.5
+    LOG_STDERR: Final[bool] = env_flag("APP_LOG_STDERR", TESTING)
     SQLALCHEMY_TRACK_MODIFICATIONS: Final[bool] = False
     CACHE_TYPE: Final[str] = "FileSystemCache"
     CACHE_DIR: Final[str] = CACHE_DIRECTORY
@@ -29,3 +164,7 @@ class Config(object):
             os.makedirs(self.CACHE_DIR)
         if not os.path.exists(self.USER_BACKUPS_PATH):
             os.makedirs(self.USER_BACKUPS_PATH)
+        if not os.path.exists(self.UPLOAD_SESSIONS_PATH):
+            os.makedirs(self.UPLOAD_SESSIONS_PATH)
+        if not os.path.exists(RUNTIME_PATH):
+            os.makedirs(RUNTIME_PATH)
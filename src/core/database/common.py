@@ -2,9 +2,11 @@ import os
 from typing import Final
 
 DATABASE_DIR: Final[str] = os.path.dirname(__file__)
-CACHE_DIRECTORY: Final[str] = os.path.join(DATABASE_DIR, "cache")
-DOWNLOAD_PATH: Final[str] = os.path.join(DATABASE_DIR, "downloads")
-DATABASE_PATH: Final[str] = os.path.join(DATABASE_DIR, "app.sqlite")
+CACHE_DIRECTORY: Final[str] = os.environ.get("APP_CACHE_DIR", os.path.join(DATABASE_DIR, "cache"))
+DOWNLOAD_PATH: Final[str] = os.environ.get("APP_BACKUPS_PATH", os.path.join(DATABASE_DIR, "downloads"))
+UPLOADS_PATH: Final[str] = os.path.join(DOWNLOAD_PATH, ".uploads")
+RUNTIME_PATH: Final[str] = os.environ.get("APP_RUNTIME_DIR", os.path.join(DATABASE_DIR, "run"))
+DATABASE_PATH: Final[str] = os.environ.get("APP_DATABASE_PATH", os.path.join(DATABASE_DIR, "app.sqlite"))
 MIGRATION_DIR: Final[str] = os.path.join(DATABASE_DIR, "repository")
 ALEMBIC_SCRIPT_ENV: Final[str] = os.path.join(DATABASE_DIR, "migrations")
 ALEMBIC_VERSION_PATH: Final[str] = os.path.join(ALEMBIC_SCRIPT_ENV, "versions")
@@ -10,13 +10,14 @@ from loguru import logger
 from migrate.versioning import api
 
 from src import db, app
+from src.core.profiling import startup
 
 
 from src.core.database.models import Backup, User
 
 from src.core.database.common import MIGRATION_DIR, SQLITE_URI
 
-LOG_PATH: Final[str] = os.path.join(Path(os.path.dirname(__file__)).parent, "logs\\debug.log")
+LOG_PATH: Final[str] = os.path.join(Path(os.path.dirname(__file__)).parent, "logs", "debug.log")
 
 
 @logger.catch()
@@ -40,7 +41,7 @@ def main() -> None:
         enqueue=True,
         diagnose=True,
     )
-    with app.app_context():
+    with startup.phase("create"), app.app_context():
         db.create_all()
 
         if not os.path.exists(MIGRATION_DIR):
@@ -49,6 +50,7 @@ def main() -> None:
         else:
             api.version_control(SQLITE_URI, MIGRATION_DIR, api.version(MIGRATION_DIR))
         logger.success(f"Database {SQLITE_URI} was created successful!")
+    startup.report()
     logger.remove(handler_id)
 
 
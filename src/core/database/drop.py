@@ -8,11 +8,12 @@ from typing import Final
 from loguru import logger
 from migrate.versioning import api
 from src import db, app
+from src.core.profiling import startup
 from src.core.database.common import SQLITE_URI, MIGRATION_DIR
 
 from src.core.database.models import Backup, User
 
-LOG_PATH: Final[str] = os.path.join(Path(os.path.dirname(__file__)).parent, "logs\\debug.log")
+LOG_PATH: Final[str] = os.path.join(Path(os.path.dirname(__file__)).parent, "logs", "debug.log")
 
 
 @logger.catch()
@@ -36,10 +37,11 @@ def main() -> None:
         enqueue=True,
         diagnose=True,
     )
-    with app.app_context():
+    with startup.phase("drop"), app.app_context():
         db.drop_all()
         api.drop_version_control(SQLITE_URI, MIGRATION_DIR)
         logger.success(f"Database {SQLITE_URI} was dropped successfully!")
+    startup.report()
     logger.remove(handler_id)
 
 
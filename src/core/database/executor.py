@@ -0,0 +1,80 @@
+"""
+Database access for coroutines. SQLAlchemy 1.4 sessions (and SQLite under them) block, so an
+async view that queries directly stalls its event loop for the whole statement. Coroutines
+hand the call to DatabaseExecutor instead: DB_THREADS threads that each keep an app context of
+their own, so a call runs the synchronous helpers as they are, on the thread's session, which
+is removed (ending the transaction, returning the connection) before the result is passed
+back. Results must not be bound to that session: use the row tuples of 'queries'.
+"""
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Callable, Any, TypeVar, Awaitable
+
+from flask import Flask
+
+from src import app, db
+from src.core.metrics import metrics
+
+T = TypeVar("T")
+
+
+class DatabaseExecutor(object):
+    instance: Optional["DatabaseExecutor"] = None
+
+    def __init__(self, flask_app: Flask, threads: int) -> None:
+        self.app = flask_app
+        self.threads = threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def provide(cls) -> "DatabaseExecutor":
+        if not cls.instance:
+            cls.instance = DatabaseExecutor(app, app.config["DB_THREADS"])
+        return cls.instance
+
+    def _start(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.threads, "db", initializer=self._enter_context)
+            return self._executor
+
+    def _enter_context(self) -> None:
+        # Never popped: the context lives as long as the thread and scopes the thread's session.
+        self.app.app_context().push()
+
+    @staticmethod
+    def _call(function: Callable[..., T], args: tuple, kwargs: dict, queued: float) -> T:
+        metrics.observe("app_db_executor_wait_seconds", (), time.perf_counter() - queued)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            db.session.remove()
+
+    async def run(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """ function(*args, **kwargs) on a database thread, awaited without blocking the event loop. """
+        executor = self._executor or self._start()
+        call = functools.partial(self._call, function, args, kwargs, time.perf_counter())
+        return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+def offloaded(function: Callable[..., T]) -> Callable[..., Awaitable[T]]:
+    """ An async version of a synchronous data access function, run by the DatabaseExecutor. """
+
+    @functools.wraps(function)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        return await DatabaseExecutor.provide().run(function, *args, **kwargs)
+
+    return wrapper
+
+
+metrics.histogram("app_db_executor_wait_seconds", "Time database calls of coroutines wait for a database thread.")
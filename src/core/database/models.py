@@ -1,23 +1,38 @@
 import hashlib
+import uuid
 from datetime import datetime
-from typing import Final, Dict, Optional
+from typing import Final, Dict, Optional, List, Tuple
 
 from loguru import logger
+from sqlalchemy import event, text
 
-from src import db, cache, app
-from src.utils import HashVerifier, HashAlg, RSACipher
+from src import db, app
+from src.core.metrics import metrics
+from src.core.storage import backup_filename
+from src import utils
 
 LOGIN_MAX_SIZE: Final[int] = 30
 BACKUP_PER_PAGE: Final[int] = 20
+BACKUPS_PER_USER: Final[int] = 10
+CHECKSUM_SIZE: Final[int] = 128
+UPLOAD_ID_SIZE: Final[int] = 32
+PEER_URL_SIZE: Final[int] = 255
+JTI_SIZE: Final[int] = 64
+JOB_KIND_SIZE: Final[int] = 32
+CHANGE_KIND_SIZE: Final[int] = 16
+# Changes kept per user for the change feed; a client further behind lists the backups again.
+CHANGES_RETAINED: Final[int] = 1000
 
 
 def hash_from_password(password: str | bytes) -> bytes:
-    return HashVerifier.provide().generate_hash(password, HashAlg.SHA512)
+    with metrics.timer("app_kdf_duration_seconds", ("hash",), span="auth"):
+        return utils.HashVerifier.provide().generate_hash(password, utils.HashAlg.SHA512)
 
 
-@cache.memoize(hash_method=hashlib.sha256)
+@metrics.memoize(hash_method=hashlib.sha256)
 def verify_password(input_password: str | bytes, password_hash: str | bytes) -> bool:
-    return HashVerifier.provide().verify_data(input_password, password_hash, HashAlg.SHA512)
+    with metrics.timer("app_kdf_duration_seconds", ("verify",), span="auth"):
+        return utils.HashVerifier.provide().verify_data(input_password, password_hash, utils.HashAlg.SHA512)
 
 
 class User(db.Model):
@@ -38,7 +53,8 @@ class User(db.Model):
 
     @property
     def token(self) -> str:
-        return RSACipher.provide().jwt_encode({"user_id": self.user_id})
+        with metrics.timer("app_jwt_duration_seconds", ("encode",), span="auth"):
+            return utils.RSACipher.provide().jwt_encode({"user_id": self.user_id})
 
     @staticmethod
     def create_user(username: str, password: str) -> "User":
@@ -51,28 +67,292 @@ class User(db.Model):
 
 class Backup(db.Model):
     __tablename__ = "backups"
+    # Listing and search by user: newest first, with date ranges and size filters answered from the index.
+    __table_args__ = (
+        db.Index("ix_backups_user_created", "user_id", "created", "backup_id", "size"),
+        db.Index("ix_backups_user_checksum", "user_id", "checksum"),
+    )
     backup_id = db.Column(db.Integer, primary_key=True, index=True)
     user = db.relationship("User", backref=db.backref("builds", lazy=True))
     user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"))
     created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     comment = db.Column(db.Text)
+    checksum = db.Column(db.String(CHECKSUM_SIZE))
+    size = db.Column(db.BigInteger)
+    verified = db.Column(db.DateTime, index=True)
+    corrupted = db.Column(db.Boolean, nullable=False, default=False)
 
     def format_time_for_path(self) -> str:
         return self.created.strftime("%d-%m-%Y_%H;%M;%S.%f")
 
     @property
     def download_path(self) -> str:
-        return f"{self.backup_id}-{self.user_id} [{self.format_time_for_path()}].zip"
+        return backup_filename(self.backup_id, self.user_id, self.created)
 
     @staticmethod
-    def create(user_id: int, comment: Optional[str] = None) -> "Backup":
+    def create(
+            user_id: int,
+            comment: Optional[str] = None,
+            checksum: Optional[str] = None,
+            size: Optional[int] = None
+    ) -> "Backup":
         return Backup(
             user_id=user_id,
             created=datetime.utcnow(),
-            comment=comment
+            comment=comment,
+            checksum=checksum,
+            size=size,
         )
 
 
+class UserUsage(db.Model):
+    """ Backups and bytes stored by a user, changed in the same transaction as the backups (see src.core.quota). """
+    __tablename__ = "user_usage"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), primary_key=True)
+    backups = db.Column(db.Integer, nullable=False, default=0)
+    bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class UploadSession(db.Model):
+    __tablename__ = "upload_sessions"
+    upload_id = db.Column(db.String(UPLOAD_ID_SIZE), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False, index=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    checksum = db.Column(db.String(CHECKSUM_SIZE), nullable=False)
+    comment = db.Column(db.Text)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    chunks = db.relationship("UploadChunk", cascade="all, delete-orphan", lazy=True)
+
+    @property
+    def chunk_count(self) -> int:
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index: int) -> int:
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def serialize(self, received: List[int]) -> Dict[str, str | int | List[int]]:
+        return {
+            "upload_id": self.upload_id,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "chunks": self.chunk_count,
+            "checksum": self.checksum,
+            "received": received,
+        }
+
+    @staticmethod
+    def create(user_id: int, size: int, chunk_size: int, checksum: str, comment: Optional[str] = None) -> "UploadSession":
+        return UploadSession(
+            upload_id=uuid.uuid4().hex,
+            user_id=user_id,
+            size=size,
+            chunk_size=chunk_size,
+            checksum=checksum.lower(),
+            comment=comment,
+            created=datetime.utcnow(),
+        )
+
+
+class UploadChunk(db.Model):
+    __tablename__ = "upload_chunks"
+    upload_id = db.Column(db.String(UPLOAD_ID_SIZE), db.ForeignKey("upload_sessions.upload_id"), primary_key=True)
+    chunk_index = db.Column(db.Integer, primary_key=True)
+
+
+class ReplicationTask(db.Model):
+    """ Outbox row: one pending operation of one backup for one peer, committed together with the change. """
+    __tablename__ = "replication_outbox"
+    PUT: Final[str] = "put"
+    DELETE: Final[str] = "delete"
+    PENDING: Final[str] = "pending"
+    RUNNING: Final[str] = "running"
+    DONE: Final[str] = "done"
+    FAILED: Final[str] = "failed"
+
+    task_id = db.Column(db.Integer, primary_key=True)
+    backup_id = db.Column(db.Integer, nullable=False, index=True)
+    peer = db.Column(db.String(PEER_URL_SIZE), nullable=False)
+    operation = db.Column(db.String(16), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default=PENDING, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed = db.Column(db.DateTime)
+    synced = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @staticmethod
+    def create(backup_id: int, peer: str, operation: str) -> "ReplicationTask":
+        now = datetime.utcnow()
+        return ReplicationTask(
+            backup_id=backup_id,
+            peer=peer,
+            operation=operation,
+            status=ReplicationTask.PENDING,
+            attempts=0,
+            next_attempt=now,
+            created=now,
+        )
+
+
+class Job(db.Model):
+    """ Durable background job, mostly post-upload processing of one backup; run by 'src.core.jobs.JobQueue'. """
+    __tablename__ = "jobs"
+    __table_args__ = (db.Index("ix_jobs_claim", "status", "priority", "next_attempt"),)
+    CHECKSUM: Final[str] = "checksum"
+    PENDING: Final[str] = "pending"
+    RUNNING: Final[str] = "running"
+    DONE: Final[str] = "done"
+    FAILED: Final[str] = "failed"
+
+    job_id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(JOB_KIND_SIZE), nullable=False)
+    backup_id = db.Column(db.Integer, index=True)
+    # '<kind>:<backup_id>' by default: enqueueing the same work twice is a no-op.
+    dedupe_key = db.Column(db.String(JOB_KIND_SIZE + 32), unique=True)
+    priority = db.Column(db.Integer, nullable=False, default=100)
+    status = db.Column(db.String(16), nullable=False, default=PENDING)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed = db.Column(db.DateTime)
+    finished = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def serialize(self) -> Dict[str, str | int | None]:
+        return {
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "created": str(self.created),
+            "finished": str(self.finished) if self.finished else None,
+            "error": self.last_error,
+        }
+
+
+class BackupChange(db.Model):
+    """
+    A change of a user's backups, numbered per user from 1: the newest 'version' of a user is the
+    version of the collection. Rows are appended by triggers on 'backups' (CHANGES_DDL), in the
+    transaction of the change, so no code path can miss one.
+    """
+    __tablename__ = "backup_changes"
+    CREATED: Final[str] = "created"
+    UPDATED: Final[str] = "updated"
+    DELETED: Final[str] = "deleted"
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    backup_id = db.Column(db.Integer, nullable=False)
+    change = db.Column(db.String(CHANGE_KIND_SIZE), nullable=False)
+
+
+class RevokedToken(db.Model):
+    """ A logged out token; the row is pruned once the token would have expired anyway. """
+    __tablename__ = "revoked_tokens"
+    revocation_id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(JTI_SIZE), unique=True, index=True, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    expires = db.Column(db.DateTime, nullable=False, index=True)
+    revoked = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @staticmethod
+    def create(jti: str, user_id: int, expires: datetime) -> "RevokedToken":
+        return RevokedToken(jti=jti, user_id=user_id, expires=expires, revoked=datetime.utcnow())
+
+
+# Full-text index of the comments, one row per backup (rowid = backup_id) kept by triggers.
+# 'owner' holds "u<user_id>" so a search intersects the user's and the terms' doclists in
+# rowid order instead of filtering every match; contentless, nothing is stored twice.
+SEARCH_TABLE: Final[str] = "backups_fts"
+SEARCH_DDL: Final[Tuple[str, ...]] = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(owner, comment, content='', detail=column)",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON backups BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, owner, comment) VALUES (new.backup_id, 'u' || new.user_id, new.comment);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON backups BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, owner, comment)
+            VALUES ('delete', old.backup_id, 'u' || old.user_id, old.comment);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE OF user_id, comment ON backups BEGIN
+        INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, owner, comment)
+            VALUES ('delete', old.backup_id, 'u' || old.user_id, old.comment);
+        INSERT INTO {SEARCH_TABLE}(rowid, owner, comment) VALUES (new.backup_id, 'u' || new.user_id, new.comment);
+    END""",
+)
+
+
+# The change log (BackupChange) kept by triggers, trimmed to CHANGES_RETAINED rows per user as it grows.
+# Only the listed fields make an update: 'verified' and 'corrupted' change without a new version.
+_CHANGE = "INSERT INTO backup_changes(user_id, version, backup_id, change) SELECT {row}.user_id, " \
+          "coalesce(max(version), 0) + 1, {row}.backup_id, '{change}' FROM backup_changes WHERE user_id = {row}.user_id"
+_PRUNE = "DELETE FROM backup_changes WHERE user_id = {row}.user_id AND version <= " \
+         f"(SELECT max(version) FROM backup_changes WHERE user_id = {{row}}.user_id) - {CHANGES_RETAINED}"
+CHANGES_DDL: Final[Tuple[str, ...]] = (
+    f"""CREATE TRIGGER IF NOT EXISTS backup_changes_insert AFTER INSERT ON backups BEGIN
+        {_CHANGE.format(row="new", change=BackupChange.CREATED)};
+        {_PRUNE.format(row="new")};
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS backup_changes_delete AFTER DELETE ON backups BEGIN
+        {_CHANGE.format(row="old", change=BackupChange.DELETED)};
+        {_PRUNE.format(row="old")};
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS backup_changes_update AFTER UPDATE OF comment, checksum, size ON backups
+        WHEN old.comment IS NOT new.comment OR old.checksum IS NOT new.checksum OR old.size IS NOT new.size BEGIN
+        {_CHANGE.format(row="new", change=BackupChange.UPDATED)};
+        {_PRUNE.format(row="new")};
+    END""",
+)
+
+
+# Columns added to existing tables: 'create_all' only creates missing tables, so databases from before
+# a column get it from '_add_columns'. Old backups start without a checksum and size; the scrubber
+# fills them in from the files.
+ADDED_COLUMNS: Final[Tuple[Tuple[str, str, str], ...]] = (
+    ("backups", "checksum", f"VARCHAR({CHECKSUM_SIZE})"),
+    ("backups", "size", "BIGINT"),
+    ("backups", "verified", "DATETIME"),
+    ("backups", "corrupted", "BOOLEAN NOT NULL DEFAULT 0"),
+)
+
+
+@event.listens_for(db.metadata, "before_create")
+def _add_columns(target, connection, **kw) -> None:
+    """ Runs on every 'create_all', before any index of the new columns is created. """
+    for table, name, ddl in ADDED_COLUMNS:
+        columns = {row[1] for row in connection.execute(text(f"PRAGMA table_info({table})"))}
+        if columns and name not in columns:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+            logger.info(f"Added column {table}.{name}")
+
+
+@event.listens_for(db.metadata, "after_create")
+def _create_search_index(target, connection, **kw) -> None:
+    """
+    Runs on every 'create_all' after '_add_columns', which gives databases from before the
+    indexed columns those columns: such databases get the new indexes, a backfilled full-text
+    index and the change feed's triggers.
+    """
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": SEARCH_TABLE}
+    ).first()
+    for index in Backup.__table__.indexes:
+        index.create(connection, checkfirst=True)
+    for statement in SEARCH_DDL + CHANGES_DDL:
+        connection.execute(text(statement))
+    if not exists:
+        connection.execute(text(
+            f"INSERT INTO {SEARCH_TABLE}(rowid, owner, comment) SELECT backup_id, 'u' || user_id, comment FROM backups"
+        ))
+
+
+@event.listens_for(db.metadata, "before_drop")
+def _drop_search_index(target, connection, **kw) -> None:
+    connection.execute(text(f"DROP TABLE IF EXISTS {SEARCH_TABLE}"))
+
+
 @logger.catch()
 def main() -> None:
     with app.app_context():
@@ -0,0 +1,223 @@
+"""
+Read side of the models: SELECTs built once at import, with bound parameters, so every call
+is a compiled-cache hit, and rows returned as plain NamedTuples of just the columns the
+endpoints use. Rows are cheap to build, to pickle into the memoize cache and to use after
+the session is gone. Everything runs on the caller's 'db.session', which Flask-SQLAlchemy
+scopes to the app context: in a request that is one session and one connection checkout.
+"""
+import re
+from datetime import datetime
+from typing import Optional, List, NamedTuple, Dict, Final, Union, Tuple
+
+from sqlalchemy import select, bindparam, table, column, tuple_, func
+from sqlalchemy.sql import Select
+from sqlalchemy.orm import Session
+
+from src.core.database.models import User, Backup, BackupChange, SEARCH_TABLE
+from src.core.metrics import metrics
+from src import utils
+
+
+class UserRow(NamedTuple):
+    user_id: int
+    login: str
+    joined: datetime
+    password_hash: bytes
+
+    def serialize(self) -> Dict[str, Dict[str, str | int]]:
+        return {
+            "user": {
+                "user_id": self.user_id,
+                "username": self.login,
+                "joined": str(self.joined),
+            }
+        }
+
+    @property
+    def token(self) -> str:
+        with metrics.timer("app_jwt_duration_seconds", ("encode",), span="auth"):
+            return utils.RSACipher.provide().jwt_encode({"user_id": self.user_id})
+
+
+class BackupRow(NamedTuple):
+    """ A backup with its owner's login; all but user_id and login are None for a user without backups. """
+    backup_id: Optional[int]
+    user_id: int
+    login: str
+    created: Optional[datetime]
+    comment: Optional[str]
+    checksum: Optional[str]
+    size: Optional[int]
+    corrupted: Optional[bool]
+
+
+class ChangeRow(NamedTuple):
+    version: int
+    backup_id: int
+    change: str
+
+
+_USER_COLUMNS: Final[tuple] = (User.user_id, User.login, User.joined, User.password_hash)
+_BACKUP_COLUMNS: Final[tuple] = (
+    Backup.backup_id, User.user_id, User.login, Backup.created, Backup.comment, Backup.checksum, Backup.size,
+    Backup.corrupted
+)
+
+SEARCH_INDEX: Final = table(SEARCH_TABLE, column("rowid"), column(SEARCH_TABLE))
+SEARCH_TERM: Final = re.compile(r"(\w+)(\*?)")
+SEARCH_MAX_TERMS: Final[int] = 16
+# Where the next page starts: (created, backup_id) of the last row, or its backup_id for text searches.
+SEARCH_AFTER = Union[Tuple[datetime, int], int, None]
+
+USER_BY_ID: Final = select(*_USER_COLUMNS).where(User.user_id == bindparam("user_id")).limit(1)
+USER_BY_LOGIN: Final = select(*_USER_COLUMNS).where(User.login == bindparam("login")).limit(1)
+USERS_BY_IDS: Final = select(*_USER_COLUMNS).where(User.user_id.in_(bindparam("user_ids", expanding=True)))
+BACKUP_BY_ID: Final = select(*_BACKUP_COLUMNS)\
+    .join(User, User.user_id == Backup.user_id)\
+    .where(Backup.backup_id == bindparam("backup_id"), Backup.user_id == bindparam("user_id"))\
+    .limit(1)
+USER_BACKUPS: Final = select(*_BACKUP_COLUMNS)\
+    .select_from(User)\
+    .join(Backup, Backup.user_id == User.user_id, isouter=True)\
+    .where(User.user_id == bindparam("user_id"))\
+    .limit(bindparam("limit"))
+BACKUPS_BY_IDS: Final = select(*_BACKUP_COLUMNS)\
+    .join(User, User.user_id == Backup.user_id)\
+    .where(Backup.user_id == bindparam("user_id"), Backup.backup_id.in_(bindparam("backup_ids", expanding=True)))
+# Each bound answered from the end of the primary key range of the user (one min/max per SELECT).
+_OLDEST_CHANGE: Final = select(func.min(BackupChange.version)).where(BackupChange.user_id == bindparam("user_id"))
+_NEWEST_CHANGE: Final = select(func.max(BackupChange.version)).where(BackupChange.user_id == bindparam("user_id"))
+COLLECTION_VERSION: Final = select(func.coalesce(_NEWEST_CHANGE.scalar_subquery(), 0))
+CHANGE_WINDOW: Final = select(
+    func.coalesce(_OLDEST_CHANGE.scalar_subquery(), 1), func.coalesce(_NEWEST_CHANGE.scalar_subquery(), 0)
+)
+CHANGES_SINCE: Final = select(BackupChange.version, BackupChange.backup_id, BackupChange.change)\
+    .where(BackupChange.user_id == bindparam("user_id"), BackupChange.version > bindparam("since"))\
+    .order_by(BackupChange.version)\
+    .limit(bindparam("limit"))
+# Newest first: the most recently verified copies of the content are the likeliest to be intact.
+DUPLICATE_BACKUPS: Final = select(*_BACKUP_COLUMNS)\
+    .join(User, User.user_id == Backup.user_id)\
+    .where(
+        Backup.user_id == bindparam("user_id"), Backup.checksum == bindparam("checksum"),
+        Backup.size == bindparam("size"), Backup.corrupted.is_(False)
+    )\
+    .order_by(Backup.backup_id.desc())\
+    .limit(bindparam("limit"))
+
+
+def user_by_id(session: Session, user_id: int) -> Optional[UserRow]:
+    row = session.execute(USER_BY_ID, {"user_id": user_id}).first()
+    return UserRow._make(row) if row is not None else None
+
+
+def user_by_login(session: Session, login: str) -> Optional[UserRow]:
+    row = session.execute(USER_BY_LOGIN, {"login": login}).first()
+    return UserRow._make(row) if row is not None else None
+
+
+def users_by_ids(session: Session, user_ids: List[int]) -> Dict[int, UserRow]:
+    """ The users found among 'user_ids' by id, in one query. """
+    if not user_ids:
+        return {}
+    rows = session.execute(USERS_BY_IDS, {"user_ids": user_ids})
+    return {row.user_id: row for row in map(UserRow._make, rows)}
+
+
+def backup_by_id(session: Session, backup_id: int, user_id: int) -> Optional[BackupRow]:
+    row = session.execute(BACKUP_BY_ID, {"backup_id": backup_id, "user_id": user_id}).first()
+    return BackupRow._make(row) if row is not None else None
+
+
+def user_backups(session: Session, user_id: int, limit: int) -> List[BackupRow]:
+    return [BackupRow._make(row) for row in session.execute(USER_BACKUPS, {"user_id": user_id, "limit": limit})]
+
+
+def backups_by_ids(session: Session, user_id: int, backup_ids: List[int]) -> Dict[int, BackupRow]:
+    """ The user's backups found among 'backup_ids' by id, in one query. """
+    if not backup_ids:
+        return {}
+    rows = session.execute(BACKUPS_BY_IDS, {"user_id": user_id, "backup_ids": backup_ids})
+    return {row.backup_id: row for row in map(BackupRow._make, rows)}
+
+
+def collection_version(session: Session, user_id: int) -> int:
+    """ The number of the user's last change of backups, 0 before the first one. """
+    return session.execute(COLLECTION_VERSION, {"user_id": user_id}).scalar_one()
+
+
+def change_window(session: Session, user_id: int) -> Tuple[int, int]:
+    """ The oldest version still in the change log of the user and the newest (the collection version). """
+    oldest, newest = session.execute(CHANGE_WINDOW, {"user_id": user_id}).one()
+    return oldest, newest
+
+
+def changes_since(session: Session, user_id: int, since: int, limit: int) -> List[ChangeRow]:
+    return [ChangeRow._make(row) for row in session.execute(
+        CHANGES_SINCE, {"user_id": user_id, "since": since, "limit": limit}
+    )]
+
+
+def duplicate_backups(session: Session, user_id: int, checksum: str, size: int, limit: int) -> List[BackupRow]:
+    """ The user's intact backups with exactly this content, newest first. """
+    return [BackupRow._make(row) for row in session.execute(
+        DUPLICATE_BACKUPS, {"user_id": user_id, "checksum": checksum, "size": size, "limit": limit}
+    )]
+
+
+class SearchFilter(NamedTuple):
+    text: Optional[str] = None
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    size_min: Optional[int] = None
+    size_max: Optional[int] = None
+
+
+def match_expression(user_id: int, text: str) -> Optional[str]:
+    """
+    The FTS5 MATCH of a user's words: every word (a trailing * makes it a prefix) must be in
+    the comment. Only words go in, quoted, so no input is FTS5 syntax; None without words.
+    """
+    terms = [f'"{word}"{star}' for word, star in SEARCH_TERM.findall(text)[:SEARCH_MAX_TERMS]]
+    if not terms:
+        return None
+    return f'owner : "u{user_id}" AND comment : ({" AND ".join(terms)})'
+
+
+def search_statement(user_id: int, search: SearchFilter, after: SEARCH_AFTER, limit: int) -> Select:
+    """
+    A page of the user's backups matching 'search', keyset paginated from 'after'. Without text
+    they come newest first from ix_backups_user_created; with text, by descending backup_id from
+    the full-text index (the same order for backups created here), filtered by the rest.
+    """
+    query = select(*_BACKUP_COLUMNS).join(User, User.user_id == Backup.user_id).where(Backup.user_id == user_id)
+    match = match_expression(user_id, search.text) if search.text else None
+    if match is not None:
+        query = query.join(SEARCH_INDEX, SEARCH_INDEX.c.rowid == Backup.backup_id)\
+            .where(SEARCH_INDEX.c[SEARCH_TABLE].op("MATCH")(match))\
+            .order_by(SEARCH_INDEX.c.rowid.desc())
+        if after is not None:
+            query = query.where(SEARCH_INDEX.c.rowid < after)
+    else:
+        query = query.order_by(Backup.created.desc(), Backup.backup_id.desc())
+        if after is not None:
+            query = query.where(tuple_(Backup.created, Backup.backup_id) < tuple_(*after))
+    if search.created_from is not None:
+        query = query.where(Backup.created >= search.created_from)
+    if search.created_to is not None:
+        query = query.where(Backup.created < search.created_to)
+    if search.size_min is not None:
+        query = query.where(Backup.size >= search.size_min)
+    if search.size_max is not None:
+        query = query.where(Backup.size <= search.size_max)
+    return query.limit(limit)
+
+
+def search_backups(
+        session: Session,
+        user_id: int,
+        search: SearchFilter,
+        after: SEARCH_AFTER,
+        limit: int
+) -> List[BackupRow]:
+    return [BackupRow._make(row) for row in session.execute(search_statement(user_id, search, after, limit))]
@@ -0,0 +1,92 @@
+"""
+Upload precheck. A client announces the SHA-256 and size of a backup before sending it: when
+the user already stores that content, the new backup is made from the stored file (a hard
+link) and nothing is uploaded; otherwise the client gets an upload token for the upload, signed
+with UPLOAD_TOKEN_SECRET, which binds it to that checksum and size. Matching stays within a user's own backups, so the
+answer tells nobody whether someone else stores a file.
+"""
+import os
+from typing import Optional, NamedTuple, Final
+
+from flask import current_app
+from itsdangerous import URLSafeTimedSerializer, BadData
+
+from src import db
+from src.core.database.models import Backup, ReplicationTask
+from src.core.database.queries import BackupRow, duplicate_backups
+from src.core.metrics import metrics
+from src.core.quota import charge_usage
+from src.core.replication import enqueue_replication
+from src.core.storage import backup_path, blob_size, link_blob
+
+UPLOAD_TOKEN_SALT: Final[str] = "backups-upload-token"
+# Copies checked for a file that is still there with the right size, newest first.
+DUPLICATE_CANDIDATES: Final[int] = 4
+
+
+class UploadGrant(NamedTuple):
+    """ What a token lets its user upload; 'comment' is for a backup made without the upload's form. """
+    user_id: int
+    checksum: str
+    size: int
+    comment: Optional[str]
+
+
+def _serializer() -> Optional[URLSafeTimedSerializer]:
+    """ None without UPLOAD_TOKEN_SECRET: the public SECRET_KEY mustn't sign capabilities. """
+    secret = current_app.config["UPLOAD_TOKEN_SECRET"]
+    return URLSafeTimedSerializer(secret, salt=UPLOAD_TOKEN_SALT) if secret else None
+
+
+def sign_upload_token(grant: UploadGrant) -> Optional[str]:
+    """ The token of the grant, or None when tokens are disabled. """
+    serializer = _serializer()
+    return serializer.dumps(list(grant)) if serializer is not None else None
+
+
+def load_upload_token(token: str, user_id: int) -> Optional[UploadGrant]:
+    """ The grant of an unexpired token issued to 'user_id', or None. """
+    serializer = _serializer()
+    if serializer is None:
+        return None
+    try:
+        grant = UploadGrant._make(serializer.loads(token, max_age=current_app.config["UPLOAD_TOKEN_MAX_AGE"]))
+    except (BadData, TypeError, ValueError):
+        return None
+    return grant if grant.user_id == user_id else None
+
+
+def find_duplicate(user_id: int, checksum: str, size: int) -> Optional[BackupRow]:
+    """ A backup of the user with this content whose file is in storage, or None. """
+    if not current_app.config["UPLOAD_DEDUPLICATION"]:
+        return None
+    for row in duplicate_backups(db.session, user_id, checksum.lower(), size, DUPLICATE_CANDIDATES):
+        try:
+            if blob_size(backup_path(row)) == size:
+                return row
+        except OSError:
+            continue  # deleted meanwhile, or lost: the scrubber marks it
+    return None
+
+
+def clone_backup(user_id: int, source: BackupRow, comment: Optional[str]) -> Backup:
+    """
+    Commits a new, ready backup of the content of 'source'. Raises QuotaExceeded (with the
+    session rolled back by the caller) before anything is stored.
+    """
+    backup = Backup.create(user_id, comment, source.checksum, source.size)
+    backup.verified = backup.created
+    db.session.add(backup)
+    db.session.flush()
+    charge_usage(user_id, 1, source.size)
+    path = backup_path(backup)
+    link_blob(backup_path(source), path)
+    try:
+        enqueue_replication(backup.backup_id, ReplicationTask.PUT)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        os.remove(path)
+        raise
+    metrics.inc("app_upload_deduplicated_bytes_total", amount=source.size)
+    return backup
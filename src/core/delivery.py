@@ -0,0 +1,193 @@
+import os
+from typing import Optional, Callable, Iterator, Final
+from urllib.parse import quote
+
+from flask import Response, current_app, request, send_file
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.serving import WSGIRequestHandler
+from werkzeug.wsgi import wrap_file
+
+from src.core.storage import open_blob
+from src.utils import ContentType, BYTES_IN_MB
+from src.utils.sealed import is_sealed
+
+STREAM: Final[str] = "stream"
+SENDFILE: Final[str] = "sendfile"
+X_ACCEL: Final[str] = "x-accel"
+X_SENDFILE: Final[str] = "x-sendfile"
+MODES: Final[tuple] = (STREAM, SENDFILE, X_ACCEL, X_SENDFILE)
+# The environ key of 'socket.sendfile' on the connection, set by SendfileRequestHandler.
+SENDFILE_ENVIRON_KEY: Final[str] = "backups.sendfile"
+SENDFILE_BLOCK_SIZE: Final[int] = BYTES_IN_MB
+
+SEND = Callable[[object, int, int], int]
+
+
+class ContinueInput(object):
+    """ Request body that sends the interim '100 Continue' when it's first read. """
+
+    def __init__(self, stream, send_continue: Callable[[], None]) -> None:
+        self.stream = stream
+        self._send_continue: Optional[Callable[[], None]] = send_continue
+
+    def _continue(self) -> None:
+        if self._send_continue is not None:
+            self._send_continue()
+            self._send_continue = None
+
+    def read(self, *args) -> bytes:
+        self._continue()
+        return self.stream.read(*args)
+
+    def readline(self, *args) -> bytes:
+        self._continue()
+        return self.stream.readline(*args)
+
+    def readinto(self, buffer) -> int:
+        self._continue()
+        return self.stream.readinto(buffer)
+
+    def __iter__(self) -> Iterator[bytes]:
+        self._continue()
+        return iter(self.stream)
+
+
+class SendfileRequestHandler(WSGIRequestHandler):
+    """
+    The development server's handler, also exposing zero-copy sends on its socket to
+    SendfileBody. For 'Expect: 100-continue' it sends '100 Continue' only once the app reads
+    the body (http.server and werkzeug send it before the app runs), so a request refused from its headers
+    (quota, duplicate upload, admission) is answered before the client sends any of the body
+    (werkzeug closes every connection, so an unread body is never taken for the next request).
+    """
+    _continue_pending: bool = False
+
+    def handle_expect_100(self) -> bool:
+        return True  # http.server would send it from 'parse_request'
+
+    def run_wsgi(self) -> None:
+        self._continue_pending = self.headers.get("Expect", "").lower().strip() == "100-continue"
+        if self._continue_pending:
+            del self.headers["Expect"]
+        super().run_wsgi()
+
+    def make_environ(self):
+        environ = super().make_environ()
+        environ[SENDFILE_ENVIRON_KEY] = self.send_file_range
+        if self._continue_pending:
+            environ["HTTP_EXPECT"] = "100-continue"
+            environ["wsgi.input"] = ContinueInput(environ["wsgi.input"], self._send_continue)
+        return environ
+
+    def _send_continue(self) -> None:
+        self._continue_pending = False
+        self.wfile.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+    def send_file_range(self, file, offset: int, count: int) -> int:
+        self.wfile.flush()
+        return self.connection.sendfile(file, offset, count)
+
+
+class SendfileBody(object):
+    """
+    Response body of 'count' bytes of the file from 'offset'. The first (empty) block makes
+    the server write the status and headers, then the bytes go from the page cache to the
+    socket with os.sendfile. Without SendfileRequestHandler it reads and yields blocks.
+    'on_chunk' is called with the bytes of each block (the download pacing hooks in there).
+    """
+
+    def __init__(self, path: str, offset: int, count: int, send: Optional[SEND]) -> None:
+        self.path = path
+        self.offset = offset
+        self.count = count
+        self.send = send
+        self.on_chunk: Optional[Callable[[int, bool], None]] = None
+
+    def __iter__(self) -> Iterator[bytes]:
+        with open(self.path, "rb") as file:
+            offset, end = self.offset, self.offset + self.count
+            if self.send is not None:
+                yield b""
+            else:
+                file.seek(offset)
+            while offset < end:
+                size = min(SENDFILE_BLOCK_SIZE, end - offset)
+                if self.send is not None:
+                    sent = self.send(file, offset, size)
+                    if not sent:
+                        break  # the file was truncated under us
+                else:
+                    block = file.read(size)
+                    if not block:
+                        break
+                    sent = len(block)
+                    yield block
+                offset += sent
+                if self.on_chunk is not None:
+                    self.on_chunk(sent, False)
+            if self.on_chunk is not None:
+                self.on_chunk(0, True)
+
+
+def _sendfile_response(path: str) -> Response:
+    response = send_file(path)
+    if request.method == "HEAD" or response.status_code not in (200, 206):
+        return response
+    if response.status_code == 206:
+        offset, count = response.content_range.start, response.content_range.stop - response.content_range.start
+    else:
+        offset, count = 0, response.content_length
+    response.response.close()
+    response.response = SendfileBody(path, offset, count, request.environ.get(SENDFILE_ENVIRON_KEY, None))
+    return response
+
+
+def _proxy_response(path: str, mode: str) -> Response:
+    """ Headers only: the fronting proxy sends the file, with its own range and conditional handling. """
+    response = Response(status=200, mimetype=ContentType.APPLICATION_ZIP)
+    if mode == X_ACCEL:
+        relative = os.path.relpath(path, current_app.config["USER_BACKUPS_PATH"])
+        response.headers["X-Accel-Redirect"] = current_app.config["DOWNLOAD_ACCEL_PREFIX"] + quote(relative)
+        rate = current_app.config["DOWNLOAD_BYTES_PER_SECOND"]
+        if rate > 0:
+            response.headers["X-Accel-Limit-Rate"] = str(rate)  # per connection, nginx can't pace per user
+    else:
+        response.headers["X-Sendfile"] = path
+    return response
+
+
+def _sealed_response(path: str) -> Response:
+    """ 'send_file' of the decrypting stream: the same headers, conditional requests and ranges on the plaintext. """
+    file = open_blob(path)
+    stat = os.stat(path)
+    response = send_file(
+        file, mimetype=ContentType.APPLICATION_ZIP, download_name=os.path.basename(path),
+        last_modified=stat.st_mtime, etag=f"{stat.st_mtime}-{file.size}-sealed", conditional=False
+    )
+    response.response = wrap_file(request.environ, file, SENDFILE_BLOCK_SIZE)  # whole chunks, not 8 KiB reads
+    response.content_length = file.size
+    try:
+        return response.make_conditional(request.environ, accept_ranges=True, complete_length=file.size)
+    except RequestedRangeNotSatisfiable:
+        file.close()
+        raise
+
+
+def deliver_file(path: str) -> Response:
+    """
+    The download response of a stored file by DOWNLOAD_DELIVERY_MODE:
+      stream      'send_file': a worker thread copies the file through Python in blocks;
+      sendfile    the same headers and ranges, bytes sent with os.sendfile (zero-copy);
+      x-accel     an 'X-Accel-Redirect' to DOWNLOAD_ACCEL_PREFIX for nginx to serve;
+      x-sendfile  an 'X-Sendfile' with the path for Apache mod_xsendfile or lighttpd.
+    With the proxy modes the worker is done as soon as the request is authorized. Sealed
+    files (STORAGE_ENCRYPTION) are decrypted by the worker in every mode.
+    """
+    if is_sealed(path):
+        return _sealed_response(path)
+    mode = current_app.config["DOWNLOAD_DELIVERY_MODE"]
+    if mode in (X_ACCEL, X_SENDFILE):
+        return _proxy_response(path, mode)
+    if mode == SENDFILE:
+        return _sendfile_response(path)
+    return send_file(path)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Iterator
+
+from flask import Flask
+from loguru import logger
+from sqlalchemy import nulls_first
+
+from src import app, db, cache
+from src.api.routes.common import find_backup_by_id
+from src.core.database.models import Backup
+from src.core.storage import backup_path, blob_checksum, blob_size
+from src.utils import ChecksumHash, SealedFileError, checksum_many
+
+
+class RateBudget(object):
+    """ Paces reads to 'bytes_per_second' (a token bucket holding at most one second of budget). """
+
+    def __init__(self, bytes_per_second: int) -> None:
+        self.bytes_per_second = bytes_per_second
+        self._tokens = float(bytes_per_second)
+        self._last = time.monotonic()
+
+    def consume(self, amount: int) -> None:
+        if self.bytes_per_second <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.bytes_per_second, self._tokens + (now - self._last) * self.bytes_per_second)
+        self._last = now
+        self._tokens -= amount
+        if self._tokens < 0:
+            time.sleep(-self._tokens / self.bytes_per_second)
+
+
+class Scrubber(object):
+    """
+    Re-hashes stored backups in the background, least recently verified first, at
+    SCRUB_BYTES_PER_SECOND, and flags the ones whose content no longer matches the
+    checksum stored at upload. Backups uploaded before checksums existed get one.
+    """
+    instance: Optional["Scrubber"] = None
+
+    def __init__(self, flask_app: Flask) -> None:
+        self.app = flask_app
+        self.bytes_per_second: int = flask_app.config["SCRUB_BYTES_PER_SECOND"]
+        self.interval: float = flask_app.config["SCRUB_INTERVAL"]
+        self.batch_size: int = flask_app.config["SCRUB_BATCH_SIZE"]
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def provide(cls) -> "Scrubber":
+        if not cls.instance:
+            cls.instance = Scrubber(app)
+        return cls.instance
+
+    def start(self) -> None:
+        if self.bytes_per_second <= 0 or self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="scrubber", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                stats = self.scrub()
+                logger.info(f"Scrub pass finished: {stats}")
+            except Exception as error:
+                logger.error(f"Scrub pass failed: {type(error).__name__}: {error}")
+            self._stopping.wait(self.interval)
+
+    def scrub(self, budget: Optional[RateBudget] = None) -> Dict[str, int]:
+        """ Runs one pass over every backup verified before the pass started. """
+        budget = budget or RateBudget(self.bytes_per_second)
+        started = datetime.utcnow()
+        stats = {"verified": 0, "corrupted": 0, "missing": 0, "bytes": 0}
+        while not self._stopping.is_set():
+            with self.app.app_context():
+                backups: List[Backup] = Backup.query\
+                    .filter((Backup.verified == None) | (Backup.verified < started))\
+                    .order_by(nulls_first(Backup.verified.asc()))\
+                    .limit(self.batch_size)\
+                    .all()
+                if not backups:
+                    return stats
+                for backup in backups:
+                    if self._stopping.is_set():
+                        break
+                    self._verify(backup, budget, stats)
+                    db.session.commit()
+        return stats
+
+    @staticmethod
+    def _verify(backup: Backup, budget: RateBudget, stats: Dict[str, int]) -> None:
+        path = backup_path(backup)
+        was_corrupted = backup.corrupted
+        backup.verified = datetime.utcnow()
+        if not os.path.exists(path):
+            backup.corrupted = True
+            stats["missing"] += 1
+            logger.error(f"Backup {backup.backup_id}: file {path} is missing!")
+        else:
+            try:
+                checksum = blob_checksum(path, on_chunk=budget.consume)
+            except SealedFileError as error:
+                checksum = None
+                logger.error(f"Backup {backup.backup_id}: {error}")
+            stats["bytes"] += os.path.getsize(path)
+            if backup.checksum is None and checksum is not None:
+                backup.checksum, backup.size = checksum, blob_size(path)
+            backup.corrupted = checksum is None or checksum != backup.checksum
+            if backup.corrupted:
+                stats["corrupted"] += 1
+                logger.error(f"Backup {backup.backup_id}: checksum mismatch ({checksum} != {backup.checksum})!")
+        stats["verified"] += 1
+        if backup.corrupted != was_corrupted:
+            cache.delete_memoized(find_backup_by_id)
+
+
+def iter_files(paths: List[str]) -> Iterator[str]:
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in names:
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backup integrity tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    scan = commands.add_parser("scan", help="hash files in parallel, several digests per pass")
+    scan.add_argument("paths", nargs="+")
+    scan.add_argument("--algorithms", nargs="+", default=["SHA_256"], choices=[alg.name for alg in ChecksumHash])
+    scan.add_argument("--workers", type=int, default=None)
+    scrub = commands.add_parser("scrub", help="verify every stored backup against its checksum once")
+    scrub.add_argument("--bytes-per-second", type=int, default=0, help="0 means unthrottled")
+    args = parser.parse_args()
+
+    if args.command == "scan":
+        report: Dict[str, Any] = {}
+        for path, digests in checksum_many(iter_files(args.paths), [ChecksumHash[name] for name in args.algorithms], args.workers):
+            report[str(path)] = str(digests) if isinstance(digests, OSError) \
+                else {alg.name: digest for alg, digest in digests.items()}
+        print(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(Scrubber.provide().scrub(RateBudget(args.bytes_per_second))))
+
+
+if __name__ == "__main__":
+    main()
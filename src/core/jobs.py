@@ -0,0 +1,232 @@
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Callable, NamedTuple, Tuple
+
+from flask import Flask
+from loguru import logger
+from sqlalchemy.dialects.sqlite import insert
+
+from src import app, db, cache
+from src.api.routes.common import find_backup_by_id
+from src.core.database.models import Backup, Job, ReplicationTask
+from src.core.metrics import metrics
+from src.core.replication import Replicator, enqueue_replication
+from src.core.storage import backup_path, blob_checksum, blob_size
+
+
+class ClaimedJob(NamedTuple):
+    job_id: int
+    kind: str
+    backup_id: Optional[int]
+    attempts: int
+
+
+class JobKind(NamedTuple):
+    handler: Callable[[ClaimedJob], None]
+    priority: int
+    concurrency: int
+
+
+def enqueue_job(kind: str, backup_id: Optional[int] = None, priority: Optional[int] = None,
+                dedupe_key: Optional[str] = None) -> None:
+    """
+    Adds the job to the current session: the caller commits it together with the change
+    it belongs to, then calls 'JobQueue.provide().notify()'. Enqueueing a job whose
+    dedupe key (by default '<kind>:<backup_id>') already exists does nothing.
+    """
+    if priority is None:
+        priority = JobQueue.provide().kinds[kind].priority
+    if dedupe_key is None and backup_id is not None:
+        dedupe_key = f"{kind}:{backup_id}"
+    now = datetime.utcnow()
+    db.session.execute(insert(Job).values(
+        kind=kind,
+        backup_id=backup_id,
+        dedupe_key=dedupe_key,
+        priority=priority,
+        status=Job.PENDING,
+        attempts=0,
+        next_attempt=now,
+        created=now,
+    ).on_conflict_do_nothing(index_elements=["dedupe_key"]))
+
+
+def checksum_backup(job: ClaimedJob) -> None:
+    """ Hashes a freshly uploaded backup, then hands it over to replication. Safe to run twice. """
+    backup = db.session.get(Backup, job.backup_id)
+    if backup is None:
+        return  # deleted meanwhile
+    path = backup_path(backup)
+    checksum = blob_checksum(path)
+    backup.checksum, backup.size, backup.verified = checksum, blob_size(path), datetime.utcnow()
+    enqueue_replication(backup.backup_id, ReplicationTask.PUT)
+    db.session.commit()
+    cache.delete_memoized(find_backup_by_id)
+    Replicator.provide().notify()
+
+
+class JobQueue(object):
+    """
+    Durable job queue in the 'jobs' table and a pool of JOBS_WORKERS threads started with
+    the app. Jobs are claimed atomically (status update guarded by the old status), so any
+    number of workers and processes may share the table; a claim older than
+    JOBS_CLAIM_TIMEOUT (a worker that died, or a result that couldn't be stored) is released
+    again, looked for every half of that timeout rather than on each poll. Jobs run by
+    priority (lower first), then in order; JOBS_CONCURRENCY caps the running jobs of each
+    kind per process.
+    A failed job is retried with jittered exponential backoff up to JOBS_MAX_ATTEMPTS, so
+    handlers must be idempotent.
+    """
+    instance: Optional["JobQueue"] = None
+
+    def __init__(self, flask_app: Flask) -> None:
+        self.app = flask_app
+        self.workers: int = flask_app.config["JOBS_WORKERS"]
+        self.concurrency: Dict[str, int] = flask_app.config["JOBS_CONCURRENCY"]
+        self.poll_interval: float = flask_app.config["JOBS_POLL_INTERVAL"]
+        self.max_attempts: int = flask_app.config["JOBS_MAX_ATTEMPTS"]
+        self.max_backoff: float = flask_app.config["JOBS_MAX_BACKOFF"]
+        self.claim_timeout: float = flask_app.config["JOBS_CLAIM_TIMEOUT"]
+        self.kinds: Dict[str, JobKind] = {}
+        self._running: Dict[str, int] = {}
+        self._released = float("-inf")
+        self._claim_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    @classmethod
+    def provide(cls) -> "JobQueue":
+        if not cls.instance:
+            cls.instance = JobQueue(app)
+            cls.instance.register(Job.CHECKSUM, checksum_backup, priority=10)
+        return cls.instance
+
+    def register(self, kind: str, handler: Callable[[ClaimedJob], None], priority: int = 100) -> None:
+        self.kinds[kind] = JobKind(handler, priority, self.concurrency.get(kind, self.workers))
+        self._running.setdefault(kind, 0)
+
+    def start(self) -> None:
+        if self._threads or self.workers <= 0:
+            return
+        self._stopping.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"jobs-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def notify(self) -> None:
+        """ Wakes a worker up after a commit instead of waiting for the next poll; one commit, one job. """
+        with self._wakeup:
+            self._wakeup.notify()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+            except Exception as error:
+                logger.error(f"Job claim failed: {type(error).__name__}: {error}")
+                job = None
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            try:
+                self._execute(job)
+            except Exception as error:
+                # The claim stays until it times out, then the job is retried.
+                logger.error(f"Job {job.kind} of backup {job.backup_id} not finished: {type(error).__name__}: {error}")
+            finally:
+                with self._claim_lock:
+                    self._running[job.kind] -= 1
+
+    def _claim(self) -> Optional[ClaimedJob]:
+        with self._claim_lock, self.app.app_context():
+            kinds = [kind for kind, spec in self.kinds.items() if self._running[kind] < spec.concurrency]
+            if not kinds:
+                return None
+            now = datetime.utcnow()
+            if time.monotonic() - self._released >= self.claim_timeout / 2:
+                self._release_stale(now)
+            candidates: List[Tuple[int, str, Optional[int], int]] = db.session.query(
+                Job.job_id, Job.kind, Job.backup_id, Job.attempts
+            ).filter(
+                Job.status == Job.PENDING,
+                Job.next_attempt <= now,
+                Job.kind.in_(kinds)
+            ).order_by(Job.priority, Job.job_id).limit(4).all()
+            for job_id, kind, backup_id, attempts in candidates:
+                updated = Job.query.filter_by(job_id=job_id, status=Job.PENDING)\
+                    .update({"status": Job.RUNNING, "claimed": now}, synchronize_session=False)
+                if updated:
+                    db.session.commit()
+                    self._running[kind] += 1
+                    return ClaimedJob(job_id, kind, backup_id, attempts)
+            db.session.rollback()  # nothing claimed: only ends the read transaction
+            return None
+
+    def _release_stale(self, now: datetime) -> None:
+        self._released = time.monotonic()
+        released = Job.query.filter(
+            Job.status == Job.RUNNING,
+            Job.claimed < now - timedelta(seconds=self.claim_timeout)
+        ).update({"status": Job.PENDING}, synchronize_session=False)
+        db.session.commit()
+        if released:
+            logger.warning(f"Released {released} stale job claim(s)")
+
+    def _execute(self, job: ClaimedJob) -> None:
+        error = None
+        with self.app.app_context():
+            try:
+                with metrics.timer("app_job_duration_seconds", (job.kind,)):
+                    self.kinds[job.kind].handler(job)
+            except Exception as exception:
+                db.session.rollback()
+                error = f"{type(exception).__name__}: {exception}"
+            self._finish(job, error)
+
+    def _finish(self, job: ClaimedJob, error: Optional[str]) -> None:
+        now = datetime.utcnow()
+        row = db.session.get(Job, job.job_id)
+        if row is None:
+            return
+        if error is None:
+            row.status, row.finished, row.last_error = Job.DONE, now, None
+            metrics.inc("app_jobs_total", (job.kind, Job.DONE))
+        else:
+            row.attempts = job.attempts + 1
+            row.last_error = error
+            if row.attempts >= self.max_attempts:
+                row.status, row.finished = Job.FAILED, now
+                metrics.inc("app_jobs_total", (job.kind, Job.FAILED))
+                logger.error(f"Job {job.kind} of backup {job.backup_id} failed: {error}")
+            else:
+                backoff = random.uniform(0, min(self.max_backoff, 2 ** row.attempts))
+                row.status, row.next_attempt = Job.PENDING, now + timedelta(seconds=backoff)
+                metrics.inc("app_jobs_total", (job.kind, "retried"))
+                logger.warning(f"Job {job.kind} of backup {job.backup_id} will be retried: {error}")
+        db.session.commit()
+
+
+def backup_state(jobs: List[Job]) -> str:
+    statuses = {job.status for job in jobs}
+    if Job.FAILED in statuses:
+        return "failed"
+    if statuses & {Job.PENDING, Job.RUNNING}:
+        return "processing"
+    return "ready"
+
+
+metrics.histogram("app_job_duration_seconds", "Background job run time by kind.", ("kind",))
+metrics.counter("app_jobs_total", "Finished background jobs by kind and outcome.", ("kind", "result"))
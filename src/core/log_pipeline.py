@@ -0,0 +1,221 @@
+import atexit
+import collections
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional, Dict, Tuple, List, Final, Any
+
+from flask import Flask, Response, request, g
+from loguru import logger
+
+from src import app
+from src.core.metrics import metrics
+from src.utils import logs
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process per log file
+    fcntl = None
+
+ACCESS: Final[str] = "access"
+TEXT_FORMAT: Final[str] = \
+    "{time:DD-MM-YYYY, HH:mm:ss.SSSSSS} — {message} [{name}:{function}:{line}] | {level} {extra}"
+
+
+def to_json(record: Dict[str, Any]) -> str:
+    entry = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "message": record["message"],
+        "logger": record["name"],
+        "function": record["function"],
+        "line": record["line"],
+        "process": record["process"].id,
+        "thread": record["thread"].name,
+    }
+    for key, value in record["extra"].items():
+        entry.setdefault(key, value)
+    if record["exception"] is not None:
+        entry["exception"] = "".join(traceback.format_exception(*record["exception"]))
+    return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class JsonFileSink(object):
+    """
+    Loguru sink that only appends the record to a bounded deque; a background thread turns
+    the pending records into JSON lines and writes them in one call every 'flush_interval'.
+    When the file outgrows 'max_bytes' it is rotated to '<path>.1' ... '<path>.<backups>'
+    under an flock, and workers still writing to a rotated file notice the new inode and
+    reopen the path. A full queue drops records instead of blocking the request.
+    """
+
+    def __init__(self, path: str, max_bytes: int, backups: int, queue_size: int, flush_interval: float) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.dropped = 0
+        self._pending: collections.deque = collections.deque()
+        self._file = None
+        self._flush_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __call__(self, message) -> None:
+        if len(self._pending) >= self.queue_size:
+            self.dropped += 1
+            return
+        self._pending.append(message.record)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._open()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as error:
+                sys.stderr.write(f"Log writer failed: {type(error).__name__}: {error}\n")
+
+    def _open(self) -> None:
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            if self._file is None or not self._pending:
+                return
+            lines: List[str] = []
+            with contextlib.suppress(IndexError):
+                while True:
+                    lines.append(to_json(self._pending.popleft()))
+            self._reopen_if_rotated()
+            self._file.write("\n".join(lines) + "\n")
+            self._file.flush()
+            self.written += len(lines)
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+
+    def _reopen_if_rotated(self) -> None:
+        try:
+            rotated = os.stat(self.path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            rotated = True
+        if rotated:
+            self._file.close()
+            self._open()
+
+    def _rotate(self) -> None:
+        with open(self.path + ".lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another worker may have rotated it while this one waited for the lock.
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                for index in range(self.backups - 1, 0, -1):
+                    if os.path.exists(f"{self.path}.{index}"):
+                        os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+                os.replace(self.path, f"{self.path}.1")
+        self._file.close()
+        self._open()
+
+
+class LogPipeline(object):
+    """
+    Production logging: JSON lines written by a background thread (JsonFileSink), levels and
+    sampling per category. The category is the one bound to the logger (see
+    'src.utils.logs.get_logger') or the module name, matched by dotted prefix against
+    LOG_LEVELS and LOG_SAMPLING; records below WARNING are kept with the sampled probability.
+    Hot paths log through 'get_logger', which applies the same rules before loguru builds
+    a record. With LOG_STDERR the records are also printed as text.
+    """
+    instance: Optional["LogPipeline"] = None
+
+    def __init__(self, flask_app: Flask) -> None:
+        self.app = flask_app
+        self.levels: Dict[str, str] = dict(flask_app.config["LOG_LEVELS"])
+        self.sampling: Dict[str, float] = dict(flask_app.config["LOG_SAMPLING"])
+        self.sink = JsonFileSink(
+            flask_app.config["LOG_PATH"],
+            flask_app.config["LOG_MAX_BYTES"],
+            flask_app.config["LOG_BACKUPS"],
+            flask_app.config["LOG_QUEUE_SIZE"],
+            flask_app.config["LOG_FLUSH_INTERVAL"],
+        )
+        self.stderr: bool = flask_app.config["LOG_STDERR"]
+
+    @classmethod
+    def provide(cls) -> "LogPipeline":
+        if not cls.instance:
+            cls.instance = LogPipeline(app)
+            metrics.add_collector(cls.instance.counters)
+        return cls.instance
+
+    @staticmethod
+    def _filter(record: Dict[str, Any]) -> bool:
+        extra = record["extra"]
+        category = extra.get("category", None) or record["name"] or ""
+        if "sample_rate" in extra:  # already sampled by a CategoryLogger
+            return record["level"].no >= logs.rule(category)[0]
+        return logs.keep(record["level"].no, category)
+
+    def init_app(self) -> None:
+        """ Replaces the loguru handlers (the default one writes synchronously to stderr). """
+        logs.configure(self.levels, self.sampling)
+        minimum = min((logs.level_no(level) for level in self.levels.values()), default=logs.level_no("INFO"))
+        logger.remove()
+        logger.add(self.sink, level=minimum, format="{message}", filter=self._filter, catch=True)
+        if self.stderr:
+            logger.add(sys.stderr, level=minimum, format=TEXT_FORMAT, filter=self._filter, colorize=False)
+        else:
+            logging.getLogger("werkzeug").setLevel(logging.WARNING)  # the sampled access log replaces its lines
+        self.sink.start()
+        atexit.register(self.sink.stop)
+
+        access = logs.get_logger(ACCESS)
+        if not access.is_enabled("INFO") or logs.rule(ACCESS)[1] <= 0:
+            return
+
+        @self.app.after_request
+        def access_log(response: Response) -> Response:
+            started = g.get("metrics_started", None)
+            (access.warning if response.status_code >= 500 else access.info)(
+                "{method} {path} {status}",
+                method=request.method,
+                path=request.path,
+                status=response.status_code,
+                duration_ms=round((time.perf_counter() - started) * 1000, 3) if started is not None else None,
+                remote=request.remote_addr,
+                user_id=g.get("rate_user", None),
+            )
+            return response
+
+    def counters(self) -> Dict[Tuple[str, Tuple[str, ...]], int]:
+        return {
+            ("app_log_records_total", ("written",)): self.sink.written,
+            ("app_log_records_total", ("dropped",)): self.sink.dropped,
+        }
+
+
+metrics.counter("app_log_records_total", "Log records written and dropped by a full log queue.", ("result",))
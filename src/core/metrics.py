@@ -0,0 +1,328 @@
+import bisect
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+import weakref
+from typing import Optional, Dict, Tuple, List, Callable, Iterator, Final, Any, Union
+
+from flask import Flask, Response, request, g, current_app
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+from src import app, cache
+from src.core.profiling import record_span
+
+LABELS = Tuple[str, ...]
+KEY = Tuple[str, LABELS]
+COUNTER: Final[str] = "counter"
+HISTOGRAM: Final[str] = "histogram"
+LATENCY_BUCKETS: Final[Tuple[float, ...]] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+class Metric(object):
+
+    def __init__(self, name: str, kind: str, help_text: str, labels: LABELS, buckets: Tuple[float, ...] = ()) -> None:
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+
+
+class Metrics(object):
+    """
+    Counters and histograms of this worker, exported in the Prometheus text format.
+    Every thread writes into its own shard (a plain dict), so recording a value takes no
+    lock; 'collect' sums the shards. Shards of finished threads are folded into one
+    retired shard. A background thread writes this worker's totals to
+    '<METRICS_PATH>/<pid>.json' every METRICS_SNAPSHOT_INTERVAL, and '/metrics' adds up
+    the snapshots of the other live workers, so any worker can answer a scrape.
+    """
+    instance: Optional["Metrics"] = None
+
+    def __init__(self, directory: str, snapshot_interval: float) -> None:
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.definitions: Dict[str, Metric] = {}
+        self._local = threading.local()
+        self._shards: List[Tuple[weakref.ref, Dict[KEY, Any]]] = []
+        self._retired: Dict[KEY, Any] = {}
+        self._merge_lock = threading.Lock()
+        self._collectors: List[Callable[[], Dict[KEY, float]]] = []
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def provide(cls) -> "Metrics":
+        if not cls.instance:
+            cls.instance = Metrics(app.config["METRICS_PATH"], app.config["METRICS_SNAPSHOT_INTERVAL"])
+        return cls.instance
+
+    def counter(self, name: str, help_text: str, labels: LABELS = ()) -> None:
+        self.definitions[name] = Metric(name, COUNTER, help_text, labels)
+
+    def histogram(self, name: str, help_text: str, labels: LABELS = (), buckets=LATENCY_BUCKETS) -> None:
+        self.definitions[name] = Metric(name, HISTOGRAM, help_text, labels, tuple(buckets))
+
+    def add_collector(self, collector: Callable[[], Dict[KEY, float]]) -> None:
+        """ 'collector' returns counter values kept elsewhere, read when the totals are collected. """
+        self._collectors.append(collector)
+
+    def _shard(self) -> Dict[KEY, Any]:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._merge_lock:  # once per thread
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+            return shard
+
+    def inc(self, name: str, labels: LABELS = (), amount: float = 1) -> None:
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name: str, labels: LABELS, value: float) -> None:
+        shard = self._shard()
+        key = (name, labels)
+        counts = shard.get(key, None)
+        if counts is None:
+            # One slot per bucket, one for +Inf, then the sum.
+            counts = shard[key] = [0] * (len(self.definitions[name].buckets) + 2)
+        counts[bisect.bisect_left(self.definitions[name].buckets, value)] += 1
+        counts[-1] += value
+
+    @contextlib.contextmanager
+    def timer(self, name: str, labels: LABELS = (), span: Optional[str] = None) -> Iterator[None]:
+        """ Observes the elapsed time; with 'span' it's also added to that span of the current request. """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe(name, labels, elapsed)
+            if span is not None:
+                record_span(span, elapsed)
+
+    def memoize(self, **kwargs) -> Callable:
+        """
+        'cache.memoize' that also counts calls and misses (the calls that run the function).
+        The time spent in the cache itself, without the function, goes to the "cache" span.
+        """
+        def decorator(function: Callable) -> Callable:
+            name = function.__name__
+
+            @functools.wraps(function)
+            def miss(*args, **kw):
+                self.inc("app_cache_memoize_misses_total", (name,))
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kw)
+                finally:
+                    record_span("cache", started - time.perf_counter())
+
+            memoized = cache.memoize(**kwargs)(miss)
+
+            @functools.wraps(memoized)
+            def call(*args, **kw):
+                self.inc("app_cache_memoize_calls_total", (name,))
+                started = time.perf_counter()
+                try:
+                    return memoized(*args, **kw)
+                finally:
+                    record_span("cache", time.perf_counter() - started)
+
+            return call
+
+        return decorator
+
+    @staticmethod
+    def _merge(into: Dict[KEY, Any], shard: Dict[KEY, Any]) -> None:
+        for key, value in list(shard.items()):
+            if isinstance(value, list):
+                total = into.get(key, None)
+                if total is None:
+                    into[key] = list(value)
+                else:
+                    for index, count in enumerate(value):
+                        total[index] += count
+            else:
+                into[key] = into.get(key, 0) + value
+
+    def collect(self) -> Dict[KEY, Any]:
+        with self._merge_lock:
+            live = []
+            for thread_ref, shard in self._shards:
+                thread = thread_ref()
+                if thread is None or not thread.is_alive():
+                    self._merge(self._retired, shard)  # nobody writes to it anymore
+                else:
+                    live.append((thread_ref, shard))
+            self._shards = live
+            totals: Dict[KEY, Any] = {}
+            self._merge(totals, self._retired)
+        for _, shard in live:
+            self._merge(totals, shard)
+        for collector in self._collectors:
+            self._merge(totals, collector())
+        return totals
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.snapshot_interval):
+            try:
+                self.write_snapshot()
+            except Exception as error:
+                logger.error(f"Metrics snapshot failed: {type(error).__name__}: {error}")
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"{pid}.json")
+
+    def write_snapshot(self) -> None:
+        path = self._snapshot_path(os.getpid())
+        with open(path + ".tmp", "w") as file:
+            json.dump([[name, list(labels), value] for (name, labels), value in self.collect().items()], file)
+        os.replace(path + ".tmp", path)
+
+    def _other_workers(self) -> Iterator[Dict[KEY, Any]]:
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json") or name == f"{os.getpid()}.json":
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                os.kill(int(name[:-len(".json")]), 0)
+            except (ValueError, PermissionError):
+                pass
+            except ProcessLookupError:
+                with contextlib.suppress(OSError):
+                    os.remove(path)  # the worker is gone
+                continue
+            try:
+                with open(path, "r") as file:
+                    yield {(metric, tuple(labels)): value for metric, labels, value in json.load(file)}
+            except (OSError, ValueError):
+                continue
+
+    def render(self) -> str:
+        totals = self.collect()
+        for snapshot in self._other_workers():
+            self._merge(totals, snapshot)
+        by_metric: Dict[str, List[Tuple[LABELS, Any]]] = {}
+        for (name, labels), value in totals.items():
+            by_metric.setdefault(name, []).append((labels, value))
+        lines = []
+        for name, metric in sorted(self.definitions.items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in sorted(by_metric.get(name, ()), key=lambda item: item[0]):
+                pairs = [f'{label}="{_escape(value)}"' for label, value in zip(metric.labels, labels)]
+                if metric.kind == COUNTER:
+                    lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), value):
+                    cumulative += count
+                    le = 'le="%s"' % ("+Inf" if bound == float("inf") else _number(bound))
+                    lines.append(f"{name}_bucket{_labels(pairs + [le])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(pairs)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(pairs)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs: List[str]) -> str:
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: Union[int, float]) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+metrics: Final[Metrics] = Metrics.provide()
+metrics.histogram("app_request_duration_seconds", "Request latency by resource and method.", ("resource", "method"))
+metrics.counter("app_requests_total", "Requests by resource, method and status.", ("resource", "method", "status"))
+metrics.counter("app_transfer_bytes_total", "Backup bytes received and sent.", ("direction", "resource"))
+metrics.counter("app_upload_deduplicated_bytes_total", "Backup bytes stored without an upload, as the user had them.")
+metrics.counter("app_cache_memoize_calls_total", "Calls of memoized functions.", ("function",))
+metrics.counter("app_cache_memoize_misses_total", "Calls of memoized functions that missed the cache.", ("function",))
+metrics.histogram("app_db_query_duration_seconds", "SQL statement latency by statement kind.", ("statement",))
+metrics.counter("app_db_checkouts_total", "Connections checked out of the pool (one per session transaction).")
+metrics.histogram("app_jwt_duration_seconds", "JWT signing and verification time.", ("operation",))
+metrics.histogram("app_kdf_duration_seconds", "Password hashing (PBKDF2) time.", ("operation",))
+
+
+@event.listens_for(Pool, "checkout")
+def _checkout(dbapi_connection, connection_record, connection_proxy) -> None:
+    metrics.inc("app_db_checkouts_total")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = conn.info["metrics_started"].pop()
+    kind = statement.lstrip()[:6].lower()
+    if kind not in ("select", "insert", "update", "delete"):
+        kind = "other"
+    elapsed = time.perf_counter() - started
+    metrics.observe("app_db_query_duration_seconds", (kind,), elapsed)
+    record_span("db", elapsed)
+
+
+def _resource() -> str:
+    view = current_app.view_functions.get(request.endpoint, None)
+    view_class = getattr(view, "view_class", None)
+    return view_class.__name__ if view_class is not None else (request.endpoint or "unmatched")
+
+
+def init_app(flask_app: Flask) -> None:
+    """ Times every request; registered before the other request hooks so rejected requests count too. """
+    if not flask_app.config["METRICS_ENABLED"]:
+        return
+
+    @flask_app.before_request
+    def start_timer() -> None:
+        g.metrics_started = time.perf_counter()
+
+    @flask_app.after_request
+    def record(response: Response) -> Response:
+        resource = _resource()
+        started = g.get("metrics_started", None)
+        if started is not None:
+            metrics.observe("app_request_duration_seconds", (resource, request.method), time.perf_counter() - started)
+        metrics.inc("app_requests_total", (resource, request.method, str(response.status_code)))
+        if request.method in ("POST", "PUT") and request.content_length:
+            metrics.inc("app_transfer_bytes_total", ("upload", resource), request.content_length)
+        if response.direct_passthrough and response.content_length:
+            metrics.inc("app_transfer_bytes_total", ("download", resource), response.content_length)
+        return response
+
+    metrics.start()
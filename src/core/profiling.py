@@ -0,0 +1,328 @@
+import argparse
+import collections
+import contextlib
+import cProfile
+import importlib.abc
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from typing import Optional, Dict, List, Tuple, Iterator, Final, Any, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from flask import Flask
+
+# Only the standard library here: this module is imported before anything else it measures.
+
+
+class _TimingFinder(importlib.abc.MetaPathFinder):
+    """ Wraps the loader of every module found by the other finders to time its execution. """
+
+    def __init__(self, profiler: "StartupProfiler") -> None:
+        self.profiler = profiler
+        self._local = threading.local()
+
+    def find_spec(self, fullname, path, target=None):
+        if getattr(self._local, "busy", False):
+            return None
+        self._local.busy = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.busy = False
+        loader = spec.loader
+        if loader is not None and not isinstance(loader, type) and hasattr(loader, "exec_module"):
+            loader.exec_module = self.profiler.timed_exec(fullname, loader.exec_module)
+        return spec
+
+
+class StartupProfiler(object):
+    """
+    Startup profiler enabled with APP_PROFILE_STARTUP=1.
+    It records the import time of every module (cumulative and self, like
+    'python -X importtime') and the duration of named init phases, then
+    reports both through the log and, with APP_PROFILE_STARTUP_OUTPUT, as JSON.
+    Disabled, 'phase' is a shared no-op context manager.
+    """
+    ENV_FLAG: Final[str] = "APP_PROFILE_STARTUP"
+    ENV_OUTPUT: Final[str] = "APP_PROFILE_STARTUP_OUTPUT"
+    TOP_MODULES: Final[int] = 25
+    instance: Optional["StartupProfiler"] = None
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self.imports: Dict[str, List[float]] = {}
+        self._stack: List[float] = []
+        self._finder: Optional[_TimingFinder] = None
+        if enabled:
+            self._finder = _TimingFinder(self)
+            sys.meta_path.insert(0, self._finder)
+
+    @classmethod
+    def provide(cls) -> "StartupProfiler":
+        if not cls.instance:
+            cls.instance = StartupProfiler(os.environ.get(cls.ENV_FLAG, "0").lower() in ("1", "true", "yes", "on"))
+        return cls.instance
+
+    def timed_exec(self, name: str, exec_module):
+        def wrapper(module) -> None:
+            self._stack.append(0.0)
+            started = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                elapsed = time.perf_counter() - started
+                children = self._stack.pop()
+                if self._stack:
+                    self._stack[-1] += elapsed
+                self.imports[name] = [elapsed, elapsed - children]
+
+        return wrapper
+
+    def phase(self, name: str) -> contextlib.AbstractContextManager:
+        return self._phase(name) if self.enabled else contextlib.nullcontext()
+
+    @contextlib.contextmanager
+    def _phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def summary(self) -> Dict[str, Any]:
+        top = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)[:self.TOP_MODULES]
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 2),
+            "modules_imported": len(self.imports),
+            "phases_ms": {name: round(elapsed * 1000, 2) for name, elapsed in self.phases},
+            "top_modules_self_ms": {name: round(times[1] * 1000, 2) for name, times in top},
+        }
+
+    def report(self) -> None:
+        if not self.enabled:
+            return
+        if self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+        summary = self.summary()
+        output = os.environ.get(self.ENV_OUTPUT, None)
+        if output:
+            with open(output, "w") as file:
+                json.dump(summary, file, indent=2)
+        from loguru import logger
+        logger.info(f"Startup profile: {json.dumps(summary)}")
+
+
+_request_local = threading.local()
+
+
+def record_span(name: str, seconds: float) -> None:
+    """ Adds time to a span of the current request; a no-op outside of recorded requests. """
+    spans = getattr(_request_local, "spans", None)
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+class StackSampler(object):
+    """ Samples the stack of one thread every 'interval' seconds into folded (flame graph) stacks. """
+
+    def __init__(self, thread_id: int, interval: float) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Dict[str, int] = collections.Counter()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id, None)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+class RequestProfiler(object):
+    """
+    Opt-in profiling of single requests and automatic capture of slow ones.
+    A request is profiled (cProfile, or a stack sampler with PROFILE_MODE="sample") when it
+    carries a PROFILE_TOKEN_HEADER signed with PROFILE_SECRET ('python -m src.core.profiling
+    sign'; never the public SECRET_KEY, and no header counts without it), or at random with PROFILE_SAMPLE_RATE. Every request also collects cheap spans
+    (auth, cache, db, io) and, when slower than PROFILE_SLOW_THRESHOLD, its breakdown is saved.
+    Captures go to PROFILE_PATH, which keeps the PROFILE_MAX_FILES newest files.
+    """
+    TOKEN_SALT: Final[str] = "request-profile"
+    instance: Optional["RequestProfiler"] = None
+
+    def __init__(self, flask_app: "Flask") -> None:
+        self.app = flask_app
+        self.directory: str = flask_app.config["PROFILE_PATH"]
+        self.mode: str = flask_app.config["PROFILE_MODE"]
+        self.sample_rate: float = flask_app.config["PROFILE_SAMPLE_RATE"]
+        self.sample_interval: float = flask_app.config["PROFILE_SAMPLE_INTERVAL"]
+        self.slow_threshold: float = flask_app.config["PROFILE_SLOW_THRESHOLD"]
+        self.max_files: int = flask_app.config["PROFILE_MAX_FILES"]
+        self.token_header: str = flask_app.config["PROFILE_TOKEN_HEADER"]
+        self.token_max_age: int = flask_app.config["PROFILE_TOKEN_MAX_AGE"]
+        self.secret: str = flask_app.config["PROFILE_SECRET"]
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+
+    @classmethod
+    def provide(cls) -> "RequestProfiler":
+        if not cls.instance:
+            from src import app
+            cls.instance = RequestProfiler(app)
+        return cls.instance
+
+    def _serializer(self):
+        from itsdangerous import URLSafeTimedSerializer
+        return URLSafeTimedSerializer(self.secret, salt=self.TOKEN_SALT)
+
+    def sign(self, requested_by: str) -> str:
+        if not self.secret:
+            raise RuntimeError("PROFILE_SECRET is not set")
+        return self._serializer().dumps({"by": requested_by})
+
+    def _token_is_valid(self, token: str) -> bool:
+        from itsdangerous import BadData
+        if not self.secret:
+            return False
+        try:
+            self._serializer().loads(token, max_age=self.token_max_age)
+            return True
+        except BadData:
+            return False
+
+    def init_app(self) -> None:
+        from flask import request
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        @self.app.before_request
+        def start_profiling() -> None:
+            _request_local.started = time.perf_counter()
+            _request_local.spans = {} if self.slow_threshold > 0 else None
+            _request_local.profiler = None
+            token = request.headers.get(self.token_header, None)
+            if (token and self._token_is_valid(token)) or (self.sample_rate and random.random() < self.sample_rate):
+                if self.mode == "sample":
+                    _request_local.profiler = StackSampler(threading.get_ident(), self.sample_interval).start()
+                else:
+                    profiler = cProfile.Profile()
+                    profiler.enable()
+                    _request_local.profiler = profiler
+
+        @self.app.teardown_request
+        def finish_profiling(error: Optional[BaseException] = None) -> None:
+            started = getattr(_request_local, "started", None)
+            if started is None:
+                return
+            elapsed = time.perf_counter() - started
+            profiler, spans = _request_local.profiler, _request_local.spans
+            _request_local.started = _request_local.spans = _request_local.profiler = None
+            if profiler is None and (spans is None or elapsed < self.slow_threshold):
+                return
+            try:
+                self._capture(request, elapsed, spans, profiler, error)
+            except OSError as exception:
+                from loguru import logger
+                logger.error(f"Can't save the request profile: {type(exception).__name__}: {exception}")
+
+    def _capture(self, request, elapsed: float, spans: Optional[Dict[str, float]], profiler, error) -> None:
+        view = self.app.view_functions.get(request.endpoint, None)
+        resource = getattr(getattr(view, "view_class", None), "__name__", request.endpoint or "unmatched")
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(self._sequence)}-{request.method}-{resource}"
+        path = os.path.join(self.directory, name)
+        spans = dict(spans or {})
+        spans["other"] = max(0.0, elapsed - sum(spans.values()))
+        report = {
+            "method": request.method,
+            "path": request.path,
+            "resource": resource,
+            "seconds": round(elapsed, 6),
+            "slow": elapsed >= self.slow_threshold > 0,
+            "error": repr(error) if error else None,
+            "spans": {key: round(value, 6) for key, value in spans.items()},
+        }
+        if isinstance(profiler, StackSampler):
+            profiler.stop()
+            with open(path + ".folded", "w") as file:
+                file.write(profiler.folded())
+            report["profile"] = name + ".folded"
+        elif profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(path + ".prof")
+            report["profile"] = name + ".prof"
+        with open(path + ".json", "w") as file:
+            json.dump(report, file, indent=2)
+        self._rotate()
+
+    def _rotate(self) -> None:
+        with self._lock:
+            with os.scandir(self.directory) as entries:
+                files = sorted((entry for entry in entries if entry.is_file()), key=lambda entry: entry.stat().st_mtime)
+            for entry in files[:max(0, len(files) - self.max_files)]:
+                with contextlib.suppress(OSError):
+                    os.remove(entry.path)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Request profiling tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sign = commands.add_parser("sign", help="print a header value that profiles the requests carrying it")
+    sign.add_argument("requested_by")
+    summary = commands.add_parser("show", help="print the top functions of a saved cProfile capture")
+    summary.add_argument("path")
+    summary.add_argument("--limit", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.command == "sign":
+        profiler = RequestProfiler.provide()
+        if not profiler.secret:
+            parser.error("set APP_PROFILE_SECRET, the server needs the same value to accept the header")
+        print(f"{profiler.token_header}: {profiler.sign(args.requested_by)}")
+    else:
+        import pstats
+        pstats.Stats(args.path).sort_stats("cumulative").print_stats(args.limit)
+
+
+startup: Final[StartupProfiler] = StartupProfiler.provide()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+from datetime import datetime
+from typing import Optional, Dict
+
+from flask import current_app
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+
+from src import db
+from src.core.database.models import Backup, UserUsage
+from src.utils import ResponseCode
+
+
+class QuotaExceeded(Exception):
+    """ Raised by 'charge_usage'; 'code' is 409 for the backup count and 507 for the bytes. """
+
+    def __init__(self, message: str, code: ResponseCode) -> None:
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+def limits() -> Dict[str, int]:
+    return {"backups": current_app.config["QUOTA_MAX_BACKUPS"], "bytes": current_app.config["QUOTA_MAX_BYTES"]}
+
+
+def _ensure_usage(user_id: int) -> bool:
+    """
+    Counts the backups of a user without a usage row yet (one from before the quotas) into a
+    new row; True if it did. The count sees the session's pending changes (autoflush).
+    """
+    if db.session.get(UserUsage, user_id) is not None:
+        return False
+    backups, size = db.session.query(func.count(Backup.backup_id), func.coalesce(func.sum(Backup.size), 0))\
+        .filter(Backup.user_id == user_id)\
+        .one()
+    return bool(db.session.execute(insert(UserUsage).values(
+        user_id=user_id, backups=backups, bytes=size, updated=datetime.utcnow()
+    ).on_conflict_do_nothing(index_elements=["user_id"])).rowcount)
+
+
+def quota_error(usage: Optional[UserUsage], backups: int, size: int) -> Optional[QuotaExceeded]:
+    """ The error the quota gives a new backup of 'size' bytes, or None if it fits. """
+    quota = limits()
+    used_backups, used_bytes = (usage.backups, usage.bytes) if usage is not None else (0, 0)
+    if used_backups + backups > quota["backups"]:
+        return QuotaExceeded("Backups limit reached!", ResponseCode.CONFLICT)
+    if used_bytes + size > quota["bytes"]:
+        return QuotaExceeded("Storage quota exceeded!", ResponseCode.INSUFFICIENT_STORAGE)
+    return None
+
+
+def check_quota(user_id: int, size: int = 0) -> Optional[QuotaExceeded]:
+    """ Read-only precheck (one primary key lookup) to reject an upload before its body is read. """
+    return quota_error(db.session.get(UserUsage, user_id), 1, size)
+
+
+def charge_usage(user_id: int, backups: int, size: int, enforce: bool = True) -> None:
+    """
+    Adds to the usage of the user in the current session, to be committed together with the
+    backup rows. With 'enforce' the increment is a single UPDATE guarded by the limits, so
+    concurrent uploads can't both take the last slot; QuotaExceeded is raised when it matches
+    nothing. Negative amounts release usage.
+    """
+    if _ensure_usage(user_id):
+        # The new row was counted with this change already in the session: only the limits are left to check.
+        usage = db.session.get(UserUsage, user_id, populate_existing=True)
+        error = quota_error(usage, 0, 0) if enforce else None
+        if error:
+            raise error
+        return
+    query = UserUsage.query.filter(UserUsage.user_id == user_id)
+    if enforce:
+        quota = limits()
+        query = query.filter(
+            UserUsage.backups + backups <= quota["backups"],
+            UserUsage.bytes + size <= quota["bytes"]
+        )
+    updated = query.update({
+        UserUsage.backups: UserUsage.backups + backups,
+        UserUsage.bytes: UserUsage.bytes + size,
+        UserUsage.updated: datetime.utcnow(),
+    }, synchronize_session=False)
+    if not updated:
+        raise quota_error(db.session.get(UserUsage, user_id, populate_existing=True), backups, size) \
+            or QuotaExceeded("Storage quota exceeded!", ResponseCode.INSUFFICIENT_STORAGE)
+
+
+def release_usage(user_id: int, size: Optional[int]) -> None:
+    charge_usage(user_id, -1, -(size or 0), enforce=False)
+
+
+def serialize_usage(user_id: int) -> Dict[str, Dict[str, int]]:
+    usage = db.session.get(UserUsage, user_id)
+    if usage is None:
+        _ensure_usage(user_id)
+        db.session.commit()
+        usage = db.session.get(UserUsage, user_id)
+    used, quota = {"backups": usage.backups, "bytes": usage.bytes}, limits()
+    return {
+        "used": used,
+        "limits": quota,
+        "available": {key: max(0, quota[key] - used[key]) for key in quota},
+    }
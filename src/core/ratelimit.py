@@ -0,0 +1,272 @@
+import contextlib
+import hashlib
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Optional, Dict, Tuple, Iterator, Iterable, Final, Union
+
+from flask import Flask, Response, request, g, jsonify, current_app
+from loguru import logger
+
+from src import app
+from src.api.routes.common import authorize, is_internal_request
+from src.utils import ResponseCode
+
+try:
+    import fcntl
+except ImportError:  # Windows: buckets are per process
+    fcntl = None
+
+LIMIT = Tuple[float, float]  # (tokens per second, burst)
+BOOT_ID_PATH: Final[str] = "/proc/sys/kernel/random/boot_id"
+
+
+def boot_stamp() -> bytes:
+    """ Identifies the current boot: the kernel's boot id, else the boot time to the minute. """
+    try:
+        with open(BOOT_ID_PATH, "rb") as file:
+            boot = file.read().strip()
+    except OSError:
+        boot = str(round((time.time() - time.monotonic()) / 60)).encode()
+    return hashlib.blake2b(boot, digest_size=SharedBuckets.HEADER.size).digest()
+
+
+class SharedBuckets(object):
+    """
+    Token buckets in a fixed table of slots in a memory-mapped file, so every worker process
+    of this node draws from the same buckets. A bucket is found by open addressing over a few
+    slots from the key's hash; when all of them are taken, the least recently used is reused
+    (which only hands the evicted key a full bucket). Updates take a process lock and an
+    flock on the file; without fcntl or a path the table lives in anonymous memory instead.
+    Updates are wall clock times, since the file outlives the process: the first worker to
+    open it after a reboot (the header holds the boot it was filled in) clears the table.
+    """
+    HEADER: Final[struct.Struct] = struct.Struct("<16s")  # boot stamp
+    SLOT: Final[struct.Struct] = struct.Struct("<Qdd")  # key hash, tokens, last update
+    PROBES: Final[int] = 8
+
+    def __init__(self, path: Optional[str] = None, slots: int = 16_384) -> None:
+        self.slots = slots
+        size = self.HEADER.size + slots * self.SLOT.size
+        self._lock = threading.Lock()
+        self._file = None
+        if path and fcntl is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._file = open(path, "a+b")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._file.fileno()).st_size != size:
+                    self._file.truncate(0)
+                    self._file.truncate(size)
+                self._map = mmap.mmap(self._file.fileno(), size)
+                stamp = boot_stamp()
+                if self.HEADER.unpack_from(self._map)[0] != stamp:
+                    self._map[:] = bytes(size)
+                    self.HEADER.pack_into(self._map, 0, stamp)
+                    logger.info(f"Rate limit buckets in '{path}' cleared: first use since boot")
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+        else:
+            self._map = mmap.mmap(-1, size)
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._lock:
+            if self._file is None:
+                yield
+                return
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little") or 1
+
+    def _find(self, key_hash: int) -> Tuple[int, bool]:
+        start = key_hash % self.slots
+        victim, victim_updated = start, math.inf
+        for probe in range(self.PROBES):
+            offset = self.HEADER.size + ((start + probe) % self.slots) * self.SLOT.size
+            slot_hash, _, updated = self.SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset, True
+            if slot_hash == 0:
+                return offset, False
+            if updated < victim_updated:
+                victim, victim_updated = offset, updated
+        return victim, False
+
+    def take(self, key: str, rate: float, burst: float, amount: float = 1.0, debt: bool = False) -> float:
+        """
+        Takes 'amount' tokens and returns 0, or returns the seconds until they are available.
+        With 'debt' the tokens are always taken (the bucket may go negative) and the return
+        value is how long the caller should wait: that is how byte streams are paced.
+        """
+        key_hash = self._hash(key)
+        now = time.time()
+        with self._locked():
+            offset, found = self._find(key_hash)
+            if found:
+                _, tokens, updated = self.SLOT.unpack_from(self._map, offset)
+                tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            else:
+                tokens = burst
+            if tokens >= amount or debt:
+                tokens -= amount
+                wait = max(0.0, -tokens / rate)
+            else:
+                wait = (amount - tokens) / rate
+            self.SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+        return wait
+
+
+class Pacer(object):
+    """ Charges transferred bytes to a bandwidth bucket in quanta and sleeps off the debt. """
+    QUANTUM: Final[int] = 256 * 1024
+
+    def __init__(self, buckets: SharedBuckets, key: str, bytes_per_second: float) -> None:
+        self.buckets = buckets
+        self.key = key
+        self.bytes_per_second = bytes_per_second
+        self._pending = 0
+
+    def __call__(self, amount: int, flush: bool = False) -> None:
+        self._pending += amount
+        if self._pending < self.QUANTUM and not (flush and self._pending):
+            return
+        amount, self._pending = self._pending, 0
+        wait = self.buckets.take(self.key, self.bytes_per_second, self.bytes_per_second, amount, debt=True)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class ThrottledInput(object):
+    """ 'wsgi.input' wrapper pacing the request body. """
+
+    def __init__(self, stream, pace: Pacer) -> None:
+        self._stream = stream
+        self._pace = pace
+
+    def read(self, *args) -> bytes:
+        data = self._stream.read(*args)
+        self._pace(len(data), flush=not data)
+        return data
+
+    def readline(self, *args) -> bytes:
+        data = self._stream.readline(*args)
+        self._pace(len(data), flush=not data)
+        return data
+
+    def readlines(self, *args) -> list:
+        lines = self._stream.readlines(*args)
+        self._pace(sum(map(len, lines)), flush=True)
+        return lines
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self.readline, b"")
+
+    def __getattr__(self, name: str):
+        return getattr(self._stream, name)
+
+
+class ThrottledBody(object):
+    """ Response iterable wrapper pacing the response body; closes the wrapped iterable. """
+
+    def __init__(self, body: Iterable[bytes], pace: Pacer) -> None:
+        self._body = body
+        self._pace = pace
+
+    def __iter__(self) -> Iterator[bytes]:
+        for block in self._body:
+            self._pace(len(block))
+            yield block
+        self._pace(0, flush=True)
+
+    def close(self) -> None:
+        if hasattr(self._body, "close"):
+            self._body.close()
+
+
+class RateLimiter(object):
+    """
+    Request-rate limits by endpoint class and byte-rate shaping of transfers, per user and per IP.
+    A Resource opts in with a 'rate_class' attribute (one class, or one per HTTP method);
+    the limits of each class come from RATE_LIMITS. Over the limit, the request is answered
+    with 429 and Retry-After before the view runs. Authenticated request bodies and file
+    responses are paced to UPLOAD_/DOWNLOAD_BYTES_PER_SECOND per user.
+    """
+    instance: Optional["RateLimiter"] = None
+
+    def __init__(self, flask_app: Flask) -> None:
+        self.app = flask_app
+        self.enabled: bool = flask_app.config["RATE_LIMITS_ENABLED"]
+        self.limits: Dict[str, Dict[str, LIMIT]] = flask_app.config["RATE_LIMITS"]
+        self.upload_rate: int = flask_app.config["UPLOAD_BYTES_PER_SECOND"]
+        self.download_rate: int = flask_app.config["DOWNLOAD_BYTES_PER_SECOND"]
+        self.buckets = SharedBuckets(flask_app.config["RATE_LIMIT_STATE_PATH"])
+
+    @classmethod
+    def provide(cls) -> "RateLimiter":
+        if not cls.instance:
+            cls.instance = RateLimiter(app)
+        return cls.instance
+
+    def init_app(self) -> None:
+        if not self.enabled:
+            return
+        self.app.before_request(self._before_request)
+        self.app.after_request(self._after_request)
+        logger.info(f"Rate limits: {self.limits}")
+
+    @staticmethod
+    def _rate_class() -> Optional[str]:
+        view = current_app.view_functions.get(request.endpoint, None)
+        rate_class: Union[str, Dict[str, str], None] = getattr(getattr(view, "view_class", None), "rate_class", None)
+        if isinstance(rate_class, dict):
+            return rate_class.get(request.method, None)
+        return rate_class
+
+    def _before_request(self) -> Optional[Response]:
+        rate_class = self._rate_class()
+        if rate_class is None or is_internal_request():
+            return None
+        token = request.headers.get("Authorization", None)
+        user_id = authorize(token) if token else None
+        g.rate_user = user_id
+        limits = self.limits.get(rate_class, {})
+        for scope, subject in (("ip", request.remote_addr), ("user", user_id)):
+            if subject is None or scope not in limits:
+                continue
+            wait = self.buckets.take(f"{rate_class}:{scope}:{subject}", *limits[scope])
+            if wait > 0:
+                return self._too_many_requests(wait)
+        if user_id and self.upload_rate > 0 and request.method in ("POST", "PUT"):
+            request.environ["wsgi.input"] = ThrottledInput(
+                request.environ["wsgi.input"], Pacer(self.buckets, f"upload:{user_id}", self.upload_rate)
+            )
+        return None
+
+    def _after_request(self, response: Response) -> Response:
+        user_id = g.get("rate_user", None)
+        if user_id and self.download_rate > 0 and response.direct_passthrough:
+            pace = Pacer(self.buckets, f"download:{user_id}", self.download_rate)
+            if hasattr(response.response, "on_chunk"):
+                response.response.on_chunk = pace  # a body that doesn't pass through Python (SendfileBody)
+            else:
+                response.response = ThrottledBody(response.response, pace)
+        return response
+
+    @staticmethod
+    def _too_many_requests(wait: float) -> Response:
+        ret = jsonify({
+            "message": "Too many requests!"
+        })
+        ret.status_code = ResponseCode.TOO_MANY_REQUESTS.value
+        ret.headers["Retry-After"] = str(max(1, math.ceil(wait)))
+        return ret
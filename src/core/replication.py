@@ -0,0 +1,249 @@
+import asyncio
+import hashlib
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+from typing import Optional, List, Tuple, Dict, Any, NamedTuple, TYPE_CHECKING
+
+from flask import Flask, current_app
+from loguru import logger
+
+from src import app, db, cache
+from src.core.database.models import Backup, User, ReplicationTask
+from src.core.metrics import metrics
+from src.core.storage import backup_path, blob_checksum, blob_size, open_blob
+from src.utils import RequestMethod, ResMethod, ResponseCode, ContentType
+
+if TYPE_CHECKING:
+    from src.utils.network import HTTPSession
+
+
+class ClaimedTask(NamedTuple):
+    task_id: int
+    backup_id: int
+    peer: str
+    operation: str
+    attempts: int
+
+
+def enqueue_replication(backup_id: int, operation: str) -> None:
+    """ Adds outbox rows to the current session: the caller commits them together with the change. """
+    peers = current_app.config["REPLICATION_PEERS"]
+    if not peers:
+        return
+    if operation == ReplicationTask.DELETE:
+        ReplicationTask.query.filter(
+            ReplicationTask.backup_id == backup_id,
+            ReplicationTask.operation == ReplicationTask.PUT,
+            ReplicationTask.status != ReplicationTask.RUNNING
+        ).delete()
+    for peer in peers:
+        db.session.add(ReplicationTask.create(backup_id, peer, operation))
+
+
+@metrics.memoize(timeout=10, hash_method=hashlib.sha256)
+def find_backup_replicas(backup_id: int) -> List[str]:
+    with app.app_context():
+        rows = db.session.query(ReplicationTask.peer).filter_by(
+            backup_id=backup_id,
+            operation=ReplicationTask.PUT,
+            status=ReplicationTask.DONE
+        ).all()
+        return [row.peer for row in rows]
+
+
+def pick_replica(backup_id: int, local_available: bool) -> Optional[str]:
+    """
+    Returns the peer a download should be redirected to, or None to serve it here.
+    Only replicas that acknowledged the current content (same checksum) are used.
+    """
+    if not current_app.config["REPLICATION_PEERS"]:
+        return None
+    replicas = find_backup_replicas(backup_id)
+    if not replicas:
+        return None
+    if not local_available:
+        return random.choice(replicas)
+    if current_app.config["REPLICATION_READ_MODE"] == "redirect":
+        return random.choice(replicas + [None])
+    return None
+
+
+class Replicator(object):
+    """
+    Pushes committed outbox rows to the peers from a background thread with its own
+    event loop. Rows are claimed atomically, so several workers may run it at once;
+    failures are retried with jittered exponential backoff until REPLICATION_MAX_ATTEMPTS.
+    """
+    instance: Optional["Replicator"] = None
+
+    def __init__(self, flask_app: Flask) -> None:
+        self.app = flask_app
+        self.peers: Tuple[str, ...] = flask_app.config["REPLICATION_PEERS"]
+        self.concurrency: int = flask_app.config["REPLICATION_CONCURRENCY"]
+        self.poll_interval: float = flask_app.config["REPLICATION_POLL_INTERVAL"]
+        self.max_attempts: int = flask_app.config["REPLICATION_MAX_ATTEMPTS"]
+        self.max_backoff: float = flask_app.config["REPLICATION_MAX_BACKOFF"]
+        self.claim_timeout: float = flask_app.config["REPLICATION_CLAIM_TIMEOUT"]
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    @classmethod
+    def provide(cls) -> "Replicator":
+        if not cls.instance:
+            cls.instance = Replicator(app)
+        return cls.instance
+
+    def start(self) -> None:
+        if not self.peers or self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=asyncio.run, args=(self._run(),), name="replicator", daemon=True)
+        self._thread.start()
+        logger.info(f"Replicating backups to {', '.join(self.peers)}")
+
+    def notify(self) -> None:
+        """ Wakes the replicator up after a commit instead of waiting for the next poll. """
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stopping = True
+        self.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    async def _run(self) -> None:
+        # aiohttp is only loaded by nodes that actually replicate.
+        from src.utils.network import HTTPSession
+
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        async with HTTPSession(limit_per_host=self.concurrency) as session:
+            while not self._stopping:
+                self._wakeup.clear()
+                try:
+                    claimed = await self._db(self._claim)
+                except Exception as error:
+                    logger.error(f"Replication claim failed: {type(error).__name__}: {error}")
+                    claimed = []
+                if claimed:
+                    await self._push_all(session, claimed)
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _db(self, function, *args):
+        def in_context():
+            with self.app.app_context():
+                return function(*args)
+
+        return await asyncio.get_running_loop().run_in_executor(None, in_context)
+
+    async def _push_all(self, session: "HTTPSession", claimed: List[ClaimedTask]) -> None:
+        queue = iter(claimed)
+
+        async def worker() -> None:
+            for task in queue:
+                try:
+                    error = await self._push(session, task)
+                except Exception as exception:
+                    error = f"{type(exception).__name__}: {exception}"
+                await self._db(self._finish, task, error)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+    async def _push(self, session: "HTTPSession", task: ClaimedTask) -> Optional[str]:
+        from aiohttp import FormData
+
+        url = f"{task.peer}/replication/backups/{task.backup_id}"
+        headers = {self.app.config["INTERNAL_API_TOKEN_HEADER"]: self.app.config["INTERNAL_API_TOKEN"]}
+        if task.operation == ReplicationTask.DELETE:
+            result = await session.query(url, RequestMethod.DELETE, ResMethod.JSON, headers=headers)
+            if result.is_success() or result.code == ResponseCode.NOT_FOUND:
+                return None
+            return f"{result.code}: {result.data or result.error}"
+        payload = await self._db(self._payload, task.backup_id)
+        if payload is None:
+            return None
+        path, fields = payload
+        with await self._db(open_blob, path) as file:
+            form = FormData(fields)
+            form.add_field("file", file, filename=os.path.basename(path), content_type=ContentType.APPLICATION_ZIP)
+            result = await session.query(url, RequestMethod.PUT, ResMethod.JSON, data=form, headers=headers)
+        if not result.is_success():
+            return f"{result.code}: {result.data or result.error}"
+        if result.data.get("checksum", None) != fields["checksum"]:
+            return f"checksum mismatch: {result.data.get('checksum', None)} != {fields['checksum']}"
+        return None
+
+    def _claim(self) -> List[ClaimedTask]:
+        now = datetime.utcnow()
+        ReplicationTask.query.filter(
+            ReplicationTask.status == ReplicationTask.RUNNING,
+            ReplicationTask.claimed < now - timedelta(seconds=self.claim_timeout)
+        ).update({"status": ReplicationTask.PENDING}, synchronize_session=False)
+        db.session.commit()
+        candidates = ReplicationTask.query.filter(
+            ReplicationTask.status == ReplicationTask.PENDING,
+            ReplicationTask.next_attempt <= now
+        ).order_by(ReplicationTask.task_id).limit(self.concurrency * 4).all()
+        claimed = []
+        for task in candidates:
+            updated = ReplicationTask.query.filter_by(task_id=task.task_id, status=ReplicationTask.PENDING)\
+                .update({"status": ReplicationTask.RUNNING, "claimed": now}, synchronize_session=False)
+            if updated:
+                claimed.append(ClaimedTask(task.task_id, task.backup_id, task.peer, task.operation, task.attempts))
+        db.session.commit()
+        return claimed
+
+    def _payload(self, backup_id: int) -> Optional[Tuple[str, Dict[str, Any]]]:
+        backup = db.session.get(Backup, backup_id)
+        if backup is None:
+            return None
+        path = backup_path(backup)
+        if backup.checksum is None:
+            backup.checksum = blob_checksum(path)
+            backup.size = blob_size(path)
+            db.session.commit()
+        user = db.session.get(User, backup.user_id)
+        return path, {
+            "user_id": str(user.user_id),
+            "login": user.login,
+            "password_hash": user.password_hash.decode(),
+            "joined": user.joined.isoformat(),
+            "created": backup.created.isoformat(),
+            "comment": backup.comment or "",
+            "checksum": backup.checksum,
+            "size": str(backup.size),
+        }
+
+    def _finish(self, task: ClaimedTask, error: Optional[str]) -> None:
+        now = datetime.utcnow()
+        row = db.session.get(ReplicationTask, task.task_id)
+        if row is None:
+            return
+        if error is None:
+            row.status, row.synced, row.last_error = ReplicationTask.DONE, now, None
+            logger.info(f"Backup {task.backup_id}: {task.operation} replicated to {task.peer}")
+            if task.operation == ReplicationTask.PUT and db.session.get(Backup, task.backup_id) is None:
+                # Deleted while the copy was in flight: the delete may have reached the peer first.
+                db.session.add(ReplicationTask.create(task.backup_id, task.peer, ReplicationTask.DELETE))
+        else:
+            row.attempts = task.attempts + 1
+            row.last_error = error
+            if row.attempts >= self.max_attempts:
+                row.status = ReplicationTask.FAILED
+                logger.error(f"Backup {task.backup_id}: {task.operation} to {task.peer} failed: {error}")
+            else:
+                backoff = random.uniform(0, min(self.max_backoff, 2 ** row.attempts))
+                row.status, row.next_attempt = ReplicationTask.PENDING, now + timedelta(seconds=backoff)
+                logger.warning(f"Backup {task.backup_id}: {task.operation} to {task.peer} will be retried: {error}")
+        db.session.commit()
+        cache.delete_memoized(find_backup_replicas, task.backup_id)
@@ -0,0 +1,174 @@
+import threading
+from datetime import datetime
+from typing import Optional, Dict, Any, Tuple
+
+from flask import Flask
+from loguru import logger
+from sqlalchemy.exc import IntegrityError
+
+from src import app, db
+from src.core.database.models import RevokedToken
+from src.core.metrics import metrics
+from src.utils.bloom import BloomFilter
+
+
+class RevocationList(object):
+    """
+    Revoked token ids (jti) of this worker: a Bloom filter in front of the 'revoked_tokens' table.
+    A token that misses the filter (almost all of them) is accepted without touching the
+    database; a hit is confirmed with one indexed lookup, which also counts false positives.
+    A background thread appends rows revoked by other workers every REVOCATION_REFRESH_INTERVAL
+    (rows are read past a watermark, so a refresh only reads new revocations) and prunes rows
+    of expired tokens, rebuilding the filter since Bloom filters can't forget.
+    """
+    CONFIRMED_CACHE_SIZE = 10_000
+    instance: Optional["RevocationList"] = None
+
+    def __init__(self, flask_app: Flask) -> None:
+        self.app = flask_app
+        self.refresh_interval: float = flask_app.config["REVOCATION_REFRESH_INTERVAL"]
+        self.prune_interval: float = flask_app.config["REVOCATION_PRUNE_INTERVAL"]
+        self.min_capacity: int = flask_app.config["REVOCATION_BLOOM_CAPACITY"]
+        self.error_rate: float = flask_app.config["REVOCATION_BLOOM_ERROR_RATE"]
+        self._bloom = BloomFilter(self.min_capacity, self.error_rate)
+        self._watermark = 0
+        self._confirmed: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.checks = 0
+        self.filter_hits = 0
+        self.false_positives = 0
+
+    @classmethod
+    def provide(cls) -> "RevocationList":
+        if not cls.instance:
+            cls.instance = RevocationList(app)
+            metrics.add_collector(cls.instance.counters)
+        return cls.instance
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        if not jti:
+            return False
+        self.checks += 1
+        if jti not in self._bloom:
+            return False
+        self.filter_hits += 1
+        if jti in self._confirmed:
+            return True
+        revoked = db.session.query(RevokedToken.revocation_id).filter_by(jti=jti).first() is not None
+        if revoked:
+            if len(self._confirmed) >= self.CONFIRMED_CACHE_SIZE:
+                self._confirmed.clear()
+            self._confirmed[jti] = True
+        else:
+            self.false_positives += 1
+        return revoked
+
+    def revoke(self, claims: Dict[str, Any]) -> None:
+        """ Stores the token's jti until the token expires and makes this worker reject it at once. """
+        jti = claims["jti"]
+        db.session.add(RevokedToken.create(jti, claims["user_id"], datetime.utcfromtimestamp(claims["exp"])))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # already revoked
+        with self._lock:
+            self._bloom.add(jti)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self.rebuild()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="revocations", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        since_prune = 0.0
+        while not self._stopping.wait(self.refresh_interval):
+            try:
+                since_prune += self.refresh_interval
+                if since_prune >= self.prune_interval:
+                    since_prune = 0.0
+                    self.prune()
+                else:
+                    self.refresh()
+            except Exception as error:
+                logger.error(f"Revocation list refresh failed: {type(error).__name__}: {error}")
+
+    def refresh(self) -> int:
+        with self._lock, self.app.app_context():
+            rows = db.session.query(RevokedToken.revocation_id, RevokedToken.jti)\
+                .filter(RevokedToken.revocation_id > self._watermark)\
+                .order_by(RevokedToken.revocation_id)\
+                .all()
+            if not rows:
+                return 0
+            if self._bloom.count + len(rows) > self._bloom.capacity:
+                return self._rebuild_locked()
+            for row in rows:
+                self._bloom.add(row.jti)
+            self._watermark = rows[-1].revocation_id
+            return len(rows)
+
+    def prune(self) -> int:
+        with self.app.app_context():
+            pruned = RevokedToken.query.filter(RevokedToken.expires < datetime.utcnow()).delete()
+            db.session.commit()
+        if pruned:
+            logger.info(f"Pruned {pruned} revoked tokens past their expiry")
+            self.rebuild()
+        else:
+            self.refresh()
+        return pruned
+
+    def rebuild(self) -> int:
+        with self._lock:
+            return self._rebuild_locked()
+
+    def _rebuild_locked(self) -> int:
+        with self.app.app_context():
+            rows = db.session.query(RevokedToken.revocation_id, RevokedToken.jti).all()
+        # Twice the current size, so the next rebuild is far away.
+        bloom = BloomFilter.of((row.jti for row in rows), max(self.min_capacity, 2 * len(rows)), self.error_rate)
+        self._watermark = max((row.revocation_id for row in rows), default=0)
+        self._bloom = bloom
+        self._confirmed = {}
+        logger.info(f"Revocation filter rebuilt: {self.stats()}")
+        return len(rows)
+
+    def counters(self) -> Dict[Tuple[str, Tuple[str, ...]], int]:
+        return {
+            ("app_token_revocation_checks_total", ("checked",)): self.checks,
+            ("app_token_revocation_checks_total", ("filter_hit",)): self.filter_hits,
+            ("app_token_revocation_checks_total", ("false_positive",)): self.false_positives,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        bloom = self._bloom
+        negatives = self.checks - (self.filter_hits - self.false_positives)
+        return {
+            "entries": bloom.count,
+            "capacity": bloom.capacity,
+            "filter_bytes": (bloom.size + 7) // 8,
+            "hashes": bloom.hashes,
+            "expected_false_positive_rate": bloom.expected_error_rate(),
+            "checks": self.checks,
+            "filter_hits": self.filter_hits,
+            "false_positives": self.false_positives,
+            "false_positive_rate": self.false_positives / negatives if negatives > 0 else 0.0,
+        }
+
+
+metrics.counter(
+    "app_token_revocation_checks_total",
+    "Revocation checks, Bloom filter hits and filter false positives.",
+    ("result",)
+)
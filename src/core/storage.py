@@ -0,0 +1,158 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, Iterator, BinaryIO, Iterable, Tuple, Dict
+
+from flask import current_app
+
+from src.utils import ChecksumHash, BYTES_IN_MB, copy_stream, copy_with_checksums, file_checksum, stream_checksum
+
+# 'src.utils.sealed' (and PyCryptodome with it) is imported by the helpers that use it: the models
+# import this module, and the maintenance entry points (create, drop) mustn't pay for crypto.
+
+_executor: Optional[ThreadPoolExecutor] = None
+_master_key: Optional[bytes] = None
+
+
+def backup_filename(backup_id: int, user_id: int, created: datetime) -> str:
+    return f"{backup_id}-{user_id} [{created.strftime('%d-%m-%Y_%H;%M;%S.%f')}].zip"
+
+
+def backup_path(backup) -> str:
+    """ Accepts a Backup model or any row with backup_id, user_id and created. """
+    return os.path.join(
+        current_app.config["USER_BACKUPS_PATH"],
+        backup_filename(backup.backup_id, backup.user_id, backup.created)
+    )
+
+
+def upload_part_path(upload_id: str) -> str:
+    return os.path.join(current_app.config["UPLOAD_SESSIONS_PATH"], f"{upload_id}.part")
+
+
+def _crypto_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            current_app.config["STORAGE_CRYPTO_THREADS"], thread_name_prefix="storage-crypto"
+        )
+    return _executor
+
+
+def master_key() -> bytes:
+    """ The storage master key, generated on first use; losing it loses every sealed backup. """
+    global _master_key
+    if _master_key is None:
+        from Crypto.Random import get_random_bytes
+        from src.utils.sealed import KEY_SIZE
+
+        path = current_app.config["STORAGE_MASTER_KEY_PATH"]
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "wb") as file:
+                file.write(get_random_bytes(KEY_SIZE))
+        with open(path, "rb") as file:
+            _master_key = file.read()
+    return _master_key
+
+
+def _master_keys(key_id: bytes) -> Optional[bytes]:
+    from src.utils.sealed import master_key_id
+
+    key = master_key()
+    return key if master_key_id(key) == key_id else None
+
+
+def open_blob(path: str) -> BinaryIO:
+    """ The plaintext of a stored backup, sealed (STORAGE_ENCRYPTION) or not, as a seekable stream. """
+    from src.utils.sealed import MAGIC, SealedReader
+
+    file = open(path, "rb")
+    if file.read(len(MAGIC)) != MAGIC:
+        file.seek(0)
+        return file
+    file.seek(0)
+    return SealedReader(file, _master_keys, _crypto_executor(), current_app.config["STORAGE_CRYPTO_THREADS"] * 2)
+
+
+def blob_size(path: str) -> int:
+    from src.utils.sealed import HEADER, MAGIC, plain_size
+
+    with open(path, "rb") as file:
+        header = file.read(HEADER.size)
+    if header[:len(MAGIC)] != MAGIC:
+        return os.path.getsize(path)
+    return plain_size(os.path.getsize(path), HEADER.unpack(header)[1])
+
+
+def read_blob(path: str, start: int = 0, stop: Optional[int] = None, block_size: int = BYTES_IN_MB) -> Iterator[bytes]:
+    """ Plaintext bytes [start, stop) of a stored backup in blocks. """
+    with open_blob(path) as file:
+        file.seek(start)
+        remaining = (stop if stop is not None else blob_size(path)) - start
+        while remaining > 0:
+            block = file.read(min(block_size, remaining))
+            if not block:
+                raise OSError(f"{path} ended {remaining} bytes early")
+            remaining -= len(block)
+            yield block
+
+
+def blob_checksum(path: str, on_chunk=None) -> str:
+    """ SHA-256 of the plaintext; plain files take the mmap path of 'file_checksum'. """
+    from src.utils.sealed import is_sealed
+
+    if not is_sealed(path):
+        return file_checksum(path, ChecksumHash.SHA_256, on_chunk=on_chunk)
+    with open_blob(path) as file:
+        return stream_checksum(file, ChecksumHash.SHA_256, on_chunk=on_chunk)
+
+
+def write_blob(
+        path: str,
+        source: BinaryIO,
+        fsync: bool = False,
+        hash_algs: Iterable[ChecksumHash] = ()
+) -> Tuple[int, Dict[ChecksumHash, str]]:
+    """
+    Stores the stream at 'path', sealed when STORAGE_ENCRYPTION is on; returns the plaintext
+    size and its digests by 'hash_algs', computed on the way.
+    """
+    if not current_app.config["STORAGE_ENCRYPTION"]:
+        return copy_with_checksums(source, path, hash_algs, fsync=fsync)
+    from src.utils.sealed import SealedWriter
+
+    with open(path, "wb") as file:
+        with SealedWriter(file, master_key(), current_app.config["STORAGE_CHUNK_SIZE"], _crypto_executor(),
+                          current_app.config["STORAGE_CRYPTO_THREADS"] * 2) as sealed:
+            ret = copy_stream(source, sealed, hash_algs)
+        if fsync:
+            file.flush()
+            os.fsync(file.fileno())
+    return ret
+
+
+def store_file(source_path: str, path: str) -> None:
+    """
+    Puts an assembled plaintext file into storage: renamed, or with STORAGE_ENCRYPTION sealed
+    into 'path' with 'source_path' left for the caller to remove once the backup is committed.
+    """
+    if not current_app.config["STORAGE_ENCRYPTION"]:
+        os.replace(source_path, path)
+        return
+    with open(source_path, "rb") as source:
+        write_blob(path + ".tmp", source, fsync=True)
+    os.replace(path + ".tmp", path)
+
+
+def link_blob(source_path: str, path: str) -> None:
+    """
+    Stores a second backup of the same content: a hard link (no bytes copied, sealed or not as
+    the original), or a copy on a filesystem without links.
+    """
+    try:
+        os.link(source_path, path)
+    except OSError:
+        shutil.copyfile(source_path, path + ".tmp")
+        os.replace(path + ".tmp", path)
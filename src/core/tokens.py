@@ -0,0 +1,64 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+from src import app
+from src.core.metrics import metrics
+from src.utils import RSACipher, token_key_id
+
+
+class VerifiedTokens(object):
+    """
+    Claims of the tokens whose signature this worker already checked, so a token seen again
+    (every request of a session, or a service asking about the same users) costs a dict lookup
+    instead of an RS512 verification. A hit is used only while the token is unexpired and its
+    kid still resolves to the very key it was verified with, so a retired or replaced key drops
+    its tokens. Revocation isn't cached: the caller checks it on every use. Invalid tokens aren't
+    kept, so garbage can only evict entries, not fill the cache.
+    """
+    instance: Optional["VerifiedTokens"] = None
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self._entries: OrderedDict[bytes, Tuple[Dict[str, Any], Optional[str], object]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def provide(cls) -> "VerifiedTokens":
+        if not cls.instance:
+            cls.instance = VerifiedTokens(app.config["TOKEN_CACHE_SIZE"])
+        return cls.instance
+
+    def decode(self, token: str) -> Optional[Dict[str, Any]]:
+        """ Claims of a validly signed, unexpired token, else None; not checked for revocation. """
+        cipher = RSACipher.provide()
+        digest = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            entry = self._entries.get(digest, None)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+        if entry is not None:
+            claims, kid, key = entry
+            if claims.get("exp", float("inf")) > time.time() and cipher.ring.verification_key(kid) is key:
+                metrics.inc("app_token_cache_total", ("hit",))
+                return claims
+        metrics.inc("app_token_cache_total", ("miss",))
+        if not token.startswith(cipher.AUTH_PREFIX):
+            return None
+        kid = token_key_id(token[len(cipher.AUTH_PREFIX):])
+        key = cipher.ring.verification_key(kid)
+        with metrics.timer("app_jwt_duration_seconds", ("decode",), span="auth"):
+            claims = cipher.jwt_decode(token)
+        if claims is None or key is None or self.capacity <= 0:
+            return claims
+        with self._lock:
+            self._entries[digest] = (claims, kid, key)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return claims
+
+
+metrics.counter("app_token_cache_total", "Token verifications answered from the verified-token cache.", ("result",))
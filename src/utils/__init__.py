@@ -1,4 +1,58 @@
-from .network import *
-from .encodings import *
-from .os_utils import *
-from .date_utils import *
+"""
+Names are resolved lazily (PEP 562): 'from src.utils import ResponseCode' loads only
+'codes', so entry points that never touch HTTP or crypto don't pay for aiohttp,
+PyCryptodome, jwt or dateutil. New public names must be registered in '_EXPORTS'.
+"""
+import importlib
+from typing import Final, Dict, Tuple, Any, List
+
+_EXPORTS: Final[Dict[str, Tuple[str, ...]]] = {
+    "codes": (
+        "ResMethod", "ContentType", "RequestMethod", "ResponseCode",
+    ),
+    "network": (
+        "NetworkResultAsync", "QueryRequest", "RetryPolicy", "NO_RETRY", "HTTPSession",
+    ),
+    "encodings": (
+        "EMPTY_STRING", "STORAGE_PATH", "HashAlg", "Encodings", "PaddingStyle", "HashVerifier", "RSACipher",
+    ),
+    "bloom": (
+        "BloomFilter",
+    ),
+    "keyring": (
+        "KeyRing", "KeyEntry", "KeySet", "key_id", "token_key_id",
+    ),
+    "sealed": (
+        "SealedFileError", "SealedReader", "SealedWriter",
+    ),
+    "archive": (
+        "TarMember", "TarStream",
+    ),
+    "logs": (
+        "CategoryLogger", "get_logger",
+    ),
+    "os_utils": (
+        "BYTES_IN_KB", "BYTES_IN_MB", "BYTES_IN_GB", "CHECKSUM_BUFFER_SIZE", "MMAP_THRESHOLD", "ChecksumHash",
+        "M_PATH", "file_checksum", "file_checksums", "stream_checksum", "checksum_many", "copy_with_checksums",
+        "copy_stream",
+    ),
+    "date_utils": (
+        "UTC_ZONE", "LOCAL_ZONE", "SECONDS_IN_MINUTE", "SECONDS_IN_HOUR", "SECONDS_IN_DAY", "SECONDS_IN_WEEK",
+        "utc_to_local", "from_timestamp_delta", "with_delta", "int_timestamp",
+    ),
+}
+_MODULE_OF: Final[Dict[str, str]] = {name: module for module, names in _EXPORTS.items() for name in names}
+__all__: List[str] = list(_MODULE_OF)
+
+
+def __getattr__(name: str) -> Any:
+    module = _MODULE_OF.get(name, None)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f"{__name__}.{module}"), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,86 @@
+import hashlib
+import tarfile
+from typing import List, NamedTuple, Iterator, Tuple, Optional, Final, Callable, BinaryIO
+
+TAR_BLOCK_SIZE: Final[int] = tarfile.BLOCKSIZE
+TAR_END: Final[bytes] = bytes(2 * TAR_BLOCK_SIZE)
+READ_SIZE: Final[int] = 1024 * 1024
+
+
+class TarMember(NamedTuple):
+    """ A stored file or, with 'data', a small in-memory one. """
+    name: str
+    size: int
+    mtime: int
+    path: Optional[str] = None
+    data: Optional[bytes] = None
+    checksum: Optional[str] = None
+
+
+def open_file(path: str) -> BinaryIO:
+    return open(path, "rb")
+
+
+def tar_header(member: TarMember) -> bytes:
+    """ Only the member fields go into the header (no owner, fixed mode), so equal members give equal bytes. """
+    info = tarfile.TarInfo(member.name)
+    info.size, info.mtime, info.mode = member.size, member.mtime, 0o644
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    return info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8", errors="strict")
+
+
+class TarStream(object):
+    """
+    A tar archive of the members laid out from their names, sizes and mtimes only, so the
+    same members always give the same bytes at the same offsets: 'iter_range' serves any
+    byte range (a resumed download) by reading just the files that overlap it, in
+    READ_SIZE blocks, with nothing buffered beyond one block and nothing written to disk.
+    'etag' identifies the layout and the member checksums for If-Range. 'opener' gives the
+    seekable contents of a member path (decrypting ones for sealed files).
+    """
+
+    def __init__(self, members: List[TarMember], opener: Callable[[str], BinaryIO] = open_file) -> None:
+        self.members = members
+        self.opener = opener
+        # (offset, length, member or None, bytes or None): headers, file data and padding in order.
+        self.segments: List[Tuple[int, int, Optional[TarMember], Optional[bytes]]] = []
+        offset = 0
+        digest = hashlib.sha256()
+        for member in members:
+            header = tar_header(member)
+            digest.update(header)
+            digest.update((member.checksum or "").encode())
+            for length, source, data in (
+                    (len(header), None, header),
+                    (member.size, member if member.data is None else None, member.data),
+                    (-member.size % TAR_BLOCK_SIZE, None, bytes(-member.size % TAR_BLOCK_SIZE)),
+            ):
+                if length:
+                    self.segments.append((offset, length, source, data))
+                    offset += length
+        self.segments.append((offset, len(TAR_END), None, TAR_END))
+        self.size = offset + len(TAR_END)
+        self.etag = digest.hexdigest()[:32]
+
+    def iter_range(self, start: int = 0, stop: Optional[int] = None) -> Iterator[bytes]:
+        """ Bytes [start, stop) of the archive. """
+        stop = self.size if stop is None else min(stop, self.size)
+        for offset, length, member, data in self.segments:
+            if offset + length <= start:
+                continue
+            if offset >= stop:
+                return
+            begin, end = max(start - offset, 0), min(stop - offset, length)
+            if data is not None:
+                yield data[begin:end]
+                continue
+            with self.opener(member.path) as file:
+                file.seek(begin)
+                remaining = end - begin
+                while remaining > 0:
+                    block = file.read(min(READ_SIZE, remaining))
+                    if not block:
+                        raise OSError(f"{member.path} is shorter than its {member.size} bytes in the archive")
+                    remaining -= len(block)
+                    yield block
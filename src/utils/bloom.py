@@ -0,0 +1,61 @@
+import hashlib
+import math
+from typing import Final, Union, Iterable, Iterator
+
+_MASK_64: Final[int] = (1 << 64) - 1
+
+
+class BloomFilter(object):
+    """
+    Fixed-size Bloom filter sized for 'capacity' items at 'error_rate'.
+    The k probes come from one 128-bit blake2b digest split into two halves
+    (Kirsch-Mitzenmacher double hashing), so a lookup costs a single hash call.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001) -> None:
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError(f"Error: invalid capacity {capacity} or error rate {error_rate}!")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    @classmethod
+    def of(cls, items: Iterable[Union[str, bytes]], capacity: int, error_rate: float = 0.001) -> "BloomFilter":
+        bloom = cls(capacity, error_rate)
+        for item in items:
+            bloom.add(item)
+        return bloom
+
+    def _probes(self, item: Union[str, bytes]) -> Iterator[int]:
+        if isinstance(item, str):
+            item = item.encode("utf-8")
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return (((h1 + i * h2) & _MASK_64) % self.size for i in range(self.hashes))
+
+    def add(self, item: Union[str, bytes]) -> None:
+        bits = self._bits
+        for probe in self._probes(item):
+            bits[probe >> 3] |= 1 << (probe & 7)
+        self.count += 1
+
+    def __contains__(self, item: Union[str, bytes]) -> bool:
+        bits = self._bits
+        for probe in self._probes(item):
+            if not bits[probe >> 3] & (1 << (probe & 7)):
+                return False
+        return True
+
+    def __len__(self) -> int:
+        return self.count
+
+    def is_full(self) -> bool:
+        return self.count >= self.capacity
+
+    def expected_error_rate(self) -> float:
+        """ Theoretical false-positive probability for the items added so far. """
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
@@ -16,14 +16,15 @@ from Crypto.Protocol.KDF import PBKDF2
 from Crypto.PublicKey import RSA
 from Crypto.PublicKey.RSA import RsaKey
 from Crypto.Random import get_random_bytes
-from jwt import JWT, jwk_from_pem
+from jwt import JWT
 from loguru import logger
 from strenum import StrEnum
 
 from src.utils.date_utils import int_timestamp, with_delta
+from src.utils.keyring import KeyRing, KEY_SUFFIX, key_id, token_key_id
 
 EMPTY_STRING: Final[str] = string.whitespace[0]
-STORAGE_PATH: Final[str] = os.path.join(Path(os.path.dirname(__file__)).parent, "core\\store")
+STORAGE_PATH: Final[str] = os.path.join(Path(os.path.dirname(__file__)).parent, "core", "store")
 
 
 class HashAlg(Enum):
@@ -149,62 +150,54 @@ class HashVerifier(object):
 class RSACipher(object):
     """Class for implementation RSA+PKCS1_OAEP encryption"""
     KEYS_PATH: Final[str] = os.path.join(STORAGE_PATH, "jwt.pem")
+    KEYS_DIR: Final[str] = os.path.join(STORAGE_PATH, "keys")
     PASSPHRASE: Final[str] = base64.b64encode(SHA512.new(b"ABCDADCAKA").digest()).decode(Encodings.UTF_8)
     PREFIX: Final[bytes] = b"uiJaX0jDSqWrtIPfSxK:"
     PREFIX_LEN: Final[int] = len(PREFIX)
     SALT_SIZE: Final[int] = 32
     instance: Optional["RSACipher"] = None
     AUTH_PREFIX: Final[str] = "JWT "
+    JWT_ALG: Final[str] = "RS512"
 
     def __init__(self) -> None:
-        self.key = self._get_key()
         self.jwt = JWT()
-        self.jwt_signing_public = jwk_from_pem(self.public_key.export_key())
-        self.jwt_signing_private = jwk_from_pem(self.key.export_key())
+        self.ring = KeyRing(self.KEYS_DIR, self.PASSPHRASE, legacy_path=self.KEYS_PATH)
+        self.ring.reload()
 
     def jwt_encode(self, payload: Dict[str, Any]) -> str:
         if "exp" not in payload:
             payload["exp"] = int_timestamp(with_delta(weeks=30))
         if "iat" not in payload:
             payload["iat"] = int_timestamp(datetime.datetime.utcnow())
-        _id = uuid.uuid4().hex
         if "jti" not in payload:
             payload["jti"] = uuid.uuid4().hex
-
+        signer = self.ring.signer()
         return self.AUTH_PREFIX + self.jwt.encode(
             payload,
-            self.jwt_signing_private,
-            alg="RS512",
-            optional_headers={"kid": _id}
+            signer.signing,
+            alg=self.JWT_ALG,
+            optional_headers={"kid": signer.kid}
         )
 
     def jwt_decode(self, token: str) -> Optional[Dict[str, Any]]:
         if not token.startswith(self.AUTH_PREFIX):
             return None
+        token = token[len(self.AUTH_PREFIX):]
+        key = self.ring.verification_key(token_key_id(token))
+        if key is None:
+            return None
         try:
-            return self.jwt.decode(token[len(self.AUTH_PREFIX):], self.jwt_signing_public)
+            return self.jwt.decode(token, key, algorithms={self.JWT_ALG})
         except BaseException as error:
             logger.error(f"{type(error).__name__}: {str(error)}")
             return None
 
-    @property
-    def public_key(self) -> RsaKey:
-        return self.key.public_key()
-
     @classmethod
     def provide(cls) -> "RSACipher":
         if not cls.instance:
             cls.instance = RSACipher()
         return cls.instance
 
-    @classmethod
-    def _get_key(cls) -> RsaKey:
-        with open(cls.KEYS_PATH, "rb") as file:
-            encoded_key = file.read()
-            key: RsaKey = RSA.import_key(encoded_key, passphrase=cls.PASSPHRASE)
-            file.flush()
-        return key
-
     @classmethod
     def generate_key(cls) -> bytes:
         key = RSA.generate(3072)
@@ -213,3 +206,14 @@ class RSACipher(object):
         file.write(encrypted_key)
         file.close()
         return encrypted_key
+
+    @classmethod
+    def rotate(cls) -> str:
+        """ Writes a new signing key into KEYS_DIR; running workers pick it up without a restart. """
+        key = RSA.generate(3072)
+        os.makedirs(cls.KEYS_DIR, exist_ok=True)
+        path = os.path.join(cls.KEYS_DIR, f"{time.strftime('%Y%m%d%H%M%S')}-{key_id(key.public_key())}{KEY_SUFFIX}")
+        with open(path + ".tmp", "wb") as file:
+            file.write(key.export_key(passphrase=cls.PASSPHRASE, pkcs=8, protection="scryptAndAES256-CBC"))
+        os.replace(path + ".tmp", path)
+        return path
@@ -0,0 +1,223 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Final, Optional, Dict, Tuple, Any, Callable
+
+from Crypto.PublicKey import RSA
+from Crypto.PublicKey.RSA import RsaKey
+from jwt import jwk_from_pem
+from jwt.jwk import AbstractJWKBase
+from loguru import logger
+
+KEY_SUFFIX: Final[str] = ".pem"
+FILE_STAMP = Tuple[int, int]  # (mtime_ns, size)
+
+
+def key_id(public_key: RsaKey) -> str:
+    """ Stable kid: the same key gets the same id in every worker and after every restart. """
+    digest = hashlib.sha256(public_key.export_key(format="DER")).digest()
+    return base64.urlsafe_b64encode(digest[:12]).decode("ascii")
+
+
+def token_key_id(token: str) -> Optional[str]:
+    """ Reads 'kid' from the (not yet verified) JOSE header of a compact JWT. """
+    header = token.split(".", 1)[0]
+    try:
+        return json.loads(base64.urlsafe_b64decode(header + "=" * (-len(header) % 4))).get("kid", None)
+    except (ValueError, AttributeError):
+        return None
+
+
+@dataclass(frozen=True)
+class KeyEntry:
+    kid: str
+    path: str
+    stamp: FILE_STAMP
+    signing: AbstractJWKBase
+    verifying: AbstractJWKBase
+    retires: Optional[float] = None  # monotonic deadline, set once the file is gone
+
+    def is_retiring(self) -> bool:
+        return self.retires is not None
+
+
+@dataclass(frozen=True)
+class KeySet:
+    keys: Dict[str, KeyEntry]
+    signer: Optional[KeyEntry]
+    fallback: Optional[KeyEntry]
+
+
+class KeyRing(object):
+    """
+    JWT signing keys indexed by kid.
+    The ring is an immutable 'KeySet' swapped in with a single assignment, so the request
+    path only does a dict lookup and never takes a lock or touches the disk.
+    A background thread rescans the keys directory (a stat per file, keys are parsed only
+    when a file changes):
+      - a new key signs once it is older than 'activation_delay', so every worker already
+        knows it by the time tokens signed with it show up;
+      - a key whose file is removed still verifies for 'grace' seconds, then it is dropped.
+    Tokens whose kid isn't in the ring (issued before kids were stable) are checked with the
+    legacy key while it is loaded.
+    """
+    DEFAULT_INTERVAL: Final[float] = 30.0
+    DEFAULT_GRACE: Final[float] = 7 * 24 * 3600.0
+
+    def __init__(
+            self,
+            directory: str,
+            passphrase: str,
+            legacy_path: Optional[str] = None,
+            grace: float = DEFAULT_GRACE,
+            activation_delay: float = 2 * DEFAULT_INTERVAL,
+            clock: Callable[[], float] = time.time
+    ) -> None:
+        self.directory = directory
+        self.passphrase = passphrase
+        self.legacy_path = legacy_path
+        self.grace = grace
+        self.activation_delay = activation_delay
+        self.clock = clock
+        self._snapshot = KeySet({}, None, None)
+        self._reload_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def snapshot(self) -> KeySet:
+        return self._snapshot
+
+    def signer(self) -> KeyEntry:
+        signer = self._snapshot.signer
+        if signer is None:
+            raise LookupError(f"Error: no signing key in '{self.directory}' or '{self.legacy_path}'!")
+        return signer
+
+    def verification_key(self, kid: Optional[str]) -> Optional[AbstractJWKBase]:
+        snapshot = self._snapshot
+        entry = snapshot.keys.get(kid, None) if kid is not None else None
+        if entry is None:
+            entry = snapshot.fallback
+        return entry.verifying if entry is not None else None
+
+    def start(self, interval: float = DEFAULT_INTERVAL) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, args=(interval,), name="key-ring", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def _watch(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.reload()
+            except Exception as error:
+                logger.error(f"Key ring reload failed: {type(error).__name__}: {error}")
+
+    def _key_files(self) -> Dict[str, FILE_STAMP]:
+        files = {}
+        if os.path.isdir(self.directory):
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith(KEY_SUFFIX):
+                        stat = entry.stat()
+                        files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        if self.legacy_path and os.path.isfile(self.legacy_path):
+            stat = os.stat(self.legacy_path)
+            files[self.legacy_path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def _load(self, path: str, stamp: FILE_STAMP) -> KeyEntry:
+        with open(path, "rb") as file:
+            key: RsaKey = RSA.import_key(file.read(), passphrase=self.passphrase)
+        return KeyEntry(
+            kid=key_id(key.public_key()),
+            path=path,
+            stamp=stamp,
+            signing=jwk_from_pem(key.export_key()),
+            verifying=jwk_from_pem(key.public_key().export_key())
+        )
+
+    def reload(self) -> bool:
+        """ Rescans the directory and swaps in a new key set; returns True if anything changed. """
+        with self._reload_lock:
+            old = self._snapshot
+            files = self._key_files()
+            by_path = {entry.path: entry for entry in old.keys.values() if not entry.is_retiring()}
+            now, monotonic = self.clock(), time.monotonic()
+            keys: Dict[str, KeyEntry] = {}
+            for path, stamp in files.items():
+                entry = by_path.get(path, None)
+                if entry is None or entry.stamp != stamp:
+                    try:
+                        entry = self._load(path, stamp)
+                    except (ValueError, IndexError, TypeError, OSError) as error:
+                        logger.error(f"Can't load key '{path}': {type(error).__name__}: {error}")
+                        continue
+                    logger.info(f"Key {entry.kid} loaded from '{path}'")
+                keys[entry.kid] = entry
+            for kid, entry in old.keys.items():
+                if kid in keys:
+                    continue
+                if not entry.is_retiring():
+                    entry = KeyEntry(entry.kid, entry.path, entry.stamp, entry.signing, entry.verifying,
+                                     retires=monotonic + self.grace)
+                    logger.info(f"Key {kid} retires in {self.grace:.0f}s")
+                if entry.retires > monotonic:
+                    keys[kid] = entry
+                else:
+                    logger.info(f"Key {kid} retired")
+            snapshot = KeySet(keys, self._pick_signer(keys, now), self._pick_fallback(keys))
+            changed = snapshot != old
+            if changed:
+                self._snapshot = snapshot
+            return changed
+
+    def _pick_signer(self, keys: Dict[str, KeyEntry], now: float) -> Optional[KeyEntry]:
+        active = [entry for entry in keys.values() if not entry.is_retiring()]
+        if not active:
+            return None
+        newest_first = sorted(active, key=lambda entry: (entry.stamp[0], entry.kid), reverse=True)
+        activation_ns = (now - self.activation_delay) * 1e9
+        return next((entry for entry in newest_first if entry.stamp[0] <= activation_ns), newest_first[-1])
+
+    def _pick_fallback(self, keys: Dict[str, KeyEntry]) -> Optional[KeyEntry]:
+        return next((entry for entry in keys.values() if entry.path == self.legacy_path), None)
+
+    def describe(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "signer": snapshot.signer.kid if snapshot.signer else None,
+            "keys": {
+                kid: {"path": entry.path, "retires_in": None if entry.retires is None
+                      else round(entry.retires - time.monotonic())}
+                for kid, entry in snapshot.keys.items()
+            },
+        }
+
+
+def main() -> None:
+    import argparse
+    from src.utils.encodings import RSACipher
+
+    parser = argparse.ArgumentParser(description="JWT signing keys")
+    parser.add_argument("command", choices=("list", "rotate"))
+    args = parser.parse_args()
+    if args.command == "rotate":
+        print(f"New key: {RSACipher.rotate()}")
+    print(json.dumps(RSACipher.provide().ring.describe(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import random
+from typing import Dict, Tuple, Final, Any
+
+from loguru import logger
+
+# (minimum level number, sampled fraction of the records below WARNING) of a category.
+RULE = Tuple[int, float]
+WARNING_NO: Final[int] = 30
+_LEVEL_NO: Final[Dict[str, int]] = {
+    "TRACE": 5, "DEBUG": 10, "INFO": 20, "SUCCESS": 25, "WARNING": 30, "ERROR": 40, "CRITICAL": 50,
+}
+_levels: Dict[str, int] = {}
+_sampling: Dict[str, float] = {}
+_rules: Dict[str, RULE] = {}
+
+
+def level_no(level: str) -> int:
+    return _LEVEL_NO.get(level, None) or logger.level(level).no
+
+
+def configure(levels: Dict[str, str], sampling: Dict[str, float]) -> None:
+    """ Levels and sampling by dotted category prefix; unconfigured, every record passes. """
+    global _levels, _sampling, _rules
+    _levels = {category: level_no(level) for category, level in levels.items()}
+    _sampling = dict(sampling)
+    _rules = {}
+
+
+def _match(table: Dict[str, Any], category: str, default: Any) -> Any:
+    while True:
+        if category in table:
+            return table[category]
+        if not category:
+            return default
+        category = category.rpartition(".")[0]
+
+
+def rule(category: str) -> RULE:
+    found = _rules.get(category, None)
+    if found is None:
+        found = _rules[category] = (_match(_levels, category, 0), _match(_sampling, category, 1.0))
+    return found
+
+
+def is_enabled(level: str, category: str = "") -> bool:
+    return level_no(level) >= rule(category)[0]
+
+
+def keep(level: int, category: str) -> bool:
+    """ The level and sampling decision for one record. """
+    minimum, rate = rule(category)
+    if level < minimum:
+        return False
+    return rate >= 1.0 or level >= WARNING_NO or random.random() < rate
+
+
+class CategoryLogger(object):
+    """
+    Loguru front for hot paths. Loguru builds the whole record (frame, time, extra) before
+    any handler compares levels, so a disabled 'logger.debug' still costs microseconds;
+    this checks the category rule first and drops the call for the price of a dict lookup.
+    Pass arguments ("... {}", value) instead of f-strings so only kept records are formatted.
+    """
+    __slots__ = ("category", "_logger")
+
+    def __init__(self, category: str) -> None:
+        self.category = category
+        self._logger = logger.bind(category=category).opt(depth=2)  # the caller of debug() etc.
+
+    def is_enabled(self, level: str) -> bool:
+        return is_enabled(level, self.category)
+
+    def _log(self, level: str, message: str, args, kwargs) -> None:
+        minimum, rate = _rules.get(self.category, None) or rule(self.category)
+        number = _LEVEL_NO[level]
+        if number < minimum:
+            return
+        if rate < 1.0 and number < WARNING_NO:
+            if random.random() >= rate:
+                return
+            kwargs["sample_rate"] = rate  # sampled here, the log filter keeps it
+        self._logger.log(level, message, *args, **kwargs)
+
+    def trace(self, message: str, *args, **kwargs) -> None:
+        self._log("TRACE", message, args, kwargs)
+
+    def debug(self, message: str, *args, **kwargs) -> None:
+        self._log("DEBUG", message, args, kwargs)
+
+    def info(self, message: str, *args, **kwargs) -> None:
+        self._log("INFO", message, args, kwargs)
+
+    def warning(self, message: str, *args, **kwargs) -> None:
+        self._log("WARNING", message, args, kwargs)
+
+    def error(self, message: str, *args, **kwargs) -> None:
+        self._log("ERROR", message, args, kwargs)
+
+
+def get_logger(category: str) -> CategoryLogger:
+    return CategoryLogger(category)
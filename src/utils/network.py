@@ -1,10 +1,9 @@
 import asyncio
-import enum
-import socket
-from dataclasses import dataclass
-from enum import IntEnum
+import random
+import weakref
+from dataclasses import dataclass, field
 from typing import (
-    TypeVar, Generic, Optional, Tuple, Any, Union
+    TypeVar, Generic, Optional, Tuple, Any, Union, Dict, FrozenSet, Iterable, List, Set, Final
 )
 
 from aiohttp import RequestInfo, ClientSession, ClientResponse
@@ -14,211 +13,14 @@ from aiohttp.typedefs import RawHeaders
 from aiohttp.web_exceptions import HTTPException
 from loguru import logger
 from multidict import CIMultiDictProxy, MultiDictProxy
-from strenum import StrEnum
 from yarl import URL
 
-
-@enum.unique
-class ResMethod(StrEnum):
-    TEXT = enum.auto()
-    JSON = enum.auto()
-
-
-@enum.unique
-class ContentType(StrEnum):
-    APPLICATION_JSON = "application/json"
-    APPLICATION_JSON_LD = "application/ld+json"
-    APPLICATION_XML = "application/xml"
-    APPLICATION_JAVASCRIPT = "application/javascript"
-    APPLICATION_FORM_URL_ENCODED = "application/x-www-form-urlencoded"
-    APPLICATION_OCTET_STREAM = "application/octet-stream"
-    APPLICATION_ZIP = "application/zip"
-    APPLICATION_7Z = "application/x-7z-compressed"
-    APPLICATION_X_RAR = "application/x-rar"
-    APPLICATION_RAR = "application/vnd.rar"
-    APPLICATION_JAVA_ARCHIVE = "application/java-archive"
-    APPLICATION_PHP = "application/x-httpd-php"
-    APPLICATION_SQLITE3 = "application/x-sqlite3"
-    APPLICATION_PDF = "application/pdf"
-    APPLICATION_OGG = "application/ogg"
-    APPLICATION_APPLE_PACKAGE_INSTALLER = "application/vnd.apple.installer+xml"
-    APPLICATION_OPEN_DOCUMENT_PRESENTATION = "application/vnd.oasis.opendocument.presentation"
-    APPLICATION_OPEN_DOCUMENT_SPREADSHEET = "application/vnd.oasis.opendocument.spreadsheet"
-    APPLICATION_OPEN_DOCUMENT_TEXT = "application/vnd.oasis.opendocument.text"
-    APPLICATION_XHTML = "application/xhtml+xml"
-    APPLICATION_XLS = "application/vnd.ms-excel"
-    APPLICATION_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    APPLICATION_VISIO = "application/vnd.visio"
-    APPLICATION_TAR = "application/x-tar"
-    APPLICATION_PPT = "application/vnd.ms-powerpoint"
-    APPLICATION_RICH_TEXT = "application/rtf"
-    APPLICATION_PDB = "application/x-ms-pdb"
-    APPLICATION_ARCHIVE = "application/x-archive"
-    APPLICATION_SHELL = "application/x-sh"
-    APPLICATION_PE = "application/vnd.microsoft.portable-executable"
-    APPLICATION_EXE = "application/x-dosexec"
-    APPLICATION_APK = "application/vnd.android.package-archive"
-    APPLICATION_PPTX = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
-
-    AUO_OGG = "audio/ogg"
-    AUDIO_WAW = "audio/wav"
-    AUDIO_MIDI = "audio/x-midi"
-    AUDIO_WEBM = "audio/webm"
-    AUDIO_MPEG = "audio/mpeg"
-    AUDIO_WEBP = "audio/webp"
-    AUDIO_OPUS = "audio/opus"
-
-    VIDEO_OGG = "video/ogg"
-
-    TEXT_PLAIN = "text/plain"
-    TEXT_XML = "text/xml"
-    TEXT_PYTHON = "text/x-python"
-    TEXT_BATCH = "text/x-msdos-batch"
-    TEXT_C_PLUS_PLUS = "text/x-c"
-    TEXT_HTML = "text/html"
-    TEXT_CSS = "text/css"
-
-    IMAGE_APNG = "image/apng"
-    IMAGE_AVIF = "image/avif"
-    IMAGE_BMP = "image/bmp"
-    IMAGE_ICO = "image/vnd.microsoft.icon"
-    IMAGE_TIFF = "image/tiff"
-    IMAGE_GIF = "image/gif"
-    IMAGE_JPEG = "image/jpeg"
-    IMAGE_SVG = "image/svg+xml"
-    IMAGE_PNG = "image/png"
-
-    FONT_OTF = "font/otf"
-    FONT_TTF = "font/ttf"
-    FONT_WOFF = "font/woff"
-    FONT_WOFF2 = "font/woff2"
-
-    MULTIPART_FORM_DATA = "multipart/form-data"
-    ALL = "*/*"
-
-
-@enum.unique
-class RequestMethod(StrEnum):
-    GET = enum.auto()
-    POST = enum.auto()
-    DELETE = enum.auto()
-    PUT = enum.auto()
-    PATCH = enum.auto()
-    HEAD = enum.auto()
-    COPY = enum.auto()
-    OPTIONS = enum.auto()
-    LINK = enum.auto()
-    UNLINK = enum.auto()
-    PURGE = enum.auto()
-    LOCK = enum.auto()
-    UNLOCK = enum.auto()
-    PROPFIND = enum.auto()
-    VIEW = enum.auto()
-
-
-class ResponseCode(IntEnum):
-    CONTINUE = 100
-    SWITCHING_PROTOCOL = 101
-    PROCESSING = 102
-    EARLY_HINTS = 103
-
-    OK = 200
-    CREATED = 201
-    ACCEPTED = 202
-    NON_AUTHORITATIVE_INFORMATION = 203
-    NO_CONTENT = 204
-    RESET_CONTENT = 205
-    PARTIAL_CONTENT = 206
-    MULTI_STATUS = 207
-    ALREADY_REPORTED = 208
-    IM_USED = 226
-
-    MULTIPLE_CHOICES = 300
-    MOVED_PERMANENTLY = 301
-    FOUND = 302
-    SEE_OTHER = 303
-    NOT_MODIFIED = 304
-    USE_PROXY = 305
-    SWITCHING_PROXY = 306
-    TEMPORARY_REDIRECT = 307
-    PERMANENT_REDIRECT = 308
-
-    BAD_REQUEST = 400
-    UNAUTHORIZED = 401
-    PAYMENT_REQUIRED = 402
-    FORBIDDEN = 403
-    NOT_FOUND = 404
-    METHOD_NOT_ALLOWED = 405
-    NOT_ACCEPTABLE = 406
-    PROXY_AUTHENTICATION_REQUIRED = 407
-    REQUEST_TIMEOUT = 408
-    CONFLICT = 409
-    GONE = 410
-    LENGTH_REQUIRED = 411
-    PRECONDITION_FAILED = 412
-    PAYLOAD_TOO_LARGE = 413
-    URI_TOO_LONG = 414
-    UNSUPPORTED_MEDIA_TYPE = 415
-    RANGE_NOT_SATISFIABLE = 416
-    EXPECTATION_FAILED = 417
-    IM_A_TEAPOT = 418  # CRINGE
-    PAGE_EXPIRED = 419
-    METHOD_FAILURE = 420
-    ENHANCE_YOUR_CALM = 420  # TWITTER
-    LOGIN_TIMEOUT = 420
-    MISDIRECTED_REQUEST = 421
-    UNPROCESSABLE_ENTITY = 422
-    LOCKED = 423
-    FAILED_DEPENDENCY = 424
-    TOO_EARLY = 425
-    UPGRADE_REQUIRED = 426
-    PRECONDITION_REQUIRED = 428
-    TOO_MANY_REQUESTS = 429
-    REQUEST_HEADER_FIELDS_TOO_LARGE_SHOPIFY = 430
-    REQUEST_HEADER_FIELDS_TOO_LARGE = 431
-    NO_RESPONSE = 444
-    RETRY_WITH = 449
-    UNAVAILABLE_FOR_LEGAL_REASONS = 451
-    REDIRECT = 451
-    REQUEST_HEADER_TOO_LARGE = 494
-    SSL_CERTIFICATE_ERROR = 495
-    SSL_CERTIFICATE_REQUIRED = 496
-    HTTP_REQUEST_SENT_TO_HTTPS_PORT = 497
-    INVALID_TOKEN = 498
-    TOKEN_REQUIRED = 499
-    CLIENT_CLOSED_REQUEST = 499
-
-    INTERNAL_SERVER_ERROR = 500
-    NOT_IMPLEMENTED = 501
-    BAD_GATEWAY = 502
-    SERVICE_UNAVAILABLE = 503
-    TIMEOUT_GATEWAY = 504
-    HTTP_VERSION_NOT_SUPPORTED = 505
-    VARIANT_ALSO_NEGOTIATES = 506
-    INSUFFICIENT_STORAGE = 507
-    LOOP_DETECTED = 508
-    BANDWIDTH_LIMIT_EXCEEDED = 509
-    NOT_EXTENDED = 510
-    NETWORK_AUTHENTICATION_REQUIRED = 511
-    WEB_SERVER_RETURNED_AN_UNKNOWN_ERROR = 520
-    WEB_SERVER_IS_DOWN = 521
-    CONNECTION_TIMED_OUT = 522
-    ORIGIN_IS_UNREACHABLE = 523
-    A_TIMEOUT_OCCURRED = 524
-    INVALID_SSL_CERTIFICATE = 526
-    RAILGUN_ERROR = 527
-    SITE_IS_OVERLOADED = 529
-    SITE_IS_FROZEN = 530
-    CLOUDFLARE_INFORMATION = 530
-    NETWORK_READ_TIMEOUT_ERROR = 598
-    NETWORK_CONNECT_TIMEOUT_ERROR = 599
-
-    # Custom codes
-    NO_ERROR = 0
-    ERROR_OCCURRED_CODE = -1
+from src.utils.codes import ResMethod, ContentType, RequestMethod, ResponseCode
+from src.utils.logs import get_logger
 
 
 T = TypeVar("T")
+hot_logger = get_logger(__name__)
 
 
 @dataclass()
@@ -294,23 +96,117 @@ class NetworkResultAsync(Generic[T]):
         return self.response.ok
 
 
+@dataclass(frozen=True)
+class QueryRequest:
+    url: Union[str, URL]
+    method: RequestMethod = RequestMethod.GET
+    res_method: ResMethod = ResMethod.TEXT
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Retries with "full jitter" exponential backoff: the n-th retry sleeps a random
+    time in [0, min(max_delay, base_delay * 2 ** n)], or honours 'Retry-After'.
+    Only idempotent methods are retried.
+    """
+    attempts: int = 3
+    base_delay: float = 0.05
+    max_delay: float = 5.0
+    retry_codes: FrozenSet[int] = frozenset({
+        ResponseCode.ERROR_OCCURRED_CODE,
+        ResponseCode.REQUEST_TIMEOUT,
+        ResponseCode.TOO_MANY_REQUESTS,
+        ResponseCode.INTERNAL_SERVER_ERROR,
+        ResponseCode.BAD_GATEWAY,
+        ResponseCode.SERVICE_UNAVAILABLE,
+        ResponseCode.TIMEOUT_GATEWAY,
+    })
+    methods: FrozenSet[RequestMethod] = frozenset({
+        RequestMethod.GET,
+        RequestMethod.HEAD,
+        RequestMethod.OPTIONS,
+        RequestMethod.PUT,
+        RequestMethod.DELETE,
+    })
+
+    def should_retry(self, request: QueryRequest, result: NetworkResultAsync[Any], attempt: int) -> bool:
+        return attempt + 1 < self.attempts and request.method in self.methods and result.code in self.retry_codes
+
+    def backoff(self, attempt: int, result: NetworkResultAsync[Any]) -> float:
+        if result.response is not None:
+            retry_after = result.response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+NO_RETRY: Final[RetryPolicy] = RetryPolicy(attempts=1)
+
+
+# The 'query_many' workers of each session, for 'close' to cancel; kept outside the session
+# since aiohttp doesn't want attributes set on a ClientSession.
+_pending: "weakref.WeakKeyDictionary[HTTPSession, Set[asyncio.Task]]" = weakref.WeakKeyDictionary()
+
+
 class HTTPSession(ClientSession):
     """ Abstract class for aiohttp. """
+    DEFAULT_LIMIT: Final[int] = 100
+    DEFAULT_LIMIT_PER_HOST: Final[int] = 32
+    DEFAULT_CONCURRENCY: Final[int] = 64
+    DNS_CACHE_TTL: Final[int] = 300
+    KEEPALIVE_TIMEOUT: Final[float] = 30.0
 
-    def __init__(self, *args, **kwargs) -> None:
+    def __init__(
+            self,
+            *args,
+            limit: int = DEFAULT_LIMIT,
+            limit_per_host: int = DEFAULT_LIMIT_PER_HOST,
+            **kwargs
+    ) -> None:
+        if kwargs.get("connector", None) is None:
+            kwargs["connector"] = self.create_connector(limit, limit_per_host)
         super().__init__(*args, **kwargs)
 
+    @classmethod
+    def create_connector(cls, limit: int = DEFAULT_LIMIT, limit_per_host: int = DEFAULT_LIMIT_PER_HOST) -> TCPConnector:
+        return TCPConnector(
+            limit=limit,
+            limit_per_host=limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=cls.DNS_CACHE_TTL,
+            keepalive_timeout=cls.KEEPALIVE_TIMEOUT,
+            enable_cleanup_closed=True,
+        )
+
     def __del__(self, **kwargs) -> None:
         """
-        Closes the ClientSession instance
-        cleanly when the instance is deleted.
-        Useful for things like when the interpreter closes.
-        This would be perfect if discord.py had this as well. :thinking:
-        :param **kwargs:
+        Releases the pooled connections when the instance is deleted.
+        Finalizers can run inside a running event loop (or without any), so no loop is
+        used here: use 'async with HTTPSession()' or 'await session.close()' for a clean
+        shutdown.
         """
         super(HTTPSession, self).__del__()
         if not self.closed:
-            asyncio.run(self.close())
+            # Nothing is pending (its tasks would keep the session alive), and aiohttp closes
+            # the connector without suspending, so the coroutine finishes on its first step.
+            closing = self.close()
+            try:
+                closing.send(None)
+            except StopIteration:
+                pass
+            else:
+                closing.close()
+
+    async def close(self) -> None:
+        """ Cancels in-flight 'query_many' work, waits for it and closes the connector. """
+        pending = list(_pending.pop(self, ()))
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        await super().close()
 
     async def get_result(self, url, *args, **kwargs) -> NetworkResultAsync[Any]:
         return await self.query(url, RequestMethod.GET, *args, **kwargs)
@@ -328,18 +224,60 @@ class HTTPSession(ClientSession):
                     **kwargs) -> NetworkResultAsync[Any]:
         try:
             async with getattr(self, method.lower())(url, *args, **kwargs) as response:
-                text = await response.text()
-                logger.debug(f"Response info: {response}")
-                logger.debug(f"Content details: {text}")
+                data = await getattr(response, res_method.lower())()
+                hot_logger.debug("Response info: {}", response)
+                if res_method != ResMethod.READ:
+                    hot_logger.debug("Content details: {}", data)
                 return NetworkResultAsync(
-                    data=await getattr(response, res_method.lower())(),
+                    data=data,
                     code=response.status,
                     error=None,
                     response=response
                 )
+        except asyncio.CancelledError:
+            raise
         except BaseException as error:
             logger.error(f"{type(error).__name__}: {str(error)}")
             if isinstance(error, HTTPException):
                 return NetworkResultAsync(data=error.text, code=error.status_code, error=error, response=None)
             else:
                 return NetworkResultAsync(data=None, code=ResponseCode.ERROR_OCCURRED_CODE, error=error, response=None)
+
+    async def query_with_retry(self, request: QueryRequest, retry: RetryPolicy = NO_RETRY) -> NetworkResultAsync[Any]:
+        attempt = 0
+        while True:
+            result = await self.query(request.url, request.method, request.res_method, **request.kwargs)
+            if not retry.should_retry(request, result, attempt):
+                return result
+            await asyncio.sleep(retry.backoff(attempt, result))
+            attempt += 1
+
+    async def query_many(
+            self,
+            requests: Iterable[QueryRequest],
+            concurrency: int = DEFAULT_CONCURRENCY,
+            retry: RetryPolicy = RetryPolicy()
+    ) -> List[NetworkResultAsync[Any]]:
+        """
+        Runs the requests with at most 'concurrency' in flight (the connector limits
+        connections per host on top of that) and returns the results in input order.
+        'requests' is consumed lazily, so generators of any length are fine.
+        """
+        if self.closed:
+            raise RuntimeError("Session is closed")
+        results: Dict[int, NetworkResultAsync[Any]] = {}
+        queue = enumerate(requests)
+
+        async def worker() -> None:
+            for index, request in queue:
+                results[index] = await self.query_with_retry(request, retry)
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(max(1, concurrency))]
+        _pending.setdefault(self, set()).update(workers)
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            _pending.get(self, set()).difference_update(workers)
+        return [results[index] for index in range(len(results))]
@@ -1,15 +1,19 @@
 import enum
 import hashlib
 import math
+import mmap
 import os
+from concurrent.futures import ThreadPoolExecutor
 from os import PathLike
 from pathlib import Path
-from typing import Final, Union
+from typing import Final, Union, Iterable, Dict, Optional, Callable, Tuple, BinaryIO, List
 
 
 BYTES_IN_KB: Final[int] = 1024
 BYTES_IN_MB: Final[int] = int(math.pow(BYTES_IN_KB, 2))
 BYTES_IN_GB: Final[int] = int(math.pow(BYTES_IN_KB, 3))
+CHECKSUM_BUFFER_SIZE: Final[int] = BYTES_IN_MB
+MMAP_THRESHOLD: Final[int] = 16 * BYTES_IN_MB
 
 
 @enum.unique
@@ -23,15 +27,140 @@ class ChecksumHash(enum.Enum):
 
 
 M_PATH = Union[Path, str, bytes, PathLike[str], PathLike[bytes], int]
+ON_CHUNK = Optional[Callable[[int], None]]
 
 
-def file_checksum(path: M_PATH, hash_alg: ChecksumHash) -> str:
+def file_checksum(
+        path: M_PATH,
+        hash_alg: ChecksumHash,
+        buffer_size: int = CHECKSUM_BUFFER_SIZE,
+        on_chunk: ON_CHUNK = None
+) -> str:
     if not isinstance(hash_alg, ChecksumHash):
         raise TypeError(f"Error: parameter 'hash' must be a {type(ChecksumHash)}! Given type: {type(hash_alg)}")
+    return file_checksums(path, (hash_alg,), buffer_size, on_chunk)[hash_alg]
+
+
+def file_checksums(
+        path: M_PATH,
+        hash_algs: Iterable[ChecksumHash],
+        buffer_size: int = CHECKSUM_BUFFER_SIZE,
+        on_chunk: ON_CHUNK = None
+) -> Dict[ChecksumHash, str]:
+    """
+    Computes every requested digest in a single pass over the file.
+    Large files are mmap'd and fed to the hashers as zero-copy slices, smaller ones
+    are read into one reused buffer; hashlib releases the GIL for such big updates.
+    'on_chunk' is called with the size of every block (e.g. to pace the reads).
+    """
+    hash_algs = tuple(hash_algs)
+    for hash_alg in hash_algs:
+        if not isinstance(hash_alg, ChecksumHash):
+            raise TypeError(f"Error: parameter 'hash' must be a {type(ChecksumHash)}! Given type: {type(hash_alg)}")
     if not os.path.exists(path):
         raise FileNotFoundError(f"Error: file '{path}' is not found!")
+    hashers = [hash_alg.value() for hash_alg in hash_algs]
     with open(path, "rb") as file:
-        file_hash = hash_alg.value()
-        while chunk := file.read(BYTES_IN_KB * 8):
-            file_hash.update(chunk)
-    return file_hash.hexdigest()
+        size = os.fstat(file.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                for offset in range(0, size, buffer_size):
+                    block = view[offset:offset + buffer_size]
+                    for hasher in hashers:
+                        hasher.update(block)
+                    if on_chunk:
+                        on_chunk(len(block))
+                    block.release()
+        else:
+            _update_from_stream(file, hashers, buffer_size, on_chunk)
+    return {hash_alg: hasher.hexdigest() for hash_alg, hasher in zip(hash_algs, hashers)}
+
+
+def stream_checksum(
+        source: BinaryIO,
+        hash_alg: ChecksumHash,
+        buffer_size: int = CHECKSUM_BUFFER_SIZE,
+        on_chunk: ON_CHUNK = None
+) -> str:
+    """ Digest of what is left in a readable stream, e.g. a decrypting one. """
+    hasher = hash_alg.value()
+    _update_from_stream(source, [hasher], buffer_size, on_chunk)
+    return hasher.hexdigest()
+
+
+def checksum_many(
+        paths: Iterable[M_PATH],
+        hash_algs: Iterable[ChecksumHash] = (ChecksumHash.SHA_256,),
+        workers: Optional[int] = None,
+        buffer_size: int = CHECKSUM_BUFFER_SIZE
+) -> List[Tuple[M_PATH, Union[Dict[ChecksumHash, str], OSError]]]:
+    """ Hashes many files on a thread pool (one file per thread, all cores busy). """
+    hash_algs = tuple(hash_algs)
+
+    def checksum(path: M_PATH) -> Tuple[M_PATH, Union[Dict[ChecksumHash, str], OSError]]:
+        try:
+            return path, file_checksums(path, hash_algs, buffer_size)
+        except OSError as error:
+            return path, error
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        return list(executor.map(checksum, paths))
+
+
+def copy_with_checksums(
+        source: BinaryIO,
+        path: M_PATH,
+        hash_algs: Iterable[ChecksumHash],
+        buffer_size: int = CHECKSUM_BUFFER_SIZE,
+        on_chunk: ON_CHUNK = None,
+        fsync: bool = False
+) -> Tuple[int, Dict[ChecksumHash, str]]:
+    """
+    Writes the stream to 'path' and hashes it on the way; returns the size and the digests.
+    With 'fsync' the data is on disk when it returns.
+    """
+    with open(path, "wb") as file:
+        ret = copy_stream(source, file, hash_algs, buffer_size, on_chunk)
+        if fsync:
+            file.flush()
+            os.fsync(file.fileno())
+    return ret
+
+
+def copy_stream(
+        source: BinaryIO,
+        sink: BinaryIO,
+        hash_algs: Iterable[ChecksumHash],
+        buffer_size: int = CHECKSUM_BUFFER_SIZE,
+        on_chunk: ON_CHUNK = None
+) -> Tuple[int, Dict[ChecksumHash, str]]:
+    """ Copies the stream into any writable one, hashing it on the way; returns the size and the digests. """
+    hash_algs = tuple(hash_algs)
+    hashers = [hash_alg.value() for hash_alg in hash_algs]
+    size = _update_from_stream(source, hashers, buffer_size, on_chunk, sink)
+    return size, {hash_alg: hasher.hexdigest() for hash_alg, hasher in zip(hash_algs, hashers)}
+
+
+def _update_from_stream(source: BinaryIO, hashers: list, buffer_size: int, on_chunk: ON_CHUNK, sink=None) -> int:
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    size = 0
+    readinto = getattr(source, "readinto", None)
+    while True:
+        if readinto is not None:
+            read = readinto(buffer)
+            block = view[:read] if read else None
+        else:
+            data = source.read(buffer_size)
+            read, block = len(data), data
+        if not read:
+            break
+        for hasher in hashers:
+            hasher.update(block)
+        if sink is not None:
+            sink.write(block)
+        if on_chunk:
+            on_chunk(read)
+        size += read
+    view.release()
+    return size
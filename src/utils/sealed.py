@@ -0,0 +1,216 @@
+"""
+Sealed files: a plaintext split into fixed-size chunks, each encrypted and authenticated on
+its own with AES-256-GCM under a random per-file data key; the data key is stored in the
+header, wrapped (AES-GCM) by a master key.
+
+    header   MAGIC | chunk size | master key id | wrap nonce | wrapped data key | wrap tag
+    chunk i  ciphertext (chunk size bytes, the last one shorter) | tag
+
+Chunk i uses nonce i, which is unique because the data key is used for one file only, and
+authenticates (i, is last chunk) as associated data, so chunks can't be reordered, dropped
+or cut off at the end. Every chunk sits at a computable offset: any byte range is read by
+decrypting only the chunks it overlaps.
+"""
+import hashlib
+import io
+import os
+import struct
+from concurrent.futures import Executor, Future
+from typing import Optional, Callable, Dict, BinaryIO, Deque, Tuple, Final
+from collections import deque
+
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+
+MAGIC: Final[bytes] = b"BKSEAL01"
+HEADER: Final[struct.Struct] = struct.Struct(">8sI8s12s32s16s")
+KEY_SIZE: Final[int] = 32
+TAG_SIZE: Final[int] = 16
+KEY_ID_SIZE: Final[int] = 8
+DEFAULT_WINDOW: Final[int] = 8
+
+KEY_LOOKUP = Callable[[bytes], Optional[bytes]]
+
+
+class SealedFileError(ValueError):
+    """ A sealed file failed authentication (tampered with, corrupted or truncated) or can't be opened. """
+
+
+def master_key_id(master_key: bytes) -> bytes:
+    return hashlib.sha256(b"sealed-master-key:" + master_key).digest()[:KEY_ID_SIZE]
+
+
+def is_sealed(path: str) -> bool:
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def plain_size(sealed_size: int, chunk_size: int) -> int:
+    body = sealed_size - HEADER.size
+    chunks = max(1, -(-body // (chunk_size + TAG_SIZE)))
+    return body - chunks * TAG_SIZE
+
+
+def _chunk_cipher(data_key: bytes, index: int, final: bool):
+    cipher = AES.new(data_key, AES.MODE_GCM, nonce=index.to_bytes(12, "big"))
+    cipher.update(struct.pack(">Q?", index, final))
+    return cipher
+
+
+def seal_chunk(data_key: bytes, index: int, final: bool, data: bytes) -> bytes:
+    ciphertext, tag = _chunk_cipher(data_key, index, final).encrypt_and_digest(data)
+    return ciphertext + tag
+
+
+def open_chunk(data_key: bytes, index: int, final: bool, sealed: bytes) -> bytes:
+    try:
+        return _chunk_cipher(data_key, index, final).decrypt_and_verify(sealed[:-TAG_SIZE], sealed[-TAG_SIZE:])
+    except ValueError:
+        raise SealedFileError(f"Chunk {index} failed authentication") from None
+
+
+def _run(executor: Optional[Executor], function, *args) -> Future:
+    if executor is not None:
+        return executor.submit(function, *args)
+    future = Future()
+    future.set_result(function(*args))
+    return future
+
+
+class SealedWriter(object):
+    """
+    File-like writer sealing what is written to 'file'. Full chunks are encrypted on
+    'executor' while more data arrives, at most 'window' of them in flight, so memory stays
+    at about (window + 1) chunks; 'close' seals the rest as the last chunk. 'size' is the
+    plaintext size written so far.
+    """
+
+    def __init__(self, file: BinaryIO, master_key: bytes, chunk_size: int,
+                 executor: Optional[Executor] = None, window: int = DEFAULT_WINDOW) -> None:
+        self.file = file
+        self.chunk_size = chunk_size
+        self.executor = executor
+        self.window = window
+        self.size = 0
+        self._data_key = get_random_bytes(KEY_SIZE)
+        self._buffer = bytearray()
+        self._index = 0
+        self._pending: Deque[Future] = deque()
+        self.closed = False
+        key_id, nonce = master_key_id(master_key), get_random_bytes(12)
+        wrap = AES.new(master_key, AES.MODE_GCM, nonce=nonce)
+        wrap.update(MAGIC + struct.pack(">I", chunk_size) + key_id)
+        wrapped, tag = wrap.encrypt_and_digest(self._data_key)
+        file.write(HEADER.pack(MAGIC, chunk_size, key_id, nonce, wrapped, tag))
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self.size += len(data)
+        # The last chunk is only known at 'close', so at least one byte always stays behind.
+        while len(self._buffer) > self.chunk_size:
+            self._submit(bytes(self._buffer[:self.chunk_size]), False)
+            del self._buffer[:self.chunk_size]
+        return len(data)
+
+    def _submit(self, chunk: bytes, final: bool) -> None:
+        self._pending.append(_run(self.executor, seal_chunk, self._data_key, self._index, final, chunk))
+        self._index += 1
+        while len(self._pending) >= self.window or final and self._pending:
+            self.file.write(self._pending.popleft().result())
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self._submit(bytes(self._buffer), True)
+        self._buffer = bytearray()
+        self.closed = True
+
+    def __enter__(self) -> "SealedWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class SealedReader(io.RawIOBase):
+    """
+    Seekable plaintext view of a sealed file. Sequential reads decrypt up to 'window'
+    chunks ahead on 'executor'; a seek elsewhere starts over at the chunk it lands in.
+    Raises SealedFileError for a chunk that fails authentication.
+    """
+
+    def __init__(self, file: BinaryIO, master_keys: KEY_LOOKUP,
+                 executor: Optional[Executor] = None, window: int = DEFAULT_WINDOW) -> None:
+        super().__init__()
+        self.file = file
+        self.executor = executor
+        self.window = window
+        header = file.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise SealedFileError("Truncated header")
+        magic, self.chunk_size, key_id, nonce, wrapped, tag = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise SealedFileError("Not a sealed file")
+        master_key = master_keys(key_id)
+        if master_key is None:
+            raise SealedFileError(f"Unknown master key {key_id.hex()}")
+        unwrap = AES.new(master_key, AES.MODE_GCM, nonce=nonce)
+        unwrap.update(header[:len(MAGIC) + 4 + KEY_ID_SIZE])
+        try:
+            self._data_key = unwrap.decrypt_and_verify(wrapped, tag)
+        except ValueError:
+            raise SealedFileError("Data key failed authentication") from None
+        sealed_size = os.fstat(file.fileno()).st_size
+        self.size = plain_size(sealed_size, self.chunk_size)
+        self.chunks = max(1, -(-(sealed_size - HEADER.size) // (self.chunk_size + TAG_SIZE)))
+        self._position = 0
+        self._ahead: Dict[int, Future] = {}
+        self._next = 0
+        self._current: Tuple[int, bytes] = (-1, b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self.size}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def _chunk(self, index: int) -> bytes:
+        if self._current[0] == index:
+            return self._current[1]
+        if index not in self._ahead:
+            for future in self._ahead.values():
+                future.cancel()
+            self._ahead, self._next = {}, index
+        while self._next < min(index + self.window, self.chunks):
+            final = self._next == self.chunks - 1
+            self.file.seek(HEADER.size + self._next * (self.chunk_size + TAG_SIZE))
+            sealed = self.file.read(self.chunk_size + TAG_SIZE)
+            self._ahead[self._next] = _run(self.executor, open_chunk, self._data_key, self._next, final, sealed)
+            self._next += 1
+        self._current = (index, self._ahead.pop(index).result())
+        return self._current[1]
+
+    def readinto(self, buffer) -> int:
+        if self._position >= self.size:
+            return 0
+        index, offset = divmod(self._position, self.chunk_size)
+        data = self._chunk(index)
+        count = min(len(buffer), len(data) - offset)
+        buffer[:count] = data[offset:offset + count]
+        self._position += count
+        return count
+
+    def close(self) -> None:
+        for future in self._ahead.values():
+            future.cancel()
+        self._ahead = {}
+        self.file.close()
+        super().close()